@@ -0,0 +1,1027 @@
+# Benchmarks e testes de carga da enquete.
+#
+# Cada comando roda em um diretório temporário com um enquete.db novo, usando
+# as mesmas funções de c.py que a aplicação Streamlit usa. As comparações com o
+# código antigo usam um legado.db separado, com o esquema original (tokens em TEXT).
+#
+# Uso:
+#   python benchmark.py votos --tokens 2000 --threads 16 --repeticoes 3
+#   python benchmark.py tokens --quantidades 10000 100000 1000000
+#   python benchmark.py exportacao --linhas 1000000
+#   python benchmark.py armazenamento --tokens 1000000
+#   python benchmark.py enquetes --votos 500 --carga 200000
+#   python benchmark.py inicializacao --repeticoes 5
+#   python benchmark.py graficos --renderizacoes 500
+#   python benchmark.py linha-do-tempo --votos 1000000 --horas 72
+#   python benchmark.py rodadas --tokens 1000000
+#   python benchmark.py intervalos --votos 10000 1000000 10000000
+#   python benchmark.py diario --votos 5000 --threads 16 --registros 1000000
+#   python benchmark.py publico --sessoes 50 --rodadas 20
+#   python benchmark.py carga --tokens 5000 --processos 4 --threads 8 --salvar-base base.json
+#   python benchmark.py carga --tokens 200 --modo apptest --processos 4 --comparar-base base.json
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+
+
+# Prepara um diretório temporário e importa c.py apontando para ele
+def preparar_ambiente():
+    diretorio = tempfile.mkdtemp(prefix='enquete-bench-')
+    os.chdir(diretorio)
+    import c
+    c.obter_pool()  # abre o banco e aplica as migrações
+    return c
+
+
+# Esquema original do enquete.db, antes das migrações
+ESQUEMA_LEGADO = '''
+CREATE TABLE tokens (
+    token TEXT PRIMARY KEY,
+    usado_intencao BOOLEAN NOT NULL DEFAULT FALSE,
+    usado_rejeicao BOOLEAN NOT NULL DEFAULT FALSE
+);
+CREATE TABLE intencao_voto (id INTEGER PRIMARY KEY AUTOINCREMENT, candidato TEXT NOT NULL, token TEXT NOT NULL);
+CREATE TABLE rejeicao (id INTEGER PRIMARY KEY AUTOINCREMENT, candidato TEXT NOT NULL, token TEXT NOT NULL);
+CREATE INDEX idx_intencao_voto_candidato ON intencao_voto (candidato);
+CREATE INDEX idx_rejeicao_candidato ON rejeicao (candidato);
+CREATE INDEX idx_intencao_voto_token ON intencao_voto (token);
+CREATE INDEX idx_rejeicao_token ON rejeicao (token);
+'''
+
+
+# Cria o legado.db com o esquema original e copia os tokens do enquete.db em texto
+def criar_banco_legado(c):
+    if os.path.exists('legado.db'):
+        os.remove('legado.db')
+    conn = sqlite3.connect('legado.db')
+    conn.executescript(ESQUEMA_LEGADO)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.close()
+    with c.conectar_banco() as conn:
+        conn.execute("ATTACH DATABASE 'legado.db' AS legado")
+        conn.execute('BEGIN')
+        conn.execute('''
+            INSERT INTO legado.tokens (token, usado_intencao, usado_rejeicao)
+            SELECT uuid_texto(token), usado_intencao, usado_rejeicao FROM main.tokens ORDER BY id
+        ''')
+        conn.execute('COMMIT')
+        conn.execute('DETACH DATABASE legado')
+
+
+# Lê os tokens do enquete.db no formato do link
+def listar_tokens(c):
+    with c.conectar_banco() as conn:
+        return [linha[0] for linha in conn.execute('SELECT uuid_texto(token) FROM tokens ORDER BY id')]
+
+
+# Dispara as tarefas em várias threads ao mesmo tempo e mede o tempo total
+def executar_concorrente(tarefas, funcao, threads):
+    fila = list(tarefas)
+    trava = threading.Lock()
+    barreira = threading.Barrier(threads)
+    resultados = []
+
+    def trabalhador():
+        barreira.wait()
+        while True:
+            with trava:
+                if not fila:
+                    return
+                tarefa = fila.pop()
+            resultado = funcao(*tarefa)
+            with trava:
+                resultados.append(resultado)
+
+    workers = [threading.Thread(target=trabalhador) for _ in range(threads)]
+    inicio = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return resultados, time.perf_counter() - inicio
+
+
+# Caminho antigo: INSERT e UPDATE em commits separados, sem checar o token
+def voto_legado(candidato, token):
+    conn = sqlite3.connect('legado.db', timeout=30)
+    usado = conn.execute('SELECT usado_intencao FROM tokens WHERE token = ?', (token,)).fetchone()[0]
+    if not usado:
+        conn.execute('INSERT INTO intencao_voto (candidato, token) VALUES (?, ?)', (candidato, token))
+        conn.commit()
+        conn.execute('UPDATE tokens SET usado_intencao = TRUE WHERE token = ?', (token,))
+        conn.commit()
+    conn.close()
+    return not usado
+
+
+# Conta quantos tokens receberam mais de um voto de intenção
+def contar_votos_duplicados(banco, coluna_token):
+    conn = sqlite3.connect(banco)
+    duplicados = conn.execute(f'''
+        SELECT COUNT(*) FROM (
+            SELECT {coluna_token} FROM intencao_voto GROUP BY {coluna_token} HAVING COUNT(*) > 1
+        )
+    ''').fetchone()[0]
+    total = conn.execute('SELECT COUNT(*) FROM intencao_voto').fetchone()[0]
+    conn.close()
+    return duplicados, total
+
+
+# Envia cada token várias vezes ao mesmo tempo (cliques repetidos no mesmo link)
+def benchmark_votos(args):
+    c = preparar_ambiente()
+    c.criar_tokens(args.tokens)
+    criar_banco_legado(c)
+    tokens = listar_tokens(c)
+
+    tarefas = [('Prof Eudes', t) for t in tokens for _ in range(args.repeticoes)]
+    # O banco novo guarda o id do candidato, o antigo o nome
+    ids_candidatos = {nome: id_ for id_, nome in c.candidatos_da_pergunta('intencao').items()}
+    caminhos = (
+        ('legado (2 commits)', voto_legado, 'legado.db', 'token'),
+        ('registrar_voto', lambda candidato, token: c.registrar_voto('intencao', ids_candidatos[candidato], token),
+         'enquete.db', 'token_id'),
+    )
+
+    print(f'{args.tokens} tokens x {args.repeticoes} envios, {args.threads} threads')
+    for nome, funcao, banco, coluna_token in caminhos:
+        resultados, duracao = executar_concorrente(tarefas, funcao, args.threads)
+        duplicados, total = contar_votos_duplicados(banco, coluna_token)
+        aceitos = sum(1 for r in resultados if r)
+        print(f'{nome:>20}: {total / duracao:8.1f} votos/s gravados, {aceitos} aceitos, '
+              f'{total} linhas, {duplicados} tokens com voto duplicado')
+        if nome == 'registrar_voto':
+            fila = c.obter_fila_votos().metricas()
+            print(f'{"":>20}  {fila["lotes"]} lotes, média de {fila["media_lote"]:.1f} votos por COMMIT, '
+                  f'maior lote {fila["maior_lote"]}')
+            assert duplicados == 0 and total == args.tokens, 'registrar_voto aceitou voto duplicado'
+
+
+# Caminho antigo: um INSERT por uuid4, todos na mesma transação
+def tokens_legado(quantidade):
+    conn = sqlite3.connect('legado.db')
+    cursor = conn.cursor()
+    for _ in range(quantidade):
+        cursor.execute('INSERT INTO tokens (token) VALUES (?)', (str(uuid.uuid4()),))
+    conn.commit()
+    conn.close()
+
+
+# Mede tokens/segundo da criação em massa para cada quantidade pedida
+def benchmark_tokens(args):
+    c = preparar_ambiente()
+    criar_banco_legado(c)
+    print(f'{"quantidade":>10} {"legado":>14} {"criar_tokens":>14}')
+    for quantidade in args.quantidades:
+        legado = '-'
+        if quantidade <= args.limite_legado:
+            inicio = time.perf_counter()
+            tokens_legado(quantidade)
+            legado = f'{quantidade / (time.perf_counter() - inicio):,.0f}/s'
+        inicio = time.perf_counter()
+        c.criar_tokens(quantidade)
+        novo = f'{quantidade / (time.perf_counter() - inicio):,.0f}/s'
+        print(f'{quantidade:>10} {legado:>14} {novo:>14}')
+
+
+# Caminho antigo: DataFrame completo e arquivo inteiro em um BytesIO
+def exportacao_legada(formato):
+    from io import BytesIO
+    import pandas as pd
+
+    conn = sqlite3.connect('legado.db')
+    df = pd.read_sql_query('SELECT * FROM tokens', conn)
+    conn.close()
+    if formato == 'Excel':
+        saida = BytesIO()
+        with pd.ExcelWriter(saida, engine='xlsxwriter') as writer:
+            df.to_excel(writer, index=False)
+        return saida.getvalue()
+    return df.to_csv(index=False).encode('utf-8')
+
+
+# Roda a exportação em um processo filho e devolve (segundos, pico de RSS acima do início em MB)
+def medir_em_processo(funcao, *args):
+    def filho(fila):
+        inicio_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        inicio = time.perf_counter()
+        funcao(*args)
+        duracao = time.perf_counter() - inicio
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        fila.put((duracao, (pico - inicio_rss) / 1024))
+
+    contexto = multiprocessing.get_context('fork')
+    fila = contexto.Queue()
+    processo = contexto.Process(target=filho, args=(fila,))
+    processo.start()
+    resultado = fila.get()
+    processo.join()
+    return resultado
+
+
+# Mede tempo e pico de memória das exportações da tabela de tokens
+def benchmark_exportacao(args):
+    c = preparar_ambiente()
+    c.criar_tokens(args.linhas)
+    if not args.sem_legado:
+        criar_banco_legado(c)
+    print(f'{args.linhas} tokens')
+    print(f'{"formato":>16} {"legado":>22} {"gerar_exportacao":>22}')
+    for formato in c.FORMATOS_EXPORTACAO:
+        legado = '-'
+        if formato in ('Excel', 'CSV') and not args.sem_legado:
+            duracao, memoria = medir_em_processo(exportacao_legada, formato)
+            legado = f'{duracao:6.1f}s {memoria:8.1f} MB'
+        duracao, memoria = medir_em_processo(c.gerar_exportacao, 'tokens', formato)
+        print(f'{formato:>16} {legado:>22} {f"{duracao:6.1f}s {memoria:8.1f} MB":>22}')
+
+
+# Tamanho dos arquivos e velocidade de busca por token: esquema original (TEXT)
+# contra tokens em BLOB de 16 bytes (WITHOUT ROWID) e votos com token_id inteiro
+def benchmark_armazenamento(args):
+    c = preparar_ambiente()
+    c.criar_tokens(args.tokens)
+    # Metade dos tokens votou na intenção e um quarto na rejeição, nos dois bancos
+    with c.transacao() as conn:
+        conn.execute("UPDATE tokens SET usado_intencao = TRUE WHERE id % 2 = 0")
+        conn.execute("UPDATE tokens SET usado_rejeicao = TRUE WHERE id % 4 = 0")
+        conn.execute('''
+            INSERT INTO intencao_voto (candidato_id, token_id)
+            SELECT (SELECT id FROM candidatos WHERE nome = 'Prof Eudes'), id FROM tokens WHERE id % 2 = 0
+        ''')
+        conn.execute('''
+            INSERT INTO rejeicao (candidato_id, token_id)
+            SELECT (SELECT id FROM candidatos WHERE nome = 'Fabio de Paula'), id FROM tokens WHERE id % 4 = 0
+        ''')
+    criar_banco_legado(c)
+    with c.conectar_banco() as conn:
+        conn.execute("ATTACH DATABASE 'legado.db' AS legado")
+        conn.execute('BEGIN')
+        conn.execute('''
+            INSERT INTO legado.intencao_voto (candidato, token)
+            SELECT 'Prof Eudes', uuid_texto(token) FROM main.tokens WHERE id % 2 = 0
+        ''')
+        conn.execute('''
+            INSERT INTO legado.rejeicao (candidato, token)
+            SELECT 'Fabio de Paula', uuid_texto(token) FROM main.tokens WHERE id % 4 = 0
+        ''')
+        conn.execute('COMMIT')
+        conn.execute('DETACH DATABASE legado')
+
+    amostra = random.sample(listar_tokens(c), min(args.buscas, args.tokens))
+    print(f'{args.tokens} tokens, {len(amostra)} buscas aleatórias por token')
+    print(f'{"esquema":>16} {"arquivo":>12} {"buscas/s":>12}')
+    for nome, banco, converter in (('TEXT (original)', 'legado.db', lambda token: token),
+                                   ('BLOB 16 bytes', 'enquete.db', c.token_para_bytes)):
+        conn = c.abrir_conexao(banco)
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('VACUUM')
+        tamanho = os.path.getsize(banco) / 1024 / 1024
+        inicio = time.perf_counter()
+        for token in amostra:
+            conn.execute('SELECT usado_intencao, usado_rejeicao FROM tokens WHERE token = ?', (converter(token),)).fetchone()
+        taxa = len(amostra) / (time.perf_counter() - inicio)
+        conn.close()
+        print(f'{nome:>16} {tamanho:>9.1f} MB {taxa:>12,.0f}')
+
+
+# Latência dos votos de uma enquete enquanto outra enquete cria tokens em massa
+# (transações longas de escrita): com as duas no mesmo banco os votos esperam a
+# trava de escrita; com um banco por enquete não há disputa.
+def benchmark_enquetes(args):
+    c = preparar_ambiente()
+    outra = c.criar_enquete('outra', 'Outra enquete', c.PERGUNTA_INTENCAO_PADRAO, c.PERGUNTA_REJEICAO_PADRAO)
+    c.criar_tokens(2 * args.votos)
+    tokens = listar_tokens(c)
+    candidato = next(iter(c.candidatos_da_pergunta('intencao')))
+
+    print(f'{args.votos} votos em sequência durante a criação de {args.carga} tokens')
+    print(f'{"carga em":>18} {"p50":>9} {"p99":>9} {"máximo":>9}')
+    for nome, enquete_carga, lote in (('mesmo banco', None, tokens[:args.votos]),
+                                      ('outro banco', outra, tokens[args.votos:])):
+        def carga():
+            with c.usar_enquete(enquete_carga):
+                c.criar_tokens(args.carga)
+
+        tarefa = threading.Thread(target=carga)
+        tarefa.start()
+        latencias = []
+        for token in lote:
+            inicio = time.perf_counter()
+            c.registrar_voto('intencao', candidato, token)
+            latencias.append(time.perf_counter() - inicio)
+        tarefa.join()
+        latencias.sort()
+        p50, p99 = latencias[len(latencias) // 2], latencias[int(len(latencias) * 0.99)]
+        print(f'{nome:>18} {p50 * 1000:>7.2f}ms {p99 * 1000:>7.2f}ms {latencias[-1] * 1000:>7.2f}ms')
+
+
+# Dependências cujo custo de importação é medido, cada uma em um processo novo
+MODULOS_INICIALIZACAO = ('streamlit', 'pandas', 'plotly.express', 'numpy', 'sqlite3', 'uuid')
+
+# Processo filho: abre a página do eleitor pelo AppTest e mede até o formulário aparecer
+SCRIPT_PRIMEIRO_FORMULARIO = '''
+import sys, time
+inicio = time.perf_counter()
+sys.path.insert(0, {diretorio!r})  # como o streamlit run faz; o AppTest não faz
+{previo}
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.query_params['token'] = {token!r}
+at.run()
+assert not at.exception and len(at.radio) == 2, 'formulário não apareceu'
+print(time.perf_counter() - inicio, 'pandas' in sys.modules, 'plotly.express' in sys.modules)
+'''
+
+
+# Custo acumulado (em segundos) de `import modulo` segundo python -X importtime
+def custo_importacao(modulo):
+    saida = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+                           capture_output=True, text=True, check=True).stderr
+    for linha in reversed(saida.splitlines()):
+        partes = [parte.strip() for parte in linha.split('|')]
+        if len(partes) == 3 and partes[2] == modulo:
+            return int(partes[1]) / 1e6
+    return 0.0
+
+
+# Custo de cada importação e tempo até o primeiro formulário de voto em um processo
+# novo, com pandas/plotly importados antes (como era no topo de c.py) e sob demanda
+def benchmark_inicializacao(args):
+    c = preparar_ambiente()
+    c.criar_tokens(2 * args.repeticoes)
+    tokens = listar_tokens(c)
+    diretorio = os.path.dirname(os.path.abspath(__file__))
+    app = os.path.join(diretorio, 'c.py')
+
+    print(f'{"importação":>16} {"tempo":>9}')
+    for modulo in MODULOS_INICIALIZACAO:
+        print(f'{modulo:>16} {custo_importacao(modulo) * 1000:>7.1f}ms')
+
+    print(f'\ntempo até o primeiro formulário (mediana de {args.repeticoes} processos)')
+    casos = (('importação antecipada', 'import pandas, plotly.express'), ('sob demanda', ''))
+    for (nome, previo), lote in zip(casos, (tokens[:args.repeticoes], tokens[args.repeticoes:])):
+        tempos = []
+        for token in lote:
+            script = SCRIPT_PRIMEIRO_FORMULARIO.format(diretorio=diretorio, previo=previo, app=app, token=token)
+            saida = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+            tempo, pandas, plotly = saida.split()[-3:]
+            tempos.append(float(tempo))
+        print(f'{nome:>22} {statistics.median(tempos) * 1000:>8.0f}ms  pandas carregado: {pandas}, plotly.express: {plotly}')
+
+
+# Caminho antigo do gráfico: DataFrame com o placar entregue ao plotly.express
+def grafico_legado(linhas):
+    import pandas as pd
+    import plotly.express as px
+
+    df = pd.DataFrame(linhas, columns=['candidato', 'votos'])
+    fig = px.pie(df, names='candidato', values='votos', hole=0.4, title=f'Intenção de Voto ({df["votos"].sum()} participantes)')
+    fig.update_traces(textposition='inside', textinfo='percent+label')
+    fig.update_layout(showlegend=False)
+    return fig
+
+
+# Tempo de CPU e pico de memória por gráfico montado (e serializado como o
+# st.plotly_chart faz), sem o cache de resultados
+def benchmark_graficos(args):
+    c = preparar_ambiente()
+    import plotly.io as pio
+
+    linhas = [(nome, random.randint(1, 5000)) for nome in c.candidatos_da_pergunta('intencao').values()]
+    caminhos = (
+        ('px.pie + DataFrame', lambda: grafico_legado(linhas)),
+        ('go.Pie direto', lambda: c.montar_grafico_rosca('Intenção de Voto', dict(linhas))),
+    )
+    print(f'{args.renderizacoes} gráficos de {len(linhas)} candidatos')
+    print(f'{"caminho":>20} {"montar":>10} {"+ JSON":>10} {"pico":>10}')
+    for nome, montar in caminhos:
+        pio.to_json(montar(), validate=False)  # importações e caches do plotly fora da medida
+        inicio = time.process_time()
+        for _ in range(args.renderizacoes):
+            montar()
+        tempo_montar = (time.process_time() - inicio) / args.renderizacoes
+        inicio = time.process_time()
+        for _ in range(args.renderizacoes):
+            pio.to_json(montar(), validate=False)
+        tempo_json = (time.process_time() - inicio) / args.renderizacoes
+        tracemalloc.start()
+        montar()
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{nome:>20} {tempo_montar * 1000:>8.2f}ms {tempo_json * 1000:>8.2f}ms {pico / 1024:>7.0f} KiB')
+
+
+# Linha do tempo por hora calculada direto da tabela de votos (sem os resumos)
+def linha_do_tempo_legada(c, tipo):
+    tabela = c.TIPOS_VOTO[tipo][0]
+    with c.conectar_banco() as conn:
+        return tuple(conn.execute(f'''
+            SELECT v.registrado_em - v.registrado_em % 3600, c.nome, COUNT(*) FROM {tabela} v
+            JOIN candidatos c ON c.id = v.candidato_id
+            WHERE v.registrado_em IS NOT NULL
+            GROUP BY 1, v.candidato_id ORDER BY 1, c.ordem, c.id
+        '''))
+
+
+# Leitura da linha do tempo (GROUP BY nos votos x resumo por hora) e o custo de manter
+# os resumos a cada voto gravado
+def benchmark_linha_do_tempo(args):
+    c = preparar_ambiente()
+    candidatos = list(c.candidatos_da_pergunta('intencao'))
+    fim = int(time.time())
+    inicio = fim - args.horas * 3600
+    with c.transacao() as conn:
+        conn.executemany('INSERT INTO intencao_voto (candidato_id, registrado_em) VALUES (?, ?)',
+                         ((random.choice(candidatos), random.randint(inicio, fim)) for _ in range(args.votos)))
+    c.preencher_linha_do_tempo()  # resumos a partir dos votos inseridos acima
+
+    print(f'{args.votos} votos em {args.horas} horas, {args.leituras} leituras da linha do tempo por hora')
+    print(f'{"caminho":>22} {"consulta":>10} {"+ gráficos":>11} {"linhas":>8}')
+    for nome, consultar in (('GROUP BY nos votos', lambda: linha_do_tempo_legada(c, 'intencao')),
+                            ('resumo por hora', lambda: c.consultar_linha_do_tempo('intencao', 'hora'))):
+        linhas = consultar()
+        assert linhas == linha_do_tempo_legada(c, 'intencao'), 'resumo diverge dos votos'
+        inicio_medida = time.perf_counter()
+        for _ in range(args.leituras):
+            consultar()
+        tempo_consulta = (time.perf_counter() - inicio_medida) / args.leituras
+        inicio_medida = time.perf_counter()
+        for _ in range(args.leituras):
+            c.montar_graficos_linha_do_tempo('Intenção de Voto', consultar(), 'hora')
+        tempo_total = (time.perf_counter() - inicio_medida) / args.leituras
+        print(f'{nome:>22} {tempo_consulta * 1000:>8.2f}ms {tempo_total * 1000:>9.2f}ms {len(linhas):>8}')
+
+    # Gravação: o mesmo lote de votos com e sem os resumos por minuto/hora
+    c.criar_tokens(2 * args.gravacoes)
+    tokens = listar_tokens(c)
+    resumos = c.LINHAS_DO_TEMPO
+    print(f'\n{args.gravacoes} votos gravados em uma transação')
+    for nome, linhas_do_tempo, lote in (('sem resumos', {}, tokens[:args.gravacoes]),
+                                        ('com resumos', resumos, tokens[args.gravacoes:])):
+        c.LINHAS_DO_TEMPO = linhas_do_tempo
+        inicio_medida = time.perf_counter()
+        with c.transacao() as conn:
+            cursor = conn.cursor()
+            for token in lote:
+                c.gravar_voto(cursor, 'rejeicao', candidatos[0], token)
+        duracao = time.perf_counter() - inicio_medida
+        print(f'{nome:>22} {duracao / len(lote) * 1e6:>8.1f}µs por voto')
+    c.LINHAS_DO_TEMPO = resumos
+
+
+# Marca metade dos tokens como usados na rodada atual, com um voto de intenção cada
+def preencher_rodada(c):
+    with c.transacao() as conn:
+        conn.execute(f'UPDATE tokens SET usado_intencao = {c.RODADA_TOKENS} WHERE id % 2 = 0')
+        conn.execute(f'''
+            INSERT INTO intencao_voto (candidato_id, token_id, rodada)
+            SELECT 1, id, {c.rodada_atual('rodada_intencao')} FROM tokens WHERE id % 2 = 0
+        ''')
+    c.reconstruir_placar('intencao')
+
+
+# Como zerar_tokens e zerar_intencao_votos funcionavam antes das rodadas
+def zerar_legado(c):
+    with c.transacao() as conn:
+        conn.execute('UPDATE tokens SET usado_intencao = FALSE, usado_rejeicao = FALSE')
+    with c.transacao() as conn:
+        conn.execute('DELETE FROM intencao_voto')
+        conn.execute('DELETE FROM placar_intencao')
+
+
+# Zerar tokens e votos com UPDATE/DELETE na tabela inteira x nova rodada com limpeza em
+# segundo plano, medindo a latência dos votos que chegam enquanto isso
+def benchmark_rodadas(args):
+    c = preparar_ambiente()
+    c.criar_tokens(args.tokens)
+    tokens = listar_tokens(c)
+    livres = iter(tokens[0::2])  # ids ímpares: nunca marcados por preencher_rodada
+    limpeza = c.obter_limpeza_rodadas()
+
+    def zerar_rodada():
+        execucoes = limpeza.metricas()['execucoes']
+        c.zerar_tokens()
+        c.zerar_intencao_votos()
+        while limpeza.metricas()['execucoes'] <= execucoes:
+            time.sleep(0.01)
+
+    print(f'{args.tokens} tokens, {args.tokens // 2} votos apagados a cada vez')
+    print(f'{"caminho":>22} {"zerar":>9} {"até limpar":>11} {"votos":>6} {"p99 voto":>10} {"maior":>10} {"WAL":>9}')
+    for nome, zerar, limpar in (('UPDATE/DELETE (antigo)', lambda: zerar_legado(c), None),
+                                ('nova rodada', lambda: (c.zerar_tokens(), c.zerar_intencao_votos()), zerar_rodada)):
+        preencher_rodada(c)
+        with c.conectar_banco() as conn:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        # Um eleitor votando sem parar enquanto o banco é zerado
+        latencias, terminou = [], threading.Event()
+
+        def eleitor():
+            while not terminou.is_set():
+                inicio = time.perf_counter()
+                c.registrar_voto('rejeicao', 1, next(livres))
+                latencias.append(time.perf_counter() - inicio)
+
+        votando = threading.Thread(target=eleitor)
+        votando.start()
+        time.sleep(0.2)
+        inicio = time.perf_counter()
+        zerar()
+        duracao_zerar = time.perf_counter() - inicio
+        if limpar is not None:
+            limpar()
+        duracao_total = time.perf_counter() - inicio
+        terminou.set()
+        votando.join()
+        latencias.sort()
+        wal = os.path.getsize('enquete.db-wal') / 1024 / 1024
+        print(f'{nome:>22} {duracao_zerar * 1000:>7.1f}ms {duracao_total * 1000:>9.1f}ms {len(latencias):>6} '
+              f'{percentil(latencias, 0.99) * 1000:>8.2f}ms {latencias[-1] * 1000:>8.2f}ms {wal:>6.1f} MB')
+
+
+# Bootstrap sorteando os votos um a um (com os votos expandidos em um array), para comparar
+def bootstrap_por_voto(votos, reamostragens, sorteio):
+    import numpy as np
+
+    votos_um_a_um = np.repeat(np.arange(len(votos)), votos)
+    amostras = np.stack([np.bincount(sorteio.choice(votos_um_a_um, len(votos_um_a_um)), minlength=len(votos))
+                         for _ in range(reamostragens)]) / len(votos_um_a_um)
+    return np.quantile(amostras, [0.025, 0.975], axis=0)
+
+
+# Tempo de cada intervalo de confiança calculado a partir dos totais, para placares de
+# tamanhos diferentes; o bootstrap por voto entra só como referência, com poucas reamostragens
+def benchmark_intervalos(args):
+    import numpy as np
+    import estatisticas
+
+    pesos = np.random.default_rng(args.semente).dirichlet(np.ones(args.candidatos))
+    metodos = (
+        ('Wilson', estatisticas.intervalos_wilson),
+        ('Goodman', estatisticas.intervalos_goodman),
+        (f'bootstrap ({estatisticas.REAMOSTRAGENS_PADRAO})', estatisticas.intervalos_bootstrap),
+        ('tudo (calcular_intervalos)', estatisticas.calcular_intervalos),
+    )
+    print(f'{args.candidatos} candidatos, média de {args.repeticoes} repetições')
+    print(f'{"método":>28} ' + ' '.join(f'{votos:>12,}' for votos in args.votos))
+    for nome, calcular in metodos:
+        tempos = []
+        for total in args.votos:
+            votos = np.random.default_rng(args.semente).multinomial(total, pesos)
+            calcular(votos)
+            inicio = time.perf_counter()
+            for _ in range(args.repeticoes):
+                calcular(votos)
+            tempos.append((time.perf_counter() - inicio) / args.repeticoes)
+        print(f'{nome:>28} ' + ' '.join(f'{tempo * 1000:>10.3f}ms' for tempo in tempos))
+
+    total = max(args.votos)
+    votos = np.random.default_rng(args.semente).multinomial(total, pesos)
+    inicio = time.perf_counter()
+    bootstrap_por_voto(votos, args.reamostragens_por_voto, np.random.default_rng(args.semente))
+    tempo = time.perf_counter() - inicio
+    print(f'\nbootstrap sorteando os votos um a um, {total:,} votos: {tempo / args.reamostragens_por_voto * 1000:.2f}ms '
+          f'por reamostragem ({tempo * estatisticas.REAMOSTRAGENS_PADRAO / args.reamostragens_por_voto:.1f}s para '
+          f'{estatisticas.REAMOSTRAGENS_PADRAO})')
+
+
+# Custo do diário de votos na gravação (mesmos votos com e sem diário, em enquetes
+# separadas) e os totais lidos do diário (inteiro, instantâneo + cauda, NumPy sobre o
+# mmap) comparados com o GROUP BY nos votos do banco
+def benchmark_diario(args):
+    import diario
+
+    c = preparar_ambiente()
+    outra = c.criar_enquete('outra', 'Outra enquete', c.PERGUNTA_INTENCAO_PADRAO, c.PERGUNTA_REJEICAO_PADRAO)
+    candidatos = list(c.candidatos_da_pergunta('intencao'))
+
+    print(f'{args.votos} votos, {args.threads} threads')
+    print(f'{"caminho":>12} {"votos/s":>9} {"p50":>9} {"p99":>9} {"lotes":>6} {"fsyncs do diário":>17}')
+    for nome, enquete, com_diario in (('sem diário', None, False), ('com diário', outra, True)):
+        c.DIARIO_VOTOS = com_diario
+        with c.usar_enquete(enquete):
+            c.criar_tokens(args.votos)
+            tokens = listar_tokens(c)
+            fila = c.obter_fila_votos()
+
+        def votar(candidato, token):
+            with c.usar_enquete(enquete):
+                inicio = time.perf_counter()
+                c.registrar_voto('intencao', candidato, token)
+                return time.perf_counter() - inicio
+
+        latencias, duracao = executar_concorrente([(random.choice(candidatos), t) for t in tokens], votar, args.threads)
+        latencias.sort()
+        with c.usar_enquete(enquete):
+            fsyncs = c.obter_diario().metricas()['escritas'] if com_diario else 0
+        print(f'{nome:>12} {len(latencias) / duracao:>9.1f} {percentil(latencias, 0.5) * 1000:>7.2f}ms '
+              f'{percentil(latencias, 0.99) * 1000:>7.2f}ms {fila.metricas()["lotes"]:>6} {fsyncs:>17}')
+
+    # Leitura: os mesmos votos no banco e em um diário gerado à parte
+    caminho = 'leitura.diario'
+    momento = int(time.time())
+    escolhidos = [random.choice(candidatos) for _ in range(args.registros)]
+    with c.transacao() as conn:
+        conn.executemany('INSERT INTO intencao_voto (candidato_id, registrado_em, rodada) VALUES (?, ?, 1)',
+                         ((candidato, momento) for candidato in escolhidos))
+    gravador = diario.Diario(caminho, registros_por_instantaneo=2 * args.registros)  # instantâneo só o manual
+    for inicio in range(0, args.registros, 10000):
+        gravador.acrescentar([diario.registro_de_voto('intencao', candidato, uuid.uuid4().bytes, momento, 1, 1)
+                              for candidato in escolhidos[inicio:inicio + 10000]])
+    diario.salvar_instantaneo(caminho)
+    gravador.acrescentar([diario.registro_de_voto('intencao', candidato, uuid.uuid4().bytes, momento, 1, 1)
+                          for candidato in escolhidos[:args.cauda]])
+    esperado = collections.Counter(escolhidos) + collections.Counter(escolhidos[:args.cauda])
+
+    def contar_no_diario_numpy():
+        with diario.LeitorDiario(caminho) as leitor:
+            registros = leitor.como_array()
+            totais = diario.contar_votos(registros, 'intencao', 1)
+            del registros
+        return totais
+
+    def contar_no_banco():
+        with c.conectar_banco() as conn:
+            return dict(conn.execute('SELECT candidato_id, COUNT(*) FROM intencao_voto WHERE rodada = 1 GROUP BY candidato_id'))
+
+    print(f'\n{args.registros} votos no banco e no diário, cauda de {args.cauda} registros após o instantâneo')
+    print(f'{"caminho":>28} {"tempo":>10}')
+    for nome, contar in (('GROUP BY no banco', contar_no_banco),
+                         ('diário inteiro', lambda: diario.totais(diario.repetir(caminho), 'intencao')),
+                         ('instantâneo + cauda', lambda: diario.totais(diario.totais_atuais(caminho), 'intencao')),
+                         ('NumPy sobre o mmap', contar_no_diario_numpy)):
+        inicio = time.perf_counter()
+        totais = contar()
+        duracao = time.perf_counter() - inicio
+        if nome != 'GROUP BY no banco':
+            assert totais == esperado, f'{nome}: totais divergem dos registros gravados'
+        print(f'{nome:>28} {duracao * 1000:>8.1f}ms')
+
+
+# Cache de resultados como era antes do single-flight: toda sessão que encontra o valor
+# vencido calcula de novo
+def cache_sem_coalescer(c):
+    class CacheSemCoalescer(c.CacheResultados):
+        def obter(self, tabela, chave, calcular):
+            agora = time.monotonic()
+            with self._trava:
+                versao = self._versoes.get(tabela, 0)
+                item = self._valores.get((tabela, chave))
+                if item is not None and item[0] == versao and item[1] > agora:
+                    self.acertos += 1
+                    return item[2]
+                self.falhas += 1
+            valor = calcular()
+            with self._trava:
+                self._valores[(tabela, chave)] = (versao, agora + self.ttl, valor)
+            return valor
+
+    return CacheSemCoalescer()
+
+
+# Página pública sob rajada: várias sessões pedem os gráficos ao mesmo tempo logo depois
+# de um voto novo (versão das tabelas alterada), com e sem o single-flight no cache; e
+# quantos acessos de um robô que abre uma sessão nova a cada recarga passam pelos limites
+def benchmark_publico(args):
+    c = preparar_ambiente()
+    c.criar_tokens(args.votos)
+    candidatos = {tipo: list(c.candidatos_da_pergunta(tipo)) for tipo in c.TIPOS_VOTO}
+    for token in listar_tokens(c):
+        for tipo in c.TIPOS_VOTO:
+            c.registrar_voto(tipo, random.choice(candidatos[tipo]), token)
+
+    for tipo in c.TIPOS_VOTO:
+        c.GRAFICOS[tipo](None)  # importações do plotly e do NumPy fora da medida
+
+    print(f'{args.sessoes} sessões pedindo os dois gráficos juntas, {args.rodadas} votos novos')
+    print(f'{"cache":>14} {"cálculos":>9} {"compartilhados":>15} {"p50":>9} {"p99":>9} {"total":>9}')
+    for nome, cache in (('sem coalescer', cache_sem_coalescer(c)), ('single-flight', c.CacheResultados())):
+        c.obter_cache_resultados = lambda: cache
+        latencias = []
+        inicio_total = time.perf_counter()
+        for _ in range(args.rodadas):
+            cache.invalidar('intencao_voto', 'rejeicao')
+
+            def sessao(_):
+                inicio = time.perf_counter()
+                for tipo in ('intencao', 'rejeicao'):
+                    c.GRAFICOS[tipo](None)
+                return time.perf_counter() - inicio
+
+            resultados, _ = executar_concorrente([(i,) for i in range(args.sessoes)], sessao, args.sessoes)
+            latencias.extend(resultados)
+        duracao = time.perf_counter() - inicio_total
+        latencias.sort()
+        metricas = cache.metricas()
+        print(f'{nome:>14} {metricas["falhas"]:>9} {metricas.get("coalescidas", 0):>15} '
+              f'{percentil(latencias, 0.5) * 1000:>7.2f}ms {percentil(latencias, 0.99) * 1000:>7.2f}ms {duracao:>8.2f}s')
+
+    # Um robô recarregando a página pública a cada `intervalo` segundos, com uma sessão
+    # nova do Streamlit a cada recarga, enquanto um visitante comum recarrega uma vez por
+    # segundo e chega um voto novo por segundo: atrás de um proxy confiável (IP conhecido)
+    # e sem proxy (sem IP). Cada acesso liberado monta os dois gráficos pelo cache com
+    # single-flight; "cálculos" são as falhas do cache, as únicas que chegam ao banco.
+    print(f'\nrobô com {args.robo_por_segundo} acessos/s por {args.robo_segundos}s, uma sessão nova por acesso')
+    print(f'{"cliente":>8} {"robô liberado":>15} {"visitante liberado":>19} {"cálculos":>9}')
+    intervalo = 1 / args.robo_por_segundo
+    for nome, ip_robo, ip_visitante in (('com IP', '203.0.113.7', '198.51.100.4'), ('sem IP', None, None)):
+        limitadores = {'sessao': c.LimitadorTaxa(*c.LIMITE_PUBLICO_SESSAO), 'ip': c.LimitadorTaxa(*c.LIMITE_PUBLICO_IP)}
+        c.obter_limitadores_publicos = lambda: limitadores
+        cache = c.CacheResultados()
+        c.obter_cache_resultados = lambda: cache
+
+        def acessar(ip):
+            c.identificar_cliente = lambda: (str(uuid.uuid4()), ip)
+            if not c.liberar_resultados_publicos():
+                return False
+            for tipo in ('intencao', 'rejeicao'):
+                c.GRAFICOS[tipo](None)
+            return True
+
+        robo = [0, 0]
+        visitante = [0, 0]
+        proxima_visita = time.monotonic()
+        fim = proxima_visita + args.robo_segundos
+        while time.monotonic() < fim:
+            robo[0] += acessar(ip_robo)
+            robo[1] += 1
+            if time.monotonic() >= proxima_visita:
+                cache.invalidar('intencao_voto', 'rejeicao')
+                visitante[0] += acessar(ip_visitante)
+                visitante[1] += 1
+                proxima_visita += 1
+            time.sleep(intervalo)
+        print(f'{nome:>8} {f"{robo[0]} de {robo[1]}":>15} {f"{visitante[0]} de {visitante[1]}":>19} '
+              f'{cache.metricas()["falhas"]:>9}')
+    print(f'limite por IP: rajada {c.LIMITE_PUBLICO_IP[0]}, {c.LIMITE_PUBLICO_IP[1]}/s')
+
+
+# Etapas de um eleitor no teste de carga, na ordem em que acontecem
+ETAPAS_FUNCOES = ('validar_token', 'votar_intencao', 'votar_rejeicao', 'graficos')
+ETAPAS_APPTEST = ('abrir_pagina', 'votar_intencao', 'votar_rejeicao')
+
+
+# Nome do erro no relatório; travas do SQLite ficam separadas das demais falhas
+def descrever_erro(erro):
+    if isinstance(erro, sqlite3.OperationalError) and 'locked' in str(erro):
+        return 'database is locked'
+    return type(erro).__name__
+
+
+# Executa uma etapa medindo a latência; devolve False se ela falhou
+def medir_etapa(resultado, etapa, funcao, *args):
+    inicio = time.perf_counter()
+    try:
+        ok = funcao(*args)
+    except Exception as erro:
+        ok = False
+        resultado['erros'][etapa][descrever_erro(erro)] += 1
+    resultado['latencias'][etapa].append(time.perf_counter() - inicio)
+    return ok is not False
+
+
+# Um eleitor chamando direto as funções de c.py: valida o link, vota nas duas
+# perguntas e carrega os gráficos de resultado
+def eleitor_funcoes(c, resultado, token, sorteio):
+    if not medir_etapa(resultado, 'validar_token', lambda: c.verificar_token(token) is not None):
+        return
+    for tipo in ('intencao', 'rejeicao'):
+        candidato = sorteio.choice(list(c.candidatos_da_pergunta(tipo)))
+        medir_etapa(resultado, f'votar_{tipo}', c.registrar_voto, tipo, candidato, token)
+    medir_etapa(resultado, 'graficos', lambda: (c.gerar_grafico_intencao_voto(), c.gerar_grafico_rejeicao()))
+
+
+# Um eleitor de ponta a ponta pelo AppTest: abre a página com o link e envia os dois formulários
+def eleitor_apptest(c, resultado, token, sorteio):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'c.py'), default_timeout=120)
+    app.query_params['token'] = token
+
+    def executar(acao=None):
+        if acao is not None:
+            acao()
+        app.run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+
+    if not medir_etapa(resultado, 'abrir_pagina', executar):
+        return
+    for tipo in ('intencao', 'rejeicao'):
+        # O formulário ainda não respondido é sempre o primeiro da página
+        candidato = sorteio.choice(list(c.candidatos_da_pergunta(tipo)))
+        medir_etapa(resultado, f'votar_{tipo}', executar,
+                    lambda: (app.radio[0].set_value(candidato), app.button[0].click()))
+
+
+# Roda os eleitores de uma lista de tokens em várias threads, dentro de um processo.
+# O AppTest não suporta execuções simultâneas no mesmo processo (o runtime de teste
+# é global), então no modo apptest a concorrência vem só dos processos.
+def executar_eleitores(tokens, threads, modo, semente):
+    import c
+
+    eleitor = eleitor_apptest if modo == 'apptest' else eleitor_funcoes
+    resultado = {'latencias': collections.defaultdict(list), 'erros': collections.defaultdict(collections.Counter)}
+    trava = threading.Lock()
+
+    def trabalhador(indice):
+        parcial = {'latencias': collections.defaultdict(list), 'erros': collections.defaultdict(collections.Counter)}
+        sorteio = random.Random(semente * 1000 + indice)
+        for token in tokens[indice::threads]:
+            eleitor(c, parcial, token, sorteio)
+        with trava:
+            for etapa, valores in parcial['latencias'].items():
+                resultado['latencias'][etapa].extend(valores)
+            for etapa, erros in parcial['erros'].items():
+                resultado['erros'][etapa].update(erros)
+
+    trabalhadores = [threading.Thread(target=trabalhador, args=(indice,)) for indice in range(threads)]
+    for trabalhador_ in trabalhadores:
+        trabalhador_.start()
+    for trabalhador_ in trabalhadores:
+        trabalhador_.join()
+    return {'latencias': dict(resultado['latencias']), 'erros': {etapa: dict(erros) for etapa, erros in resultado['erros'].items()}}
+
+
+# Ponto de entrada dos processos filhos (spawn: cada um importa c.py e abre o seu pool e a sua fila)
+def processo_carga(parametros):
+    return executar_eleitores(*parametros)
+
+
+def percentil(valores, fracao):
+    return valores[min(len(valores) - 1, int(len(valores) * fracao))] if valores else 0.0
+
+
+# Teste de carga do fluxo de votação: semeia N tokens e dispara os eleitores em
+# processos x threads; relata vazão, p50/p99 e taxa de erro de cada etapa e
+# opcionalmente salva ou compara com uma linha de base em JSON
+def benchmark_carga(args):
+    caminho_base = {nome: os.path.abspath(valor) for nome, valor in
+                    (('salvar', args.salvar_base), ('comparar', args.comparar_base)) if valor}
+    if args.modo == 'apptest' and args.threads != 1:
+        print('modo apptest: usando 1 thread por processo')
+        args.threads = 1
+    c = preparar_ambiente()
+    c.criar_tokens(args.tokens)
+    tokens = listar_tokens(c)
+    random.Random(args.semente).shuffle(tokens)
+
+    fatias = [(tokens[indice::args.processos], args.threads, args.modo, args.semente + indice)
+              for indice in range(args.processos)]
+    print(f'{args.tokens} eleitores, modo {args.modo}, {args.processos} processo(s) x {args.threads} thread(s)')
+    inicio = time.perf_counter()
+    if args.processos == 1:
+        parciais = [processo_carga(fatias[0])]
+    else:
+        with multiprocessing.get_context('spawn').Pool(args.processos) as processos:
+            parciais = processos.map(processo_carga, fatias)
+    duracao = time.perf_counter() - inicio
+
+    etapas = ETAPAS_APPTEST if args.modo == 'apptest' else ETAPAS_FUNCOES
+    relatorio = {}
+    print(f'{"etapa":>16} {"execuções":>10} {"erros":>7} {"vazão/s":>10} {"p50":>9} {"p99":>9}  falhas')
+    for etapa in etapas:
+        latencias = sorted(valor for parcial in parciais for valor in parcial['latencias'].get(etapa, []))
+        erros = collections.Counter()
+        for parcial in parciais:
+            erros.update(parcial['erros'].get(etapa, {}))
+        total_erros = sum(erros.values())
+        relatorio[etapa] = {
+            'execucoes': len(latencias),
+            'taxa_erro': total_erros / len(latencias) if latencias else 0.0,
+            'vazao': len(latencias) / duracao,
+            'p50_ms': percentil(latencias, 0.50) * 1000,
+            'p99_ms': percentil(latencias, 0.99) * 1000,
+            'erros': dict(erros),
+        }
+        item = relatorio[etapa]
+        falhas = ', '.join(f'{nome}: {quantidade}' for nome, quantidade in erros.most_common()) or '-'
+        print(f'{etapa:>16} {item["execucoes"]:>10} {total_erros:>7} {item["vazao"]:>10.1f} '
+              f'{item["p50_ms"]:>7.2f}ms {item["p99_ms"]:>7.2f}ms  {falhas}')
+    print(f'tempo total: {duracao:.1f}s')
+
+    parametros = {'tokens': args.tokens, 'modo': args.modo, 'processos': args.processos, 'threads': args.threads}
+    if 'comparar' in caminho_base:
+        with open(caminho_base['comparar'], encoding='utf-8') as arquivo:
+            base = json.load(arquivo)
+        if base['parametros'] != parametros:
+            print(f'atenção: linha de base medida com outros parâmetros: {base["parametros"]}')
+        print(f'\ncomparação com {caminho_base["comparar"]}')
+        print(f'{"etapa":>16} {"vazão/s":>22} {"p99":>26} {"taxa de erro":>18}')
+        for etapa, item in relatorio.items():
+            antes = base['operacoes'].get(etapa)
+            if antes is None:
+                continue
+            variacao = (item['vazao'] / antes['vazao'] - 1) * 100 if antes['vazao'] else 0.0
+            print(f'{etapa:>16} {antes["vazao"]:>8.1f} -> {item["vazao"]:>8.1f} ({variacao:+5.0f}%) '
+                  f'{antes["p99_ms"]:>8.2f} -> {item["p99_ms"]:>8.2f}ms '
+                  f'{antes["taxa_erro"]:>7.2%} -> {item["taxa_erro"]:>7.2%}')
+    if 'salvar' in caminho_base:
+        with open(caminho_base['salvar'], 'w', encoding='utf-8') as arquivo:
+            json.dump({'parametros': parametros, 'operacoes': relatorio}, arquivo, indent=2, ensure_ascii=False)
+        print(f'linha de base salva em {caminho_base["salvar"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks da enquete')
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    votos = comandos.add_parser('votos', help='Envio concorrente de votos com o mesmo token')
+    votos.add_argument('--tokens', type=int, default=2000)
+    votos.add_argument('--threads', type=int, default=16)
+    votos.add_argument('--repeticoes', type=int, default=3)
+    votos.set_defaults(funcao=benchmark_votos)
+
+    tokens = comandos.add_parser('tokens', help='Criação de tokens em massa')
+    tokens.add_argument('--quantidades', type=int, nargs='+', default=[10000, 100000, 1000000])
+    tokens.add_argument('--limite-legado', type=int, default=100000,
+                        help='Maior quantidade medida também pelo caminho antigo')
+    tokens.set_defaults(funcao=benchmark_tokens)
+
+    exportacao = comandos.add_parser('exportacao', help='Tempo e pico de memória das exportações')
+    exportacao.add_argument('--linhas', type=int, default=1000000)
+    exportacao.add_argument('--sem-legado', action='store_true', help='Não medir o caminho antigo')
+    exportacao.set_defaults(funcao=benchmark_exportacao)
+
+    armazenamento = comandos.add_parser('armazenamento', help='Tamanho e buscas: tokens TEXT x BLOB')
+    armazenamento.add_argument('--tokens', type=int, default=1000000)
+    armazenamento.add_argument('--buscas', type=int, default=100000)
+    armazenamento.set_defaults(funcao=benchmark_armazenamento)
+
+    enquetes = comandos.add_parser('enquetes', help='Votos de uma enquete durante escrita pesada em outra')
+    enquetes.add_argument('--votos', type=int, default=500)
+    enquetes.add_argument('--carga', type=int, default=200000)
+    enquetes.set_defaults(funcao=benchmark_enquetes)
+
+    inicializacao = comandos.add_parser('inicializacao', help='Custo das importações e tempo até o formulário de voto')
+    inicializacao.add_argument('--repeticoes', type=int, default=5)
+    inicializacao.set_defaults(funcao=benchmark_inicializacao)
+
+    graficos = comandos.add_parser('graficos', help='CPU e memória por gráfico: px.pie x go.Pie')
+    graficos.add_argument('--renderizacoes', type=int, default=500)
+    graficos.set_defaults(funcao=benchmark_graficos)
+
+    linha_do_tempo = comandos.add_parser('linha-do-tempo', help='Linha do tempo: GROUP BY nos votos x resumos')
+    linha_do_tempo.add_argument('--votos', type=int, default=1000000)
+    linha_do_tempo.add_argument('--horas', type=int, default=72, help='Período coberto pelos votos')
+    linha_do_tempo.add_argument('--leituras', type=int, default=20)
+    linha_do_tempo.add_argument('--gravacoes', type=int, default=20000, help='Votos gravados na medida de escrita')
+    linha_do_tempo.set_defaults(funcao=benchmark_linha_do_tempo)
+
+    rodadas = comandos.add_parser('rodadas', help='Zerar com UPDATE/DELETE x nova rodada, com votos chegando')
+    rodadas.add_argument('--tokens', type=int, default=1000000)
+    rodadas.set_defaults(funcao=benchmark_rodadas)
+
+    intervalos = comandos.add_parser('intervalos', help='Tempo dos intervalos de confiança a partir dos totais')
+    intervalos.add_argument('--votos', type=int, nargs='+', default=[10000, 1000000, 10000000])
+    intervalos.add_argument('--candidatos', type=int, default=5)
+    intervalos.add_argument('--repeticoes', type=int, default=500)
+    intervalos.add_argument('--reamostragens-por-voto', type=int, default=5)
+    intervalos.add_argument('--semente', type=int, default=1)
+    intervalos.set_defaults(funcao=benchmark_intervalos)
+
+    diario = comandos.add_parser('diario', help='Custo do diário na gravação e totais lidos do diário x banco')
+    diario.add_argument('--votos', type=int, default=5000, help='Votos gravados com e sem diário')
+    diario.add_argument('--threads', type=int, default=16)
+    diario.add_argument('--registros', type=int, default=1000000, help='Votos no banco e no diário da leitura')
+    diario.add_argument('--cauda', type=int, default=10000, help='Registros depois do último instantâneo')
+    diario.set_defaults(funcao=benchmark_diario)
+
+    publico = comandos.add_parser('publico', help='Rajada na página pública: single-flight e limites de acesso')
+    publico.add_argument('--votos', type=int, default=2000, help='Votos já gravados antes da rajada')
+    publico.add_argument('--sessoes', type=int, default=50)
+    publico.add_argument('--rodadas', type=int, default=20, help='Votos novos (invalidações) durante a rajada')
+    publico.add_argument('--robo-por-segundo', type=int, default=50)
+    publico.add_argument('--robo-segundos', type=int, default=5)
+    publico.set_defaults(funcao=benchmark_publico)
+
+    carga = comandos.add_parser('carga', help='Teste de carga do fluxo de votação (funções ou AppTest)')
+    carga.add_argument('--tokens', type=int, default=2000, help='Eleitores (um token cada)')
+    carga.add_argument('--processos', type=int, default=1)
+    carga.add_argument('--threads', type=int, default=8, help='Threads por processo')
+    carga.add_argument('--modo', choices=('funcoes', 'apptest'), default='funcoes')
+    carga.add_argument('--semente', type=int, default=1, help='Semente do sorteio de tokens e candidatos')
+    carga.add_argument('--salvar-base', help='Arquivo JSON onde salvar o resultado como linha de base')
+    carga.add_argument('--comparar-base', help='Arquivo JSON de uma linha de base anterior')
+    carga.set_defaults(funcao=benchmark_carga)
+
+    args = parser.parse_args()
+    args.funcao(args)
+
+
+if __name__ == '__main__':
+    main()
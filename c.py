@@ -1,9 +1,33 @@
 import streamlit as st
 import sqlite3
-import pandas as pd
-import plotly.express as px
-from io import BytesIO
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache, wraps
+from itertools import groupby
+from operator import itemgetter
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import bisect
+import contextvars
+import csv
+import gzip
+import importlib.util
+import logging
+import math
+import os
+import queue
+import random
+import re
+import secrets
+import tempfile
+import threading
+import time
 import uuid
+import weakref
+from zoneinfo import ZoneInfo
+
+import diario
 
 
 # Configuração da página deve ser a primeira chamada
@@ -28,6 +52,10 @@ hide_github_icon = """
     </style>
 """
 
+# pandas e plotly.express não são importados aqui: juntos custam quase meio segundo
+# de inicialização e o formulário de votação não precisa deles. Cada função que
+# monta DataFrames ou gráficos importa o que usa.
+
 # Aplicando o estilo ao Streamlit
 st.markdown(hide_github_icon, unsafe_allow_html=True)
 
@@ -36,14 +64,844 @@ st.markdown(hide_github_icon, unsafe_allow_html=True)
 
 
 
-# Função para conectar ao banco de dados
+# Caminho do banco de dados da enquete padrão
+CAMINHO_BANCO = 'enquete.db'
+
+# Quantidade máxima de conexões abertas mantidas pelo pool
+TAMANHO_POOL = 8
+
+# Tempo máximo (em segundos) esperando uma conexão livre no pool
+ESPERA_POOL = 10
+
+# PRAGMAs aplicados em toda conexão nova
+PRAGMAS_CONEXAO = (
+    'PRAGMA synchronous = NORMAL',
+    # Curto de propósito: quem espera mais é com_retentativas, que conta as tentativas
+    # e espera com recuo exponencial em vez de deixar a thread parada no SQLite
+    'PRAGMA busy_timeout = 1000',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+)
+
+
+# Função para abrir uma conexão nova já configurada.
+# isolation_level=None: as transações são abertas explicitamente com BEGIN
+def abrir_conexao(caminho):
+    conn = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None, timeout=5)
+    for pragma in PRAGMAS_CONEXAO:
+        conn.execute(pragma)
+    # Conversão entre o texto do link e os 16 bytes guardados no banco, usável no SQL
+    conn.create_function('uuid_bytes', 1, token_para_bytes, deterministic=True)
+    conn.create_function('uuid_texto', 1, bytes_para_token, deterministic=True)
+    return conn
+
+
+# Nenhuma conexão do pool ficou livre dentro de ESPERA_POOL segundos
+class PoolEsgotado(TimeoutError):
+    pass
+
+
+# Pool de conexões SQLite compartilhado por todas as sessões do processo
+class PoolConexoes:
+    def __init__(self, caminho, tamanho=TAMANHO_POOL):
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self._livres = queue.LifoQueue()
+        self._criadas = 0
+        self._trava = threading.Lock()
+
+        # WAL é persistente no arquivo, basta ativar uma vez
+        conn = self._abrir()
+        conn.execute('PRAGMA journal_mode = WAL')
+        self._livres.put(conn)
+
+    # Abre uma conexão nova. A vaga é reservada antes de conectar, na mesma trava que
+    # confere o tamanho, para chamadas simultâneas não passarem de `tamanho` conexões;
+    # com `so_com_vaga`, devolve None se o pool já está cheio.
+    def _abrir(self, so_com_vaga=False):
+        with self._trava:
+            if so_com_vaga and self._criadas >= self.tamanho:
+                return None
+            self._criadas += 1
+        try:
+            return abrir_conexao(self.caminho)
+        except BaseException:
+            with self._trava:
+                self._criadas -= 1
+            raise
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._trava:
+            self._criadas -= 1
+
+    # Verifica se a conexão ainda responde antes de entregá-la
+    def _saudavel(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    # Empresta uma conexão; com todas em uso por ESPERA_POOL segundos, recusa com PoolEsgotado
+    def adquirir(self):
+        try:
+            conn = self._livres.get_nowait()
+        except queue.Empty:
+            conn = self._abrir(so_com_vaga=True)
+            if conn is None:
+                try:
+                    conn = self._livres.get(timeout=ESPERA_POOL)
+                except queue.Empty:
+                    obter_metricas().somar('PoolConexoes.adquirir', 'rejeitadas')
+                    raise PoolEsgotado('Nenhuma conexão livre com o banco.') from None
+
+        if not self._saudavel(conn):
+            # A conexão nova ocupa a vaga da descartada
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            try:
+                conn = abrir_conexao(self.caminho)
+            except BaseException:
+                with self._trava:
+                    self._criadas -= 1
+                raise
+        return conn
+
+    def devolver(self, conn):
+        # Nunca devolver ao pool uma conexão com transação pendente
+        if conn.in_transaction:
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                self._descartar(conn)
+                return
+        self._livres.put(conn)
+
+    def estatisticas(self):
+        return {'abertas': self._criadas, 'livres': self._livres.qsize(), 'tamanho': self.tamanho}
+
+
+# Decorador para objetos únicos por processo (pools, filas, caches).
+# st.cache_resource só guarda valores com o runtime do Streamlit ativo; fora dele
+# (benchmark.py e scripts) c.py é importado uma única vez e lru_cache basta.
+def recurso_compartilhado(funcao):
+    if runtime.exists():
+        return st.cache_resource(funcao)
+    return lru_cache(maxsize=None)(funcao)
+
+# =======================================
+# Métricas de Desempenho
+# =======================================
+
+# Limites (em segundos) das faixas do histograma de latência, como os "le" do Prometheus
+FAIXAS_LATENCIA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Exportação das métricas no formato texto do Prometheus, desligada se não configurada:
+# porta local servindo /metrics e/ou arquivo regravado a cada METRICAS_INTERVALO segundos
+# (para o coletor de arquivos de texto do node_exporter)
+METRICAS_PORTA = os.environ.get('ENQUETE_METRICAS_PORTA')
+METRICAS_ARQUIVO = os.environ.get('ENQUETE_METRICAS_ARQUIVO')
+METRICAS_INTERVALO = 15
+
+
+# Contadores somados por função, com a descrição usada no formato do Prometheus
+CONTADORES_METRICAS = {
+    'erros': 'Chamadas que terminaram em exceção.',
+    'linhas': 'Linhas lidas do banco.',
+    'bloqueios': 'Chamadas que encontraram o SQLite travado por outra escrita.',
+    'retentativas': 'Novas tentativas depois de encontrar o SQLite travado.',
+    'rejeitadas': 'Chamadas recusadas pelo limite de concorrência.',
+    'limitadas': 'Acessos recusados pelo limite de acessos por cliente.',
+    'coalescidas': 'Chamadas que aproveitaram um cálculo igual já em andamento.',
+}
+
+
+# Contadores de uma função medida
+class MetricasFuncao:
+    __slots__ = ('chamadas', 'soma', 'faixas') + tuple(CONTADORES_METRICAS)
+
+    def __init__(self):
+        self.chamadas = 0
+        self.soma = 0.0
+        self.faixas = [0] * (len(FAIXAS_LATENCIA) + 1)  # a última é a +Inf
+        for contador in CONTADORES_METRICAS:
+            setattr(self, contador, 0)
+
+    def copia(self):
+        return dict({contador: getattr(self, contador) for contador in CONTADORES_METRICAS},
+                    chamadas=self.chamadas, soma=self.soma, faixas=list(self.faixas))
+
+
+# Métricas das funções de banco e dos gráficos: chamadas, histograma de latência e
+# os CONTADORES_METRICAS (erros, linhas lidas, travas...), compartilhadas pelo processo
+class Metricas:
+    def __init__(self):
+        self._funcoes = {}
+        self._trava = threading.Lock()
+
+    def _item(self, nome):
+        item = self._funcoes.get(nome)
+        if item is None:
+            item = self._funcoes[nome] = MetricasFuncao()
+        return item
+
+    def registrar(self, nome, duracao, erro=False, linhas=0):
+        faixa = bisect.bisect_left(FAIXAS_LATENCIA, duracao)
+        with self._trava:
+            item = self._item(nome)
+            item.chamadas += 1
+            item.erros += erro
+            item.soma += duracao
+            item.faixas[faixa] += 1
+            item.linhas += linhas
+
+    # Soma a um dos CONTADORES_METRICAS da função
+    def somar(self, nome, contador, quantidade=1):
+        with self._trava:
+            item = self._item(nome)
+            setattr(item, contador, getattr(item, contador) + quantidade)
+
+    def zerar(self):
+        with self._trava:
+            self._funcoes.clear()
+
+    def _copias(self):
+        with self._trava:
+            return [(nome, item.copia()) for nome, item in sorted(self._funcoes.items())]
+
+    # Percentil estimado pelo histograma (interpolação linear dentro da faixa)
+    @staticmethod
+    def _percentil(faixas, chamadas, fracao):
+        alvo = fracao * chamadas
+        acumulado = 0
+        for indice, quantidade in enumerate(faixas):
+            if quantidade and acumulado + quantidade >= alvo:
+                inicio = FAIXAS_LATENCIA[indice - 1] if indice else 0.0
+                fim = FAIXAS_LATENCIA[indice] if indice < len(FAIXAS_LATENCIA) else FAIXAS_LATENCIA[-1]
+                return inicio + (fim - inicio) * (alvo - acumulado) / quantidade
+            acumulado += quantidade
+        return 0.0
+
+    # Uma linha por função, com os tempos em milissegundos
+    def resumo(self):
+        linhas = []
+        for nome, item in self._copias():
+            chamadas, soma, faixas = item['chamadas'], item['soma'], item['faixas']
+            linha = {
+                'funcao': nome,
+                'chamadas': chamadas,
+                'media_ms': soma / chamadas * 1000 if chamadas else 0.0,
+                'p50_ms': self._percentil(faixas, chamadas, 0.50) * 1000,
+                'p95_ms': self._percentil(faixas, chamadas, 0.95) * 1000,
+                'p99_ms': self._percentil(faixas, chamadas, 0.99) * 1000,
+                'total_s': soma,
+            }
+            linha.update((contador, item[contador]) for contador in CONTADORES_METRICAS)
+            linhas.append(linha)
+        return linhas
+
+    # Total de um contador somando todas as funções
+    def total(self, contador):
+        return sum(item[contador] for _, item in self._copias())
+
+    # Todas as métricas no formato texto de exposição do Prometheus
+    def texto_prometheus(self):
+        copias = self._copias()
+        linhas = [
+            '# HELP enquete_duracao_segundos Duração das chamadas das funções medidas.',
+            '# TYPE enquete_duracao_segundos histogram',
+        ]
+        for nome, item in copias:
+            acumulado = 0
+            for limite, quantidade in zip(FAIXAS_LATENCIA + ('+Inf',), item['faixas']):
+                acumulado += quantidade
+                linhas.append(f'enquete_duracao_segundos_bucket{{funcao="{nome}",le="{limite}"}} {acumulado}')
+            linhas.append(f'enquete_duracao_segundos_sum{{funcao="{nome}"}} {item["soma"]}')
+            linhas.append(f'enquete_duracao_segundos_count{{funcao="{nome}"}} {item["chamadas"]}')
+        for contador, descricao in CONTADORES_METRICAS.items():
+            metrica = 'enquete_linhas_lidas_total' if contador == 'linhas' else f'enquete_{contador}_total'
+            linhas.append(f'# HELP {metrica} {descricao}')
+            linhas.append(f'# TYPE {metrica} counter')
+            for nome, item in copias:
+                linhas.append(f'{metrica}{{funcao="{nome}"}} {item[contador]}')
+        return '\n'.join(linhas) + '\n'
+
+
+# Log dos erros das threads em segundo plano, que não têm uma página onde mostrar st.error
+log_enquete = logging.getLogger('enquete')
+
+# Métricas criadas uma única vez por processo
+@recurso_compartilhado
+def criar_metricas():
+    return Metricas()
+
+# O mesmo objeto, buscado uma vez por execução do script, na thread do script. As
+# threads em segundo plano (gravador de votos, limpeza, índice de tokens) leem esta
+# variável em vez de passar pelo st.cache_resource, que fora da thread do script
+# avisa "missing ScriptRunContext" a cada chamada.
+METRICAS = criar_metricas()
+
+# Métricas do processo
+def obter_metricas():
+    return METRICAS
+
+# Verifica se o erro do SQLite é de banco travado por outra escrita
+def erro_de_trava(erro):
+    mensagem = str(erro).lower()
+    return isinstance(erro, sqlite3.OperationalError) and ('locked' in mensagem or 'busy' in mensagem)
+
+# Decorador que mede cada chamada da função (latência, erros e esperas por trava).
+# Com contar_linhas=True, o tamanho da lista ou tupla devolvida conta como linhas lidas.
+def medir(contar_linhas=False):
+    def decorador(funcao):
+        nome = funcao.__qualname__
+        metricas = obter_metricas()
+
+        @wraps(funcao)
+        def medida(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                resultado = funcao(*args, **kwargs)
+            except Exception as erro:
+                if erro_de_trava(erro):
+                    metricas.somar(nome, 'bloqueios')
+                metricas.registrar(nome, time.perf_counter() - inicio, erro=True)
+                raise
+            linhas = len(resultado) if contar_linhas and isinstance(resultado, (list, tuple)) else 0
+            metricas.registrar(nome, time.perf_counter() - inicio, linhas=linhas)
+            return resultado
+
+        return medida
+    return decorador
+
+# Tentativas de uma escrita que encontrou o banco travado e o recuo entre elas (em
+# segundos): a espera dobra a cada tentativa, até o máximo, com um sorteio para que
+# as escritas que travaram juntas não voltem todas no mesmo instante
+RETENTATIVAS_ESCRITA = 5
+ESPERA_RETENTATIVA = 0.05
+ESPERA_RETENTATIVA_MAX = 1.0
+
+# Função para chamar `funcao` de novo enquanto o SQLite responder que o banco está
+# travado, até RETENTATIVAS_ESCRITA vezes; as novas tentativas contam em `nome`
+def com_retentativas(nome, funcao, *args):
+    for tentativa in range(RETENTATIVAS_ESCRITA):
+        try:
+            return funcao(*args)
+        except sqlite3.OperationalError as erro:
+            if not erro_de_trava(erro) or tentativa == RETENTATIVAS_ESCRITA - 1:
+                raise
+        obter_metricas().somar(nome, 'retentativas')
+        espera = min(ESPERA_RETENTATIVA_MAX, ESPERA_RETENTATIVA * 2 ** tentativa)
+        time.sleep(random.uniform(espera / 2, espera))
+
+# Inicia a exportação das métricas (porta e/ou arquivo), uma única vez por processo
+@recurso_compartilhado
+def iniciar_exportacao_metricas():
+    metricas = obter_metricas()
+
+    if METRICAS_PORTA:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class RespostaMetricas(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                corpo = metricas.texto_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, formato, *args):
+                pass
+
+        # Só na interface local: quem coleta é um Prometheus/agente na mesma máquina.
+        # Porta ocupada (outro processo do app já serve as métricas, por exemplo) não
+        # impede a página de abrir: a falha fica no log e as métricas seguem em memória.
+        try:
+            servidor = ThreadingHTTPServer(('127.0.0.1', int(METRICAS_PORTA)), RespostaMetricas)
+        except OSError:
+            log_enquete.exception('Não foi possível servir as métricas na porta %s', METRICAS_PORTA)
+        else:
+            threading.Thread(target=servidor.serve_forever, name='metricas-http', daemon=True).start()
+
+    if METRICAS_ARQUIVO:
+        def gravar_arquivo():
+            while True:
+                # Grava ao lado e troca de uma vez: o coletor nunca lê um arquivo pela metade
+                temporario = f'{METRICAS_ARQUIVO}.tmp'
+                try:
+                    with open(temporario, 'w', encoding='utf-8') as arquivo:
+                        arquivo.write(metricas.texto_prometheus())
+                    os.replace(temporario, METRICAS_ARQUIVO)
+                except OSError:
+                    log_enquete.exception('Não foi possível gravar as métricas em %s', METRICAS_ARQUIVO)
+                time.sleep(METRICAS_INTERVALO)
+
+        threading.Thread(target=gravar_arquivo, name='metricas-arquivo', daemon=True).start()
+    return metricas
+
+# =======================================
+# Registro de Enquetes
+# =======================================
+
+# Arquivo SQLite com o registro das enquetes servidas por este processo.
+# Cada enquete tem o seu próprio arquivo de banco (tokens, votos, placar e candidatos),
+# então a gravação de uma enquete movimentada não trava as demais.
+CAMINHO_REGISTRO = 'enquetes.db'
+
+# Enquete usada quando a URL não traz ?enquete=; o banco dela é CAMINHO_BANCO
+ENQUETE_PADRAO = 'principal'
+
+# Perguntas da enquete original, usadas pela enquete padrão
+PERGUNTA_INTENCAO_PADRAO = "Se as eleições em São Miguel do Guaporé fossem hoje, em qual desses candidatos você votaria?"
+PERGUNTA_REJEICAO_PADRAO = "Em qual desses candidatos você não votaria de jeito nenhum?"
+
+# Identificador de enquete aceito na URL e no nome do arquivo
+FORMATO_SLUG = re.compile(r'[a-z0-9][a-z0-9-]{0,39}')
+
+# Enquete da execução atual (definida em main a partir da URL).
+# Sem enquete definida (scripts, benchmark.py) vale a enquete padrão.
+ENQUETE_ATUAL = contextvars.ContextVar('enquete_atual', default=None)
+
+COLUNAS_ENQUETE = ('slug', 'nome', 'arquivo', 'pergunta_intencao', 'pergunta_rejeicao')
+
+
+# Função para montar a enquete padrão, como dicionário com as COLUNAS_ENQUETE
+def enquete_padrao():
+    return {'slug': ENQUETE_PADRAO, 'nome': 'São Miguel do Guaporé', 'arquivo': CAMINHO_BANCO,
+            'pergunta_intencao': PERGUNTA_INTENCAO_PADRAO, 'pergunta_rejeicao': PERGUNTA_REJEICAO_PADRAO}
+
+# Função para obter a enquete atual
+def enquete_atual():
+    enquete = ENQUETE_ATUAL.get()
+    return enquete_padrao() if enquete is None else enquete
+
+# Função para executar um trecho de código em outra enquete (scripts e ferramentas)
+@contextmanager
+def usar_enquete(enquete):
+    marcador = ENQUETE_ATUAL.set(enquete)
+    try:
+        yield enquete
+    finally:
+        ENQUETE_ATUAL.reset(marcador)
+
+# Pool do registro de enquetes, criado uma única vez por processo junto com a
+# tabela do registro e a enquete padrão
+@recurso_compartilhado
+def obter_registro():
+    pool = PoolConexoes(CAMINHO_REGISTRO, tamanho=2)
+    conn = pool.adquirir()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS enquetes (
+            slug TEXT PRIMARY KEY,
+            nome TEXT NOT NULL,
+            arquivo TEXT NOT NULL UNIQUE,
+            pergunta_intencao TEXT NOT NULL,
+            pergunta_rejeicao TEXT NOT NULL,
+            criada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        padrao = enquete_padrao()
+        conn.execute(f"INSERT OR IGNORE INTO enquetes ({', '.join(COLUNAS_ENQUETE)}) VALUES (?, ?, ?, ?, ?)",
+                     [padrao[coluna] for coluna in COLUNAS_ENQUETE])
+        conn.execute('COMMIT')
+    finally:
+        pool.devolver(conn)
+    return pool
+
+# Função para buscar uma enquete do registro pelo identificador; None se não existir
+def buscar_enquete(slug):
+    pool = obter_registro()
+    conn = pool.adquirir()
+    try:
+        linha = conn.execute(f"SELECT {', '.join(COLUNAS_ENQUETE)} FROM enquetes WHERE slug = ?", (slug,)).fetchone()
+    finally:
+        pool.devolver(conn)
+    return None if linha is None else dict(zip(COLUNAS_ENQUETE, linha))
+
+# Função para listar as enquetes registradas
+def listar_enquetes():
+    pool = obter_registro()
+    conn = pool.adquirir()
+    try:
+        linhas = conn.execute(f"SELECT {', '.join(COLUNAS_ENQUETE)} FROM enquetes ORDER BY criada_em, slug").fetchall()
+    finally:
+        pool.devolver(conn)
+    return [dict(zip(COLUNAS_ENQUETE, linha)) for linha in linhas]
+
+# Função para registrar uma enquete nova e criar o seu banco (ao lado de CAMINHO_BANCO)
+def criar_enquete(slug, nome, pergunta_intencao, pergunta_rejeicao):
+    if not FORMATO_SLUG.fullmatch(slug):
+        raise ValueError("O identificador deve ter até 40 letras minúsculas, números ou hífens.")
+    enquete = {
+        'slug': slug,
+        'nome': nome,
+        'arquivo': os.path.join(os.path.dirname(CAMINHO_BANCO), f'enquete-{slug}.db'),
+        'pergunta_intencao': pergunta_intencao,
+        'pergunta_rejeicao': pergunta_rejeicao,
+    }
+    pool = obter_registro()
+    conn = pool.adquirir()
+    try:
+        conn.execute(f"INSERT INTO enquetes ({', '.join(COLUNAS_ENQUETE)}) VALUES (?, ?, ?, ?, ?)",
+                     [enquete[coluna] for coluna in COLUNAS_ENQUETE])
+    except sqlite3.IntegrityError:
+        raise ValueError(f"Já existe uma enquete com o identificador {slug}.")
+    finally:
+        pool.devolver(conn)
+    pool_da_enquete(enquete['arquivo'])  # cria o arquivo e aplica as migrações
+    return enquete
+
+# Função para obter o caminho do banco da enquete atual
+def caminho_banco():
+    return enquete_atual()['arquivo']
+
+# Pool de um banco de enquete, criado uma única vez por processo e por arquivo
+# (sobrevive aos reruns do Streamlit). Ao ser criado, aplica as migrações pendentes.
+@recurso_compartilhado
+def pool_da_enquete(caminho):
+    pool = PoolConexoes(caminho)
+    # O esquema é preparado uma única vez, junto com o pool, e nunca durante as páginas
+    conn = pool.adquirir()
+    try:
+        aplicar_migracoes(conn)
+    finally:
+        pool.devolver(conn)
+    return pool
+
+# Pool da enquete atual
+def obter_pool():
+    return pool_da_enquete(caminho_banco())
+
+# Função para conectar ao banco de dados (empresta uma conexão do pool)
+@contextmanager
 def conectar_banco():
-    return sqlite3.connect('enquete.db')
+    pool = obter_pool()
+    conn = pool.adquirir()
+    try:
+        yield conn
+    finally:
+        pool.devolver(conn)
+
+# Maior quantidade de votos gravados em um mesmo COMMIT
+FILA_MAX_LOTE = 256
+
+# Tempo (em milissegundos) que a fila espera por mais votos antes de gravar um lote.
+# Com 0 o agrupamento acontece naturalmente: os votos que chegam enquanto um lote
+# está sendo gravado formam o próximo lote.
+FILA_ESPERA_MS = 0
+
+# Tempo máximo (em segundos) que uma sessão espera a confirmação do seu voto
+FILA_TIMEOUT = 30
+
+
+# Voto aguardando gravação na fila
+class PedidoVoto:
+    __slots__ = ('tipo', 'candidato_id', 'token', 'momento', 'rodadas', 'aceito', 'erro', 'concluido')
+
+    def __init__(self, tipo, candidato_id, token):
+        self.tipo = tipo
+        self.candidato_id = candidato_id
+        self.token = token
+        self.momento = time.time()  # horário do voto, não o do COMMIT do lote
+        self.rodadas = None  # rodadas em que foi gravado, para o diário
+        self.aceito = False
+        self.erro = None
+        self.concluido = threading.Event()
+
+
+# Fila de gravação de votos: uma thread em segundo plano agrupa os votos que
+# chegam juntos e grava cada lote em uma única transação (um único fsync).
+class FilaVotos:
+    def __init__(self, caminho, max_lote=FILA_MAX_LOTE, espera_ms=FILA_ESPERA_MS, ao_gravar=None):
+        self.max_lote = max_lote
+        # Chamado após cada COMMIT com a lista de pedidos aceitos no lote
+        self.ao_gravar = ao_gravar
+        self.espera = espera_ms / 1000
+        self._fila = queue.Queue()
+        self._trava = threading.Lock()
+        self.lotes = 0
+        self.votos = 0
+        self.ultimo_lote = 0
+        self.maior_lote = 0
+
+        # Conexão exclusiva do gravador; com commits em grupo dá para pagar o fsync completo
+        self._conn = abrir_conexao(caminho)
+        self._conn.execute('PRAGMA synchronous = FULL')
+
+        self._thread = threading.Thread(target=self._executar, name='fila-votos', daemon=True)
+        self._thread.start()
+
+    def enviar(self, tipo, candidato_id, token, timeout=FILA_TIMEOUT):
+        if tipo not in TIPOS_VOTO:
+            raise ValueError(f'Tipo de voto desconhecido: {tipo}')
+        pedido = PedidoVoto(tipo, candidato_id, token)
+        self._fila.put(pedido)
+        if not pedido.concluido.wait(timeout):
+            raise TimeoutError('O voto não foi confirmado a tempo.')
+        if pedido.erro is not None:
+            raise pedido.erro
+        return pedido.aceito
+
+    # Pega o primeiro voto disponível e junta os que chegarem dentro da janela de espera
+    def _coletar_lote(self):
+        lote = [self._fila.get()]
+        limite = time.monotonic() + self.espera
+        while len(lote) < self.max_lote:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self._fila.get(timeout=restante) if restante > 0 else self._fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    @medir()
+    def _gravar_lote(self, lote):
+        cursor = self._conn.cursor()
+        # BEGIN IMMEDIATE já pega a trava de escrita: sem leitura promovida a escrita
+        # no meio da transação, que o SQLite recusa sem esperar o busy_timeout
+        cursor.execute('BEGIN IMMEDIATE')
+        for pedido in lote:  # limpa o resultado de uma tentativa anterior do mesmo lote
+            pedido.aceito = False
+            pedido.erro = None
+        try:
+            # Com a trava de escrita, as rodadas não mudam até o COMMIT: uma leitura por lote
+            rodadas = ler_rodadas(cursor)
+            for pedido in lote:
+                pedido.rodadas = rodadas
+                # SAVEPOINT por voto: um voto com erro não derruba o lote inteiro
+                cursor.execute('SAVEPOINT voto')
+                try:
+                    pedido.aceito = gravar_voto(cursor, pedido.tipo, pedido.candidato_id, pedido.token, pedido.momento, rodadas)
+                except sqlite3.Error as erro:
+                    cursor.execute('ROLLBACK TO voto')
+                    pedido.erro = erro
+                cursor.execute('RELEASE voto')
+            cursor.execute('COMMIT')
+        except BaseException:
+            if self._conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
+
+    def _executar(self):
+        while True:
+            lote = self._coletar_lote()
+            try:
+                com_retentativas('FilaVotos._gravar_lote', self._gravar_lote, lote)
+            except Exception as erro:
+                for pedido in lote:
+                    pedido.aceito = False
+                    pedido.erro = erro
+            aceitos = [pedido for pedido in lote if pedido.aceito]
+            if aceitos and self.ao_gravar is not None:
+                try:
+                    self.ao_gravar(aceitos)
+                except Exception:
+                    # Os votos já estão no banco: uma falha no aviso não pode derrubar o
+                    # gravador (os próximos votos ficariam esperando até o timeout)
+                    obter_metricas().somar('FilaVotos.ao_gravar', 'erros')
+                    log_enquete.exception('Falha ao avisar a gravação de %d votos', len(aceitos))
+            with self._trava:
+                self.lotes += 1
+                self.votos += len(lote)
+                self.ultimo_lote = len(lote)
+                self.maior_lote = max(self.maior_lote, len(lote))
+            # A confirmação só sai depois do COMMIT do lote (e do fsync do diário)
+            for pedido in lote:
+                pedido.concluido.set()
+
+    def metricas(self):
+        with self._trava:
+            return {
+                'profundidade': self._fila.qsize(),
+                'lotes': self.lotes,
+                'votos': self.votos,
+                'ultimo_lote': self.ultimo_lote,
+                'maior_lote': self.maior_lote,
+                'media_lote': self.votos / self.lotes if self.lotes else 0.0,
+            }
+
+
+# Diário dos votos (diario.py) ligado ou não; desligado, nada é gravado fora do banco
+DIARIO_VOTOS = os.environ.get('ENQUETE_DIARIO', '1') != '0'
+
+# Diário de votos criado uma única vez por processo e por banco de enquete, ao lado do banco
+@recurso_compartilhado
+def diario_da_enquete(caminho):
+    return diario.Diario(diario.caminho_diario(caminho))
+
+# Diário de votos da enquete atual
+def obter_diario():
+    return diario_da_enquete(caminho_banco())
+
+# Função para copiar os votos aceitos de um lote para o diário, com um único fsync
+@medir()
+def anotar_votos(registro, pedidos):
+    registro.acrescentar([
+        diario.registro_de_voto(pedido.tipo, pedido.candidato_id, token_para_bytes(pedido.token), pedido.momento,
+                                pedido.rodadas[RODADAS_VOTO[pedido.tipo]], pedido.rodadas['rodada_tokens'])
+        for pedido in pedidos
+    ])
+
+# Fila de gravação criada uma única vez por processo e por banco de enquete:
+# cada enquete tem o seu gravador, então os lotes de enquetes diferentes não se esperam
+@recurso_compartilhado
+def fila_da_enquete(caminho):
+    pool_da_enquete(caminho)  # garante WAL ativo antes da conexão do gravador
+    cache = cache_da_enquete(caminho)
+    indice = indice_da_enquete(caminho)
+    registro = diario_da_enquete(caminho) if DIARIO_VOTOS else None
+
+    def ao_gravar(pedidos):
+        cache.invalidar(*{TIPOS_VOTO[pedido.tipo][0] for pedido in pedidos})
+        for pedido in pedidos:
+            indice.invalidar_estado(pedido.token)
+        if registro is not None:
+            try:
+                anotar_votos(registro, pedidos)
+            except OSError:
+                pass  # os votos já estão no banco; a falha fica nas métricas de anotar_votos
+
+    return FilaVotos(caminho, ao_gravar=ao_gravar)
+
+# Fila de gravação da enquete atual
+def obter_fila_votos():
+    return fila_da_enquete(caminho_banco())
+
+# Função para executar comandos de escrita dentro de uma única transação.
+# IMMEDIATE pega a trava de escrita logo no BEGIN, que é repetido com recuo se o
+# banco estiver travado; nada do bloco roda antes de a trava ser obtida.
+@contextmanager
+def transacao(modo='IMMEDIATE'):
+    with conectar_banco() as conn:
+        com_retentativas('transacao', conn.execute, f'BEGIN {modo}')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+# Tempo máximo (em segundos) que um resultado fica em cache mesmo sem nenhuma escrita
+# registrada, para enxergar alterações feitas fora deste processo
+CACHE_TTL = 30
+
+
+# Cálculo de um valor do cache em andamento, aguardado pelas sessões que pedem o mesmo valor
+class CalculoEmAndamento:
+    __slots__ = ('valor', 'erro', 'pronto')
+
+    def __init__(self):
+        self.valor = None
+        self.erro = None
+        self.pronto = threading.Event()
+
+
+# Cache de resultados (DataFrames agregados e figuras dos gráficos) compartilhado por
+# todas as sessões. Cada tabela tem um número de versão que aumenta a cada escrita;
+# um valor guardado só é reaproveitado se foi calculado na versão atual da tabela.
+# Pedidos iguais que chegam enquanto o valor está sendo calculado esperam esse mesmo
+# cálculo (single-flight), em vez de cada sessão repetir as consultas e as figuras.
+class CacheResultados:
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self._valores = {}
+        self._versoes = {}
+        self._em_andamento = {}
+        self._trava = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.coalescidas = 0
+
+    def versao(self, tabela):
+        with self._trava:
+            return self._versoes.get(tabela, 0)
+
+    # Marca as tabelas como alteradas; os valores antigos deixam de valer
+    def invalidar(self, *tabelas):
+        with self._trava:
+            for tabela in tabelas:
+                self._versoes[tabela] = self._versoes.get(tabela, 0) + 1
+
+    def obter(self, tabela, chave, calcular):
+        agora = time.monotonic()
+        with self._trava:
+            versao = self._versoes.get(tabela, 0)
+            item = self._valores.get((tabela, chave))
+            if item is not None and item[0] == versao and item[1] > agora:
+                self.acertos += 1
+                return item[2]
+            calculo = self._em_andamento.get((tabela, chave, versao))
+            if calculo is None:
+                calculo = self._em_andamento[(tabela, chave, versao)] = CalculoEmAndamento()
+                self.falhas += 1
+                responsavel = True
+            else:
+                self.coalescidas += 1
+                responsavel = False
+
+        if not responsavel:
+            obter_metricas().somar('CacheResultados.obter', 'coalescidas')
+            calculo.pronto.wait()
+            if calculo.erro is not None:
+                raise calculo.erro
+            return calculo.valor
+
+        try:
+            calculo.valor = calcular()
+        except BaseException as erro:
+            calculo.erro = erro
+            raise
+        finally:
+            # Guarda o valor antes de liberar quem espera: um pedido que chegar depois
+            # já encontra o valor no cache
+            with self._trava:
+                if calculo.erro is None:
+                    self._valores[(tabela, chave)] = (versao, agora + self.ttl, calculo.valor)
+                del self._em_andamento[(tabela, chave, versao)]
+            calculo.pronto.set()
+        return calculo.valor
+
+    def metricas(self):
+        with self._trava:
+            total = self.acertos + self.falhas
+            return {
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'coalescidas': self.coalescidas,
+                'taxa_acerto': self.acertos / total if total else 0.0,
+                'itens': len(self._valores),
+            }
+
+
+# Cache de resultados criado uma única vez por processo e por banco de enquete
+@recurso_compartilhado
+def cache_da_enquete(caminho):
+    return CacheResultados()
+
+# Cache de resultados da enquete atual
+def obter_cache_resultados():
+    return cache_da_enquete(caminho_banco())
+
+# =======================================
+# Esquema do Banco e Migrações
+# =======================================
 
-# Função para criar as tabelas necessárias, se não existirem
-def criar_tabelas():
-    conn = conectar_banco()
-    cursor = conn.cursor()
+# Migração 1: esquema original. As tabelas usam IF NOT EXISTS porque os bancos
+# criados antes das migrações já têm tokens, votos e configuração.
+def migracao_esquema_inicial(cursor):
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS tokens (
         token TEXT PRIMARY KEY,
@@ -73,193 +931,1360 @@ def criar_tabelas():
         data_hora TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
+    # Placar mantido a cada voto, para os gráficos não precisarem de GROUP BY
+    for tabela, placar in (('intencao_voto', 'placar_intencao'), ('rejeicao', 'placar_rejeicao')):
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {placar} (
+            candidato TEXT PRIMARY KEY,
+            votos INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        # Banco antigo que já tinha votos: montar o placar a partir deles
+        cursor.execute(f'DELETE FROM {placar}')
+        cursor.execute(f'INSERT INTO {placar} (candidato, votos) SELECT candidato, COUNT(*) FROM {tabela} GROUP BY candidato')
+    # Andamento das criações de tokens em massa (permite retomar)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS lotes_tokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        solicitados INTEGER NOT NULL,
+        criados INTEGER NOT NULL DEFAULT 0,
+        criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        concluido_em TIMESTAMP
+    )
+    ''')
     # Inserir configuração inicial, se não existir
     cursor.execute('''
     INSERT OR IGNORE INTO configuracao (id, exibir_real, candidato_favorecido) 
     VALUES (1, TRUE, NULL)
     ''')
-    conn.commit()
-    conn.close()
 
-# Função para carregar as configurações atuais
+# Migração 2: índices usados pelas consultas da página de administração
+def migracao_indices(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_intencao_voto_candidato ON intencao_voto (candidato)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rejeicao_candidato ON rejeicao (candidato)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_intencao_voto_token ON intencao_voto (token)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rejeicao_token ON rejeicao (token)')
+
+# Migração 3: tokens guardados como os 16 bytes do UUID em uma tabela WITHOUT ROWID
+# (a chave primária é o próprio índice) e votos apontando para o id inteiro do token.
+# Os ids dos tokens antigos são os seus rowids, o que preserva a ordem de criação.
+def migracao_tokens_binarios(cursor):
+    cursor.execute('''
+    CREATE TABLE tokens_binarios (
+        token BLOB PRIMARY KEY,
+        id INTEGER NOT NULL UNIQUE,
+        usado_intencao BOOLEAN NOT NULL DEFAULT FALSE,
+        usado_rejeicao BOOLEAN NOT NULL DEFAULT FALSE
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+    INSERT INTO tokens_binarios (token, id, usado_intencao, usado_rejeicao)
+    SELECT uuid_bytes(token), rowid, usado_intencao, usado_rejeicao FROM tokens
+    WHERE uuid_bytes(token) IS NOT NULL
+    ''')
+    for tabela in ('intencao_voto', 'rejeicao'):
+        cursor.execute(f'''
+        CREATE TABLE {tabela}_binario (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            candidato TEXT NOT NULL,
+            token_id INTEGER
+        )
+        ''')
+        # LEFT JOIN: um voto cujo token sumiu continua contando, só sem token_id
+        cursor.execute(f'''
+        INSERT INTO {tabela}_binario (id, candidato, token_id)
+        SELECT v.id, v.candidato, t.rowid FROM {tabela} v LEFT JOIN tokens t ON t.token = v.token
+        ''')
+        cursor.execute(f'DROP TABLE {tabela}')
+        cursor.execute(f'ALTER TABLE {tabela}_binario RENAME TO {tabela}')
+        cursor.execute(f'CREATE INDEX idx_{tabela}_candidato ON {tabela} (candidato)')
+        cursor.execute(f'CREATE INDEX idx_{tabela}_token_id ON {tabela} (token_id)')
+    cursor.execute('DROP TABLE tokens')
+    cursor.execute('ALTER TABLE tokens_binarios RENAME TO tokens')
+
+# Candidatos da enquete original: (nome, vale para intenção, vale para rejeição)
+CANDIDATOS_INICIAIS = (
+    ('Fabio de Paula', True, True),
+    ('Coronel Crispim', True, True),
+    ('Prof Eudes', True, True),
+    ('Branco/Nulo', True, False),
+    ('Não sei/Não decidi', True, False),
+)
+
+# Opções com que começa uma enquete nova; os candidatos são cadastrados pela administração
+CANDIDATOS_GENERICOS = (
+    ('Branco/Nulo', True, False),
+    ('Não sei/Não decidi', True, False),
+)
+
+# Migração 4: tabela de candidatos (nome, ordem de exibição e perguntas em que aparece).
+# Votos e placares passam a guardar o id inteiro do candidato em vez do nome.
+def migracao_candidatos(cursor):
+    cursor.execute('''
+    CREATE TABLE candidatos (
+        id INTEGER PRIMARY KEY,
+        nome TEXT NOT NULL UNIQUE,
+        ordem INTEGER NOT NULL,
+        intencao BOOLEAN NOT NULL DEFAULT TRUE,
+        rejeicao BOOLEAN NOT NULL DEFAULT TRUE,
+        ativo BOOLEAN NOT NULL DEFAULT TRUE
+    )
+    ''')
+    # Os candidatos da enquete original só entram no banco dela (que pode trazer votos
+    # com esses nomes); as enquetes criadas depois começam com as opções genéricas
+    arquivo = cursor.execute('PRAGMA database_list').fetchone()[2]
+    original = os.path.realpath(arquivo) == os.path.realpath(CAMINHO_BANCO)
+    cursor.executemany(
+        'INSERT INTO candidatos (nome, ordem, intencao, rejeicao) VALUES (?, ?, ?, ?)',
+        [(nome, ordem, intencao, rejeicao)
+         for ordem, (nome, intencao, rejeicao) in enumerate(CANDIDATOS_INICIAIS if original else CANDIDATOS_GENERICOS, 1)],
+    )
+    # Nomes que só existem nos votos antigos continuam contando, como candidatos inativos
+    cursor.execute('''
+    INSERT INTO candidatos (nome, ordem, intencao, rejeicao, ativo)
+    SELECT nome, (SELECT COALESCE(MAX(ordem), 0) FROM candidatos) + ROW_NUMBER() OVER (ORDER BY nome),
+           MAX(intencao), MAX(rejeicao), FALSE
+    FROM (
+        SELECT candidato AS nome, TRUE AS intencao, FALSE AS rejeicao FROM intencao_voto
+        UNION ALL
+        SELECT candidato, FALSE, TRUE FROM rejeicao
+    )
+    WHERE nome NOT IN (SELECT nome FROM candidatos)
+    GROUP BY nome
+    ''')
+    for tabela, placar in (('intencao_voto', 'placar_intencao'), ('rejeicao', 'placar_rejeicao')):
+        cursor.execute(f'''
+        CREATE TABLE {tabela}_candidatos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            candidato_id INTEGER NOT NULL REFERENCES candidatos (id),
+            token_id INTEGER
+        )
+        ''')
+        cursor.execute(f'''
+        INSERT INTO {tabela}_candidatos (id, candidato_id, token_id)
+        SELECT v.id, c.id, v.token_id FROM {tabela} v JOIN candidatos c ON c.nome = v.candidato
+        ''')
+        cursor.execute(f'DROP TABLE {tabela}')
+        cursor.execute(f'ALTER TABLE {tabela}_candidatos RENAME TO {tabela}')
+        cursor.execute(f'CREATE INDEX idx_{tabela}_candidato ON {tabela} (candidato_id)')
+        cursor.execute(f'CREATE INDEX idx_{tabela}_token_id ON {tabela} (token_id)')
+
+        cursor.execute(f'DROP TABLE {placar}')
+        cursor.execute(f'''
+        CREATE TABLE {placar} (
+            candidato_id INTEGER PRIMARY KEY REFERENCES candidatos (id),
+            votos INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        cursor.execute(f'INSERT INTO {placar} (candidato_id, votos) SELECT candidato_id, COUNT(*) FROM {tabela} GROUP BY candidato_id')
+
+# Migração 5: horário de cada voto (segundos desde 1970, UTC) e os resumos de votos por
+# minuto e por hora de cada candidato, mantidos a cada voto para a linha do tempo.
+# Os votos antigos ficam sem horário até rodar `ferramentas.py preencher-linha-do-tempo`.
+def migracao_linha_do_tempo(cursor):
+    for tabela in ('intencao_voto', 'rejeicao'):
+        cursor.execute(f'ALTER TABLE {tabela} ADD COLUMN registrado_em INTEGER')
+    for resumo in ('votos_por_minuto', 'votos_por_hora'):
+        cursor.execute(f'''
+        CREATE TABLE {resumo} (
+            tipo TEXT NOT NULL,
+            inicio INTEGER NOT NULL,
+            candidato_id INTEGER NOT NULL REFERENCES candidatos (id),
+            votos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tipo, inicio, candidato_id)
+        ) WITHOUT ROWID
+        ''')
+
+# Migração 6: rodadas. Zerar tokens ou votos passa a ser começar uma nova rodada (uma
+# linha em `configuracao`) em vez de UPDATE/DELETE na tabela inteira. usado_intencao e
+# usado_rejeicao guardam a rodada em que o token foi usado (0 = nunca; os TRUE antigos
+# valem 1, que é a primeira rodada) e votos, placares e resumos guardam a rodada do voto.
+def migracao_rodadas(cursor):
+    for contador in ('rodada_tokens', 'rodada_intencao', 'rodada_rejeicao'):
+        cursor.execute(f'ALTER TABLE configuracao ADD COLUMN {contador} INTEGER NOT NULL DEFAULT 1')
+    for tabela, placar in (('intencao_voto', 'placar_intencao'), ('rejeicao', 'placar_rejeicao')):
+        cursor.execute(f'ALTER TABLE {tabela} ADD COLUMN rodada INTEGER NOT NULL DEFAULT 1')
+        cursor.execute(f'CREATE INDEX idx_{tabela}_rodada ON {tabela} (rodada)')
+        cursor.execute(f'''
+        CREATE TABLE {placar}_rodadas (
+            rodada INTEGER NOT NULL,
+            candidato_id INTEGER NOT NULL REFERENCES candidatos (id),
+            votos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (rodada, candidato_id)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'INSERT INTO {placar}_rodadas (rodada, candidato_id, votos) SELECT 1, candidato_id, votos FROM {placar}')
+        cursor.execute(f'DROP TABLE {placar}')
+        cursor.execute(f'ALTER TABLE {placar}_rodadas RENAME TO {placar}')
+    for resumo in ('votos_por_minuto', 'votos_por_hora'):
+        cursor.execute(f'''
+        CREATE TABLE {resumo}_rodadas (
+            tipo TEXT NOT NULL,
+            rodada INTEGER NOT NULL,
+            inicio INTEGER NOT NULL,
+            candidato_id INTEGER NOT NULL REFERENCES candidatos (id),
+            votos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tipo, rodada, inicio, candidato_id)
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'''
+        INSERT INTO {resumo}_rodadas (tipo, rodada, inicio, candidato_id, votos)
+        SELECT tipo, 1, inicio, candidato_id, votos FROM {resumo}
+        ''')
+        cursor.execute(f'DROP TABLE {resumo}')
+        cursor.execute(f'ALTER TABLE {resumo}_rodadas RENAME TO {resumo}')
+
+# Migrações em ordem; a versão do banco (PRAGMA user_version) é a quantidade já aplicada
+MIGRACOES = [
+    migracao_esquema_inicial,
+    migracao_indices,
+    migracao_tokens_binarios,
+    migracao_candidatos,
+    migracao_linha_do_tempo,
+    migracao_rodadas,
+]
+
+# Função para levar o banco até a versão mais recente do esquema.
+# Cada migração roda em sua própria transação junto com a troca de user_version;
+# a versão é relida depois do BEGIN IMMEDIATE caso outro processo tenha migrado antes.
+@medir()
+def aplicar_migracoes(conn):
+    while True:
+        com_retentativas('aplicar_migracoes', conn.execute, 'BEGIN IMMEDIATE')
+        try:
+            versao = conn.execute('PRAGMA user_version').fetchone()[0]
+            if versao >= len(MIGRACOES):
+                conn.execute('COMMIT')
+                return versao
+            MIGRACOES[versao](conn.cursor())
+            conn.execute(f'PRAGMA user_version = {versao + 1}')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+# Função para carregar as configurações atuais (compartilhadas via cache)
 def carregar_configuracoes():
-    conn = conectar_banco()
-    cursor = conn.cursor()
-    cursor.execute('SELECT exibir_real, candidato_favorecido FROM configuracao WHERE id = 1')
-    config = cursor.fetchone()
-    conn.close()
-    return config
+    def consultar():
+        with conectar_banco() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT exibir_real, candidato_favorecido FROM configuracao WHERE id = 1')
+            return cursor.fetchone()
+
+    return obter_cache_resultados().obter('configuracao', 'atual', consultar)
 
 # Função para salvar as configurações
+@medir()
 def salvar_configuracoes(exibir_real, candidato_favorecido=None):
-    conn = conectar_banco()
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE configuracao SET 
-        exibir_real = ?,
-        candidato_favorecido = ?,
-        data_hora = CURRENT_TIMESTAMP
-        WHERE id = 1
-    ''', (exibir_real, candidato_favorecido))
-    conn.commit()
-    conn.close()
+    with transacao() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE configuracao SET 
+            exibir_real = ?,
+            candidato_favorecido = ?,
+            data_hora = CURRENT_TIMESTAMP
+            WHERE id = 1
+        ''', (exibir_real, candidato_favorecido))
+    obter_cache_resultados().invalidar('configuracao')
+
+# Função para carregar a tabela de candidatos em ordem de exibição (compartilhada via cache).
+# Cada linha: (id, nome, ordem, intencao, rejeicao, ativo)
+def carregar_candidatos():
+    return obter_cache_resultados().obter('candidatos', 'todos', consultar_candidatos)
+
+@medir(contar_linhas=True)
+def consultar_candidatos():
+    with conectar_banco() as conn:
+        return conn.execute(
+            'SELECT id, nome, ordem, intencao, rejeicao, ativo FROM candidatos ORDER BY ordem, id'
+        ).fetchall()
+
+# Função para listar os candidatos ativos de uma pergunta ('intencao' ou 'rejeicao'),
+# como um dicionário id -> nome na ordem de exibição
+def candidatos_da_pergunta(tipo):
+    indice = 3 if tipo == 'intencao' else 4
+    return {linha[0]: linha[1] for linha in carregar_candidatos() if linha[5] and linha[indice]}
+
+# Função para salvar as alterações feitas na tabela de candidatos.
+# `linhas` são dicionários com id (None para candidato novo), nome, ordem, intencao,
+# rejeicao e ativo. Candidatos já votados nunca são apagados, só desativados.
+@medir()
+def salvar_candidatos(linhas):
+    with transacao() as conn:
+        cursor = conn.cursor()
+        ids_mantidos = []
+        for linha in linhas:
+            valores = (linha['nome'].strip(), int(linha['ordem']), bool(linha['intencao']),
+                       bool(linha['rejeicao']), bool(linha['ativo']))
+            if linha.get('id') is None:
+                cursor.execute('INSERT INTO candidatos (nome, ordem, intencao, rejeicao, ativo) VALUES (?, ?, ?, ?, ?)', valores)
+                ids_mantidos.append(cursor.lastrowid)
+            else:
+                cursor.execute('UPDATE candidatos SET nome = ?, ordem = ?, intencao = ?, rejeicao = ?, ativo = ? WHERE id = ?',
+                               valores + (int(linha['id']),))
+                ids_mantidos.append(int(linha['id']))
+        marcadores = ', '.join('?' * len(ids_mantidos))
+        cursor.execute(f'UPDATE candidatos SET ativo = FALSE WHERE id NOT IN ({marcadores})', ids_mantidos)
+    # Os nomes aparecem nos placares e gráficos já guardados em cache
+    obter_cache_resultados().invalidar('candidatos', 'intencao_voto', 'rejeicao')
 
 # =======================================
 # Código da Página do Usuário
 # =======================================
 
+# Taxa de falsos positivos desejada para o filtro de Bloom dos tokens
+FILTRO_TOKENS_ERRO = 0.001
+
+# Capacidade mínima do filtro de Bloom (cresce junto com a quantidade de tokens)
+FILTRO_TOKENS_CAPACIDADE = 100000
+
+# Quantidade de estados de token guardados no cache LRU
+ESTADOS_TOKENS_LRU = 50000
+
+# Intervalo mínimo (em segundos) entre duas buscas por tokens novos no banco, feitas
+# quando um token não está no filtro: tokens criados por outro processo ou por um
+# script passam a valer em no máximo este tempo, e uma enxurrada de links inventados
+# não vira uma consulta ao banco por link
+FILTRO_TOKENS_CONFERENCIA = 1.0
+
+# Função para converter o token da URL nos 16 bytes do UUID; None se não for um UUID
+def token_para_bytes(token):
+    try:
+        return uuid.UUID(token).bytes
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+# Função para converter os 16 bytes guardados no banco de volta no texto do link
+def bytes_para_token(chave):
+    return None if chave is None else str(uuid.UUID(bytes=chave))
+
+
+# Filtro de Bloom: responde "com certeza não existe" ou "talvez exista" usando poucos
+# bits por elemento. Os tokens já são 16 bytes aleatórios, então as posições saem
+# deles mesmos, sem um hash criptográfico: cada metade passa por um XOR com uma chave
+# aleatória por processo e pelo misturador do splitmix64 (não dá para fabricar tokens
+# que passem pelo filtro de propósito sem conhecer a chave). A inclusão em massa faz
+# essas contas com numpy, para todos os tokens de um lote de uma vez.
+MASCARA_64_BITS = 0xFFFFFFFFFFFFFFFF
+
+# Função para misturar um inteiro de 64 bits (finalizador do splitmix64)
+def misturar_64_bits(x):
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASCARA_64_BITS
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASCARA_64_BITS
+    return x ^ (x >> 31)
+
+# Mesma mistura sobre um array numpy de uint64 (a multiplicação já dá a volta em 64 bits)
+def misturar_64_bits_np(x):
+    import numpy as np
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+class FiltroBloom:
+    def __init__(self, capacidade, taxa_erro=FILTRO_TOKENS_ERRO):
+        self.capacidade = capacidade
+        self.total_bits = max(8, int(-capacidade * math.log(taxa_erro) / math.log(2) ** 2))
+        self.quantidade_hashes = max(1, round(self.total_bits / capacidade * math.log(2)))
+        self.bits = bytearray((self.total_bits + 7) // 8)
+        self.elementos = 0
+        self.ultimo_id = 0  # maior id de token já incluído
+        self._chave = (secrets.randbits(64), secrets.randbits(64))
+
+    def _posicoes(self, valor):
+        h1 = misturar_64_bits(int.from_bytes(valor[:8], 'little') ^ self._chave[0])
+        h2 = misturar_64_bits(int.from_bytes(valor[8:], 'little') ^ self._chave[1]) | 1
+        total_bits = self.total_bits
+        return [((h1 + i * h2) & MASCARA_64_BITS) % total_bits for i in range(self.quantidade_hashes)]
+
+    def adicionar(self, valor):
+        self.adicionar_todos((valor,))
+
+    def adicionar_todos(self, valores):
+        import numpy as np
+        if not valores:
+            return
+        metades = np.frombuffer(b''.join(valores), dtype='<u8').reshape(-1, 2)
+        h1 = misturar_64_bits_np(metades[:, 0] ^ np.uint64(self._chave[0]))
+        h2 = misturar_64_bits_np(metades[:, 1] ^ np.uint64(self._chave[1])) | np.uint64(1)
+        posicoes = (h1[:, None] + np.arange(self.quantidade_hashes, dtype=np.uint64) * h2[:, None]) % np.uint64(self.total_bits)
+        np.bitwise_or.at(np.frombuffer(self.bits, dtype=np.uint8), posicoes >> np.uint64(3),
+                         np.uint8(1) << (posicoes & np.uint64(7)).astype(np.uint8))
+        self.elementos += len(metades)
+
+    def __contains__(self, valor):
+        return all(self.bits[posicao >> 3] & (1 << (posicao & 7)) for posicao in self._posicoes(valor))
+
+
+# Índice em memória dos tokens: o filtro de Bloom recusa links inexistentes sem
+# consultar o SQLite, e um LRU guarda o estado (usado_intencao, usado_rejeicao) na
+# rodada atual dos tokens consultados recentemente, inclusive os que não existem (cache negativo).
+# O filtro é montado em segundo plano; até ficar pronto, tudo é respondido pelo banco.
+class IndiceTokens:
+    def __init__(self, pool, tamanho_lru=ESTADOS_TOKENS_LRU):
+        self._pool = pool
+        self._trava = threading.Lock()
+        self._trava_atualizacao = threading.Lock()  # uma busca por tokens novos de cada vez
+        self._estados = OrderedDict()
+        self.tamanho_lru = tamanho_lru
+        self.recusados_filtro = 0
+        self.acertos_lru = 0
+        self.consultas_banco = 0
+        self._filtro = None
+        self._montando = False
+        self._proxima_conferencia = 0.0
+        self._montar_em_segundo_plano()
+
+    # Começa a montar um filtro novo, se já não houver um sendo montado (chamar com a trava)
+    def _montar_em_segundo_plano(self, capacidade_minima=0):
+        if self._montando:
+            return
+        self._montando = True
+        threading.Thread(target=self._montar_filtro, args=(capacidade_minima,), name='indice-tokens', daemon=True).start()
+
+    # Monta o filtro lendo todos os tokens do banco em blocos, sem segurar a trava do índice
+    @medir()
+    def _carregar_filtro(self, capacidade_minima=0):
+        conn = self._pool.adquirir()
+        try:
+            total, ultimo_id = conn.execute('SELECT COUNT(*), COALESCE(MAX(id), 0) FROM tokens').fetchone()
+            filtro = FiltroBloom(max(FILTRO_TOKENS_CAPACIDADE, 2 * max(total, capacidade_minima)))
+            cursor = conn.execute('SELECT token FROM tokens WHERE id <= ?', (ultimo_id,))
+            for bloco in iter(lambda: cursor.fetchmany(LINHAS_POR_BLOCO), []):
+                filtro.adicionar_todos([chave for (chave,) in bloco])
+            filtro.ultimo_id = ultimo_id
+        finally:
+            self._pool.devolver(conn)
+        return filtro
+
+    def _montar_filtro(self, capacidade_minima):
+        try:
+            filtro = self._carregar_filtro(capacidade_minima)
+        except sqlite3.Error:
+            filtro = None  # já contado nas métricas; a próxima falta no filtro tenta de novo
+        with self._trava:
+            self._montando = False
+            if filtro is not None:
+                self._filtro = filtro
+                # "Não existe" guardado antes do filtro pode ser de um token criado depois
+                for chave in [chave for chave, estado in self._estados.items() if estado is None]:
+                    del self._estados[chave]
+        if filtro is not None:
+            self._atualizar_filtro()  # tokens criados enquanto o filtro era montado
+
+    # Acrescenta ao filtro os tokens com id maior que o último incluído. Se o maior id
+    # do banco diminuiu (backup restaurado), o filtro é descartado e montado de novo.
+    def _atualizar_filtro(self):
+        with self._trava_atualizacao:
+            with self._trava:
+                filtro = self._filtro
+            if filtro is None:
+                return
+            conn = self._pool.adquirir()
+            try:
+                maior_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM tokens').fetchone()[0]
+                novos = [] if maior_id <= filtro.ultimo_id else conn.execute(
+                    'SELECT token FROM tokens WHERE id > ? AND id <= ?', (filtro.ultimo_id, maior_id)).fetchall()
+            finally:
+                self._pool.devolver(conn)
+            with self._trava:
+                if self._filtro is not filtro:
+                    return
+                if maior_id < filtro.ultimo_id:
+                    self._filtro = None
+                    self._estados.clear()
+                    self._montar_em_segundo_plano()
+                    return
+                self._incluir(filtro, [chave for (chave,) in novos], maior_id)
+
+    # Inclui as chaves no filtro (chamar com a trava); acima da capacidade a taxa de erro
+    # sobe, então um filtro com o dobro do espaço é montado em segundo plano
+    def _incluir(self, filtro, chaves, ultimo_id):
+        filtro.adicionar_todos(chaves)
+        filtro.ultimo_id = max(filtro.ultimo_id, ultimo_id)
+        self._esquecer(chaves)
+        if filtro.elementos > filtro.capacidade:
+            self._montar_em_segundo_plano(filtro.elementos)
+
+    # Registra tokens recém-criados, já em bytes, com ids até `ultimo_id` (chamado depois do COMMIT)
+    def adicionar(self, chaves, ultimo_id):
+        with self._trava:
+            if self._filtro is not None:
+                # Sem buraco entre os ids: nada criado por outro processo ficou de fora
+                contiguo = ultimo_id - len(chaves) == self._filtro.ultimo_id
+                self._incluir(self._filtro, chaves, ultimo_id if contiguo else 0)
+            else:
+                self._esquecer(chaves)
+
+    # Tira do LRU o "não existe" guardado para tokens que acabaram de ser criados,
+    # percorrendo o menor dos dois (um lote de criação é bem maior que o LRU)
+    def _esquecer(self, chaves):
+        if len(self._estados) < len(chaves):
+            novas = set(chaves)
+            for chave in [chave for chave in self._estados if chave in novas]:
+                del self._estados[chave]
+        else:
+            for chave in chaves:
+                self._estados.pop(chave, None)
+
+    # Falso se o token com certeza não existe. Um token fora do filtro ainda pode ter
+    # sido criado fora deste processo: no máximo uma vez por FILTRO_TOKENS_CONFERENCIA
+    # o filtro busca os tokens novos no banco antes de recusar.
+    def _talvez_exista(self, chave):
+        with self._trava:
+            if self._filtro is None or chave in self._filtro:
+                return True
+            agora = time.monotonic()
+            if agora < self._proxima_conferencia:
+                return False
+            self._proxima_conferencia = agora + FILTRO_TOKENS_CONFERENCIA
+        self._atualizar_filtro()
+        with self._trava:
+            return self._filtro is None or chave in self._filtro
+
+    # Estado do token: (usado_intencao, usado_rejeicao), ou None se o token não existe
+    def estado(self, token):
+        chave = token_para_bytes(token)
+        if chave is None or not self._talvez_exista(chave):
+            with self._trava:
+                self.recusados_filtro += 1
+            return None
+        with self._trava:
+            if chave in self._estados:
+                self._estados.move_to_end(chave)
+                self.acertos_lru += 1
+                return self._estados[chave]
+            self.consultas_banco += 1
+
+        conn = self._pool.adquirir()
+        try:
+            resultado = conn.execute(
+                f'SELECT usado_intencao = {RODADA_TOKENS}, usado_rejeicao = {RODADA_TOKENS} FROM tokens WHERE token = ?',
+                (chave,),
+            ).fetchone()
+        finally:
+            self._pool.devolver(conn)
+
+        with self._trava:
+            self._estados[chave] = resultado
+            if len(self._estados) > self.tamanho_lru:
+                self._estados.popitem(last=False)
+        return resultado
+
+    def invalidar_estado(self, token):
+        with self._trava:
+            self._estados.pop(token_para_bytes(token), None)
+
+    def limpar_estados(self):
+        with self._trava:
+            self._estados.clear()
+
+    def metricas(self):
+        with self._trava:
+            return {
+                'recusados_filtro': self.recusados_filtro,
+                'acertos_lru': self.acertos_lru,
+                'consultas_banco': self.consultas_banco,
+                'tokens_no_filtro': self._filtro.elementos if self._filtro is not None else 0,
+                'estados_em_cache': len(self._estados),
+            }
+
+
+# Índice de tokens criado uma única vez por processo e por banco de enquete
+@recurso_compartilhado
+def indice_da_enquete(caminho):
+    return IndiceTokens(pool_da_enquete(caminho))
+
+# Índice de tokens da enquete atual
+def obter_indice_tokens():
+    return indice_da_enquete(caminho_banco())
+
 # Função para verificar o estado do token
+@medir()
 def verificar_token(token):
-    conn = conectar_banco()
-    cursor = conn.cursor()
-    cursor.execute('SELECT usado_intencao, usado_rejeicao FROM tokens WHERE token = ?', (token,))
-    resultado = cursor.fetchone()
-    conn.close()
-    return resultado
-
-# Função para marcar o token como usado na intenção de voto
-def marcar_token_como_usado_intencao(token):
-    conn = conectar_banco()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE tokens SET usado_intencao = TRUE WHERE token = ?', (token,))
-    conn.commit()
-    conn.close()
-
-# Função para marcar o token como usado na rejeição
-def marcar_token_como_usado_rejeicao(token):
-    conn = conectar_banco()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE tokens SET usado_rejeicao = TRUE WHERE token = ?', (token,))
-    conn.commit()
-    conn.close()
-
-# Função para registrar a intenção de voto
-def registrar_intencao_voto(candidato, token):
-    conn = conectar_banco()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO intencao_voto (candidato, token) VALUES (?, ?)', (candidato, token))
-    conn.commit()
-    conn.close()
-
-# Função para registrar a rejeição
-def registrar_rejeicao(candidato, token):
-    conn = conectar_banco()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO rejeicao (candidato, token) VALUES (?, ?)', (candidato, token))
-    conn.commit()
-    conn.close()
+    return obter_indice_tokens().estado(token)
+
+# Tabela de votos, coluna de controle do token e tabela de placar de cada tipo de voto
+TIPOS_VOTO = {
+    'intencao': ('intencao_voto', 'usado_intencao', 'placar_intencao'),
+    'rejeicao': ('rejeicao', 'usado_rejeicao', 'placar_rejeicao'),
+}
+
+# Contador de rodada (coluna de `configuracao`) dos votos de cada tipo
+RODADAS_VOTO = {
+    'intencao': 'rodada_intencao',
+    'rejeicao': 'rodada_rejeicao',
+}
+
+# Subconsulta com a rodada atual de um contador; o SQLite a avalia uma vez por comando
+def rodada_atual(contador):
+    return f'(SELECT {contador} FROM configuracao WHERE id = 1)'
+
+# Rodada atual dos tokens: um token está usado se a sua coluna guarda esta rodada
+RODADA_TOKENS = rodada_atual('rodada_tokens')
+
+# Contadores de rodada guardados em `configuracao`
+CONTADORES_RODADA = ('rodada_tokens', 'rodada_intencao', 'rodada_rejeicao')
+
+# Função para ler a rodada atual de cada contador, como dicionário contador -> rodada
+def ler_rodadas(cursor):
+    linha = cursor.execute(f'SELECT {", ".join(CONTADORES_RODADA)} FROM configuracao WHERE id = 1').fetchone()
+    return dict(zip(CONTADORES_RODADA, linha))
+
+# Resumos da linha do tempo: tabela e largura (em segundos) de cada faixa de tempo
+LINHAS_DO_TEMPO = {
+    'minuto': ('votos_por_minuto', 60),
+    'hora': ('votos_por_hora', 3600),
+}
+
+# Função para gravar um voto dentro de uma transação já aberta.
+# O token só é marcado como usado se ainda não tiver sido na rodada atual (compare-and-set)
+# e o voto é inserido logo em seguida; retorna False se o token já tinha votado.
+# `momento` é o horário do voto (time.time()); o padrão é agora. `rodadas` (de
+# ler_rodadas) evita reler a configuração a cada voto de um mesmo lote.
+def gravar_voto(cursor, tipo, candidato_id, token, momento=None, rodadas=None):
+    tabela, coluna, placar = TIPOS_VOTO[tipo]
+    chave = token_para_bytes(token)
+    rodadas = rodadas or ler_rodadas(cursor)
+    rodada_tokens, rodada = rodadas['rodada_tokens'], rodadas[RODADAS_VOTO[tipo]]
+    cursor.execute(f'UPDATE tokens SET {coluna} = ? WHERE token = ? AND {coluna} != ?', (rodada_tokens, chave, rodada_tokens))
+    if cursor.rowcount != 1:
+        return False
+    momento = int(time.time() if momento is None else momento)
+    cursor.execute(f'INSERT INTO {tabela} (candidato_id, token_id, registrado_em, rodada) SELECT ?, id, ?, ? FROM tokens WHERE token = ?',
+                   (candidato_id, momento, rodada, chave))
+    cursor.execute(f'''
+        INSERT INTO {placar} (rodada, candidato_id, votos) VALUES (?, ?, 1)
+        ON CONFLICT (rodada, candidato_id) DO UPDATE SET votos = votos + 1
+    ''', (rodada, candidato_id))
+    for resumo, largura in LINHAS_DO_TEMPO.values():
+        cursor.execute(f'''
+            INSERT INTO {resumo} (tipo, rodada, inicio, candidato_id, votos) VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT (tipo, rodada, inicio, candidato_id) DO UPDATE SET votos = votos + 1
+        ''', (tipo, rodada, momento - momento % largura, candidato_id))
+    return True
+
+# Votos aguardando confirmação ao mesmo tempo no processo (todas as enquetes) e o
+# tempo (em segundos) que um voto novo espera por uma vaga antes de ser recusado
+LIMITE_VOTOS_PENDENTES = 200
+ESPERA_VAGA_VOTO = 2
+
+
+# Voto recusado porque o limite de votos pendentes estava cheio; nada foi gravado
+class SistemaOcupado(Exception):
+    pass
+
+# Voto recusado porque o candidato não está ativo na pergunta (desativado depois de o
+# formulário ser exibido, por exemplo); nada foi gravado
+class CandidatoInvalido(ValueError):
+    pass
+
+
+# Vagas de votos pendentes, criadas uma única vez por processo
+@recurso_compartilhado
+def obter_limite_votos():
+    return threading.BoundedSemaphore(LIMITE_VOTOS_PENDENTES)
+
+# Função para registrar um voto (intenção ou rejeição) no candidato de id `candidato_id`.
+# O voto entra na fila de gravação e a função só retorna depois que o lote em
+# que ele foi gravado recebeu COMMIT; retorna False se o token já tinha votado.
+# Com LIMITE_VOTOS_PENDENTES votos já esperando, recusa o voto com SistemaOcupado
+# em vez de deixar a fila crescer até as sessões estourarem o FILA_TIMEOUT.
+@medir()
+def registrar_voto(tipo, candidato_id, token):
+    if candidato_id not in candidatos_da_pergunta(tipo):
+        raise CandidatoInvalido(f'Candidato inválido para {tipo}: {candidato_id}')
+    limite = obter_limite_votos()
+    if not limite.acquire(timeout=ESPERA_VAGA_VOTO):
+        obter_metricas().somar('registrar_voto', 'rejeitadas')
+        raise SistemaOcupado('Muitos votos aguardando gravação.')
+    try:
+        return obter_fila_votos().enviar(tipo, candidato_id, token)
+    finally:
+        limite.release()
+
+# Função para registrar o voto enviado por um formulário da página do eleitor.
+# Retorna o mesmo que registrar_voto, ou None se o voto não pôde ser gravado agora
+# (a mensagem para tentar de novo já foi exibida e o link continua valendo). O
+# candidato escolhido pode ter sido desativado entre a exibição e o envio do formulário.
+def registrar_voto_formulario(tipo, candidato_id, token):
+    try:
+        return registrar_voto(tipo, candidato_id, token)
+    except CandidatoInvalido:
+        st.warning("Essa opção não está mais disponível. Escolha outra opção e envie de novo.")
+    except SistemaOcupado:
+        st.warning("Muitas pessoas votando neste momento. Tente novamente em instantes.")
+    except (sqlite3.OperationalError, TimeoutError):
+        st.error("Não foi possível registrar seu voto agora. Tente novamente em instantes.")
+    return None
 
 # Função para exibir a tabela `configuracao` como dataframe
 def exibir_dataframe_configuracao():
-    conn = conectar_banco()
-    df = pd.read_sql_query("SELECT * FROM configuracao", conn)
-    conn.close()
-    return df
-
-# Função para exibir a tabela de tokens
-def exibir_tokens():
-    conn = conectar_banco()
-    df = pd.read_sql_query("SELECT * FROM tokens", conn)
-    conn.close()
-    return df
-
-# Função para exibir a tabela de intenção de votos
-def exibir_tabela_intencao_votos():
-    conn = conectar_banco()
-    df = pd.read_sql_query("SELECT * FROM intencao_voto", conn)
-    conn.close()
-    return df
-
-# Função para exibir a tabela de rejeição
-def exibir_tabela_rejeicao():
-    conn = conectar_banco()
-    df = pd.read_sql_query("SELECT * FROM rejeicao", conn)
-    conn.close()
+    with conectar_banco() as conn:
+        import pandas as pd
+        df = pd.read_sql_query("SELECT * FROM configuracao", conn)
     return df
 
-# Função para zerar os tokens
+# Quantidade de linhas por página nas tabelas da página de administração
+TAMANHO_PAGINA = 100
+
+# Filtros de situação dos tokens (na rodada atual) aceitos por buscar_pagina_tokens/contar_tokens
+SITUACOES_TOKEN = {
+    'Todos': None,
+    'Não usados': f'usado_intencao != {RODADA_TOKENS} AND usado_rejeicao != {RODADA_TOKENS}',
+    'Usados na intenção de voto': f'usado_intencao = {RODADA_TOKENS}',
+    'Usados na rejeição': f'usado_rejeicao = {RODADA_TOKENS}',
+    'Usados nos dois': f'usado_intencao = {RODADA_TOKENS} AND usado_rejeicao = {RODADA_TOKENS}',
+}
+
+# Função para montar o filtro por prefixo do token (texto hexadecimal, com ou sem
+# hífens) como um intervalo de bytes, para usar o índice da coluna BLOB
+def filtro_prefixo(prefixo, coluna='token'):
+    digitos = prefixo.replace('-', '').lower()[:32]
+    try:
+        inicio = bytes.fromhex(digitos.ljust(32, '0'))
+    except ValueError:
+        return '0', []  # não é hexadecimal: nenhum token começa assim
+    # Próximo valor depois de todos os tokens com esse prefixo
+    passo = 1 << (4 * (32 - len(digitos)))
+    fim = int.from_bytes(inicio, 'big') + passo
+    if fim >= 1 << 128:
+        return f'{coluna} >= ?', [inicio]
+    return f'{coluna} >= ? AND {coluna} < ?', [inicio, fim.to_bytes(16, 'big')]
+
+def filtros_tokens(situacao=None, prefixo=None):
+    condicoes, parametros = [], []
+    if SITUACOES_TOKEN.get(situacao):
+        condicoes.append(SITUACOES_TOKEN[situacao])
+    if prefixo:
+        condicao, valores = filtro_prefixo(prefixo)
+        condicoes.append(condicao)
+        parametros.extend(valores)
+    return condicoes, parametros
+
+# Função para buscar uma página de tokens (paginação por chave: token > último da página anterior)
+@medir(contar_linhas=True)
+def buscar_pagina_tokens(apos=None, situacao=None, prefixo=None, limite=TAMANHO_PAGINA):
+    condicoes, parametros = filtros_tokens(situacao, prefixo)
+    if apos is not None:
+        condicoes.append('token > ?')
+        parametros.append(token_para_bytes(apos))
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+    with conectar_banco() as conn:
+        return conn.execute(
+            f'SELECT uuid_texto(token), usado_intencao = {RODADA_TOKENS}, usado_rejeicao = {RODADA_TOKENS} '
+            f'FROM tokens {where} ORDER BY token LIMIT ?',
+            parametros + [limite],
+        ).fetchall()
+
+# Função para contar os tokens que atendem aos filtros
+@medir()
+def contar_tokens(situacao=None, prefixo=None):
+    condicoes, parametros = filtros_tokens(situacao, prefixo)
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+    with conectar_banco() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM tokens {where}', parametros).fetchone()[0]
+
+def filtros_votos(tipo, candidato=None, prefixo=None):
+    condicoes, parametros = [f'v.rodada = {rodada_atual(RODADAS_VOTO[tipo])}'], []
+    if candidato:
+        condicoes.append('v.candidato_id = ?')
+        parametros.append(candidato)
+    if prefixo:
+        condicao, valores = filtro_prefixo(prefixo, 't.token')
+        condicoes.append(condicao)
+        parametros.extend(valores)
+    return condicoes, parametros
+
+# Função para buscar uma página de votos (paginação por chave: id > último da página anterior).
+# `candidato` é o id do candidato.
+@medir(contar_linhas=True)
+def buscar_pagina_votos(tipo, apos=None, candidato=None, prefixo=None, limite=TAMANHO_PAGINA):
+    tabela = TIPOS_VOTO[tipo][0]
+    condicoes, parametros = filtros_votos(tipo, candidato, prefixo)
+    if apos is not None:
+        condicoes.append('v.id > ?')
+        parametros.append(apos)
+    with conectar_banco() as conn:
+        return conn.execute(f'''
+            SELECT v.id, c.nome, uuid_texto(t.token) FROM {tabela} v
+            JOIN candidatos c ON c.id = v.candidato_id
+            LEFT JOIN tokens t ON t.id = v.token_id
+            WHERE {' AND '.join(condicoes)} ORDER BY v.id LIMIT ?
+        ''', parametros + [limite]).fetchall()
+
+# Função para contar os votos que atendem aos filtros.
+# Sem filtro por token a contagem sai direto do placar, sem percorrer os votos.
+@medir()
+def contar_votos(tipo, candidato=None, prefixo=None):
+    tabela, _, placar = TIPOS_VOTO[tipo]
+    rodada = rodada_atual(RODADAS_VOTO[tipo])
+    with conectar_banco() as conn:
+        if not prefixo:
+            if candidato:
+                linha = conn.execute(f'SELECT votos FROM {placar} WHERE rodada = {rodada} AND candidato_id = ?',
+                                     (candidato,)).fetchone()
+                return linha[0] if linha else 0
+            return conn.execute(f'SELECT COALESCE(SUM(votos), 0) FROM {placar} WHERE rodada = {rodada}').fetchone()[0]
+        condicoes, parametros = filtros_votos(tipo, candidato, prefixo)
+        return conn.execute(
+            f"SELECT COUNT(*) FROM {tabela} v JOIN tokens t ON t.id = v.token_id WHERE {' AND '.join(condicoes)}",
+            parametros,
+        ).fetchone()[0]
+
+# Função para listar os candidatos que já receberam votos de um tipo, como (id, nome)
+@medir(contar_linhas=True)
+def listar_candidatos_votados(tipo):
+    placar = TIPOS_VOTO[tipo][2]
+    with conectar_banco() as conn:
+        return conn.execute(f'''
+            SELECT c.id, c.nome FROM {placar} p JOIN candidatos c ON c.id = p.candidato_id
+            WHERE p.rodada = {rodada_atual(RODADAS_VOTO[tipo])} AND p.votos > 0 ORDER BY c.ordem, c.id
+        ''').fetchall()
+
+# Função para começar uma nova rodada de um contador (rodada_tokens, rodada_intencao ou
+# rodada_rejeicao): uma única linha alterada, qualquer que seja o tamanho do banco. O que
+# ficou nas rodadas anteriores passa a ser ignorado e é apagado depois, em segundo plano.
+def nova_rodada(contador):
+    with transacao() as conn:
+        conn.execute(f'UPDATE configuracao SET {contador} = {contador} + 1 WHERE id = 1')
+        rodada = ler_rodadas(conn)[contador]
+    if DIARIO_VOTOS:
+        obter_diario().acrescentar([diario.registro_de_rodada(contador, rodada, time.time())])
+
+# Função para zerar os tokens (todos voltam a valer na nova rodada)
+@medir()
 def zerar_tokens():
-    conn = conectar_banco()
-    cursor = conn.cursor()
-    cursor.execute('UPDATE tokens SET usado_intencao = FALSE, usado_rejeicao = FALSE')
-    conn.commit()
-    conn.close()
+    nova_rodada('rodada_tokens')
+    obter_indice_tokens().limpar_estados()
 
 # Função para zerar a tabela de intenção de votos
+@medir()
 def zerar_intencao_votos():
-    conn = conectar_banco()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM intencao_voto')
-    conn.commit()
-    conn.close()
+    nova_rodada('rodada_intencao')
+    obter_cache_resultados().invalidar('intencao_voto')
+    obter_limpeza_rodadas().agendar()
 
 # Função para zerar a tabela de rejeição
+@medir()
 def zerar_rejeicao():
-    conn = conectar_banco()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM rejeicao')
-    conn.commit()
-    conn.close()
+    nova_rodada('rodada_rejeicao')
+    obter_cache_resultados().invalidar('rejeicao')
+    obter_limpeza_rodadas().agendar()
+
+# Votos de rodadas antigas apagados por transação e a pausa (em segundos) entre duas
+# transações da limpeza, para os lotes de votos novos passarem na frente
+LINHAS_POR_LIMPEZA = 2000
+PAUSA_LIMPEZA = 0.05
+
+
+# Limpeza das rodadas antigas em segundo plano: apaga votos, placares e resumos das
+# rodadas anteriores em transações curtas, sem segurar a trava de escrita por segundos
+# (nem inchar o WAL) enquanto os eleitores continuam votando. Os tokens não precisam de
+# limpeza: um token usado em rodada antiga simplesmente não está usado na atual.
+class LimpezaRodadas:
+    def __init__(self, caminho):
+        self._pedido = threading.Event()
+        self._trava = threading.Lock()
+        self.execucoes = 0
+        self.linhas_apagadas = 0
+        self.em_andamento = False
+
+        # Conexão exclusiva da limpeza, como a do gravador de votos
+        self._conn = abrir_conexao(caminho)
+
+        self._thread = threading.Thread(target=self._executar, name='limpeza-rodadas', daemon=True)
+        self._thread.start()
+        self.agendar()  # rodadas que um processo anterior deixou para trás
+
+    def agendar(self):
+        self._pedido.set()
+
+    # Apaga até LINHAS_POR_LIMPEZA votos antigos de cada tipo; retorna quantos apagou
+    @medir()
+    def _apagar_lote(self):
+        cursor = self._conn.cursor()
+        com_retentativas('LimpezaRodadas._apagar_lote', cursor.execute, 'BEGIN IMMEDIATE')
+        apagadas = 0
+        try:
+            for tipo, (tabela, _, placar) in TIPOS_VOTO.items():
+                rodada = rodada_atual(RODADAS_VOTO[tipo])
+                cursor.execute(f'''
+                    DELETE FROM {tabela} WHERE id IN (SELECT id FROM {tabela} WHERE rodada < {rodada} LIMIT ?)
+                ''', (LINHAS_POR_LIMPEZA,))
+                apagadas += cursor.rowcount
+                cursor.execute(f'DELETE FROM {placar} WHERE rodada < {rodada}')
+                for resumo, _ in LINHAS_DO_TEMPO.values():
+                    cursor.execute(f'DELETE FROM {resumo} WHERE tipo = ? AND rodada < {rodada}', (tipo,))
+            cursor.execute('COMMIT')
+        except BaseException:
+            if self._conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
+        return apagadas
+
+    def _executar(self):
+        while True:
+            self._pedido.wait()
+            self._pedido.clear()
+            with self._trava:
+                self.em_andamento = True
+            try:
+                while True:
+                    apagadas = self._apagar_lote()
+                    with self._trava:
+                        self.linhas_apagadas += apagadas
+                    if not apagadas:
+                        break
+                    time.sleep(PAUSA_LIMPEZA)
+            except sqlite3.Error:
+                pass  # já contado nas métricas de _apagar_lote; o resto fica para a próxima troca de rodada
+            with self._trava:
+                self.execucoes += 1
+                self.em_andamento = False
+
+    def metricas(self):
+        with self._trava:
+            return {
+                'execucoes': self.execucoes,
+                'linhas_apagadas': self.linhas_apagadas,
+                'em_andamento': self.em_andamento,
+            }
+
+
+# Limpeza criada uma única vez por processo e por banco de enquete
+@recurso_compartilhado
+def limpeza_da_enquete(caminho):
+    pool_da_enquete(caminho)  # garante WAL ativo antes da conexão da limpeza
+    return LimpezaRodadas(caminho)
+
+# Limpeza das rodadas antigas da enquete atual
+def obter_limpeza_rodadas():
+    return limpeza_da_enquete(caminho_banco())
+
+# Função para consultar a rodada atual de cada contador, como dicionário contador -> rodada
+def consultar_rodadas():
+    with conectar_banco() as conn:
+        return ler_rodadas(conn)
+
+# Função para refazer os resumos da linha do tempo da rodada atual a partir dos votos que têm horário
+def recalcular_linha_do_tempo(cursor, tipo):
+    tabela = TIPOS_VOTO[tipo][0]
+    rodada = rodada_atual(RODADAS_VOTO[tipo])
+    for resumo, largura in LINHAS_DO_TEMPO.values():
+        cursor.execute(f'DELETE FROM {resumo} WHERE tipo = ? AND rodada = {rodada}', (tipo,))
+        cursor.execute(f'''
+            INSERT INTO {resumo} (tipo, rodada, inicio, candidato_id, votos)
+            SELECT ?, rodada, registrado_em - registrado_em % {largura}, candidato_id, COUNT(*) FROM {tabela}
+            WHERE rodada = {rodada} AND registrado_em IS NOT NULL
+            GROUP BY 3, 4
+        ''', (tipo,))
+
+# Função para dar horário aos votos gravados antes da linha do tempo existir e refazer
+# os resumos. Os votos sem horário recebem `momento` (time.time(); o padrão é agora).
+# Retorna um dicionário tipo -> quantidade de votos preenchidos.
+@medir()
+def preencher_linha_do_tempo(momento=None):
+    momento = int(time.time() if momento is None else momento)
+    preenchidos = {}
+    with transacao() as conn:
+        cursor = conn.cursor()
+        for tipo, (tabela, _, _) in TIPOS_VOTO.items():
+            cursor.execute(f'UPDATE {tabela} SET registrado_em = ? WHERE registrado_em IS NULL', (momento,))
+            preenchidos[tipo] = cursor.rowcount
+            recalcular_linha_do_tempo(cursor, tipo)
+    obter_cache_resultados().invalidar(*(tabela for tabela, _, _ in TIPOS_VOTO.values()))
+    return preenchidos
+
+# Função para refazer o placar da rodada atual contando os votos da tabela bruta
+def recalcular_placar(cursor, tipo):
+    tabela, _, placar = TIPOS_VOTO[tipo]
+    rodada = rodada_atual(RODADAS_VOTO[tipo])
+    cursor.execute(f'DELETE FROM {placar} WHERE rodada = {rodada}')
+    cursor.execute(f'''
+        INSERT INTO {placar} (rodada, candidato_id, votos)
+        SELECT rodada, candidato_id, COUNT(*) FROM {tabela} WHERE rodada = {rodada} GROUP BY candidato_id
+    ''')
+
+# Função para comparar o placar da rodada atual com a contagem real dos votos.
+# Retorna uma lista de (candidato, votos no placar, votos reais) com as divergências.
+@medir(contar_linhas=True)
+def verificar_placar(tipo):
+    tabela, _, placar = TIPOS_VOTO[tipo]
+    rodada = rodada_atual(RODADAS_VOTO[tipo])
+    with conectar_banco() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT COALESCE(c.nome, d.candidato_id), d.no_placar, d.reais FROM (
+                SELECT candidato_id, SUM(no_placar) AS no_placar, SUM(reais) AS reais FROM (
+                    SELECT candidato_id, votos AS no_placar, 0 AS reais FROM {placar} WHERE rodada = {rodada} AND votos > 0
+                    UNION ALL
+                    SELECT candidato_id, 0, COUNT(*) FROM {tabela} WHERE rodada = {rodada} GROUP BY candidato_id
+                )
+                GROUP BY candidato_id
+                HAVING SUM(no_placar) != SUM(reais)
+            ) d
+            LEFT JOIN candidatos c ON c.id = d.candidato_id
+            ORDER BY c.ordem, d.candidato_id
+        ''')
+        divergencias = cursor.fetchall()
+    return divergencias
+
+# Função para reconstruir o placar a partir dos votos registrados
+@medir()
+def reconstruir_placar(tipo):
+    with transacao() as conn:
+        recalcular_placar(conn.cursor(), tipo)
+    obter_cache_resultados().invalidar(TIPOS_VOTO[tipo][0])
+
+# Função para somar os totais do diário da enquete atual: o último instantâneo mais a
+# cauda, lidos por mmap, sem consultar o banco
+@medir()
+def totais_do_diario():
+    return diario.totais_atuais(diario.caminho_diario(caminho_banco()))
+
+# Função para comparar o placar da rodada atual com os totais do diário (de
+# totais_do_diario). Retorna uma lista de (candidato, votos no placar, votos no diário)
+# com as divergências, na ordem de exibição dos candidatos.
+@medir(contar_linhas=True)
+def conferir_placar_com_diario(tipo, estado):
+    placar = TIPOS_VOTO[tipo][2]
+    with conectar_banco() as conn:
+        rodada = ler_rodadas(conn)[RODADAS_VOTO[tipo]]
+        no_placar = dict(conn.execute(f'SELECT candidato_id, votos FROM {placar} WHERE rodada = ? AND votos > 0', (rodada,)))
+        nomes = conn.execute('SELECT id, nome FROM candidatos ORDER BY ordem, id').fetchall()
+    no_diario = {candidato_id: votos for (r, candidato_id), votos in estado['placar'][tipo].items() if r == rodada}
+    ordem = {candidato_id: posicao for posicao, (candidato_id, _) in enumerate(nomes)}
+    nomes = dict(nomes)
+    return [
+        (nomes.get(candidato_id, candidato_id), no_placar.get(candidato_id, 0), no_diario.get(candidato_id, 0))
+        for candidato_id in sorted(no_placar.keys() | no_diario.keys(), key=lambda candidato_id: (ordem.get(candidato_id, len(ordem)), candidato_id))
+        if no_placar.get(candidato_id, 0) != no_diario.get(candidato_id, 0)
+    ]
+
+# Função para trocar o placar da rodada atual pelos totais do diário. Só faz sentido se
+# o diário cobre a rodada inteira (estava ligado desde o começo dela).
+@medir()
+def aplicar_placar_do_diario(tipo, estado):
+    placar = TIPOS_VOTO[tipo][2]
+    with transacao() as conn:
+        rodada = ler_rodadas(conn)[RODADAS_VOTO[tipo]]
+        conn.execute(f'DELETE FROM {placar} WHERE rodada = ?', (rodada,))
+        conn.executemany(f'INSERT INTO {placar} (rodada, candidato_id, votos) VALUES (?, ?, ?)',
+                         [(rodada, candidato_id, votos) for (r, candidato_id), votos in estado['placar'][tipo].items() if r == rodada])
+    obter_cache_resultados().invalidar(TIPOS_VOTO[tipo][0])
+
+# Função para regravar no banco os votos do diário que faltam nele, por exemplo depois
+# de restaurar um backup antigo do enquete.db. Cada contador fica com a maior rodada
+# entre a do banco e a do diário. Se um token tem k votos da rodada atual no banco, os
+# k primeiros votos dele no diário são esses; os seguintes passam por gravar_voto com as
+# rodadas do próprio registro, então rodar de novo não duplica nada. Tudo em uma única
+# transação: é manutenção, para rodar com a enquete parada.
+# Retorna um dicionário tipo -> (regravados, já no banco, recusados).
+@medir()
+def repetir_diario():
+    caminho = diario.caminho_diario(caminho_banco())
+    estado = diario.totais_atuais(caminho)
+    resultado = {tipo: [0, 0, 0] for tipo in TIPOS_VOTO}
+    no_banco = {}  # (tipo, token) -> votos da rodada atual no banco ainda não encontrados no diário
+    with transacao() as conn:
+        cursor = conn.cursor()
+        rodadas = ler_rodadas(cursor)
+        for contador in CONTADORES_RODADA:
+            if estado['rodadas'][contador] > rodadas[contador]:
+                rodadas[contador] = estado['rodadas'][contador]
+                cursor.execute(f'UPDATE configuracao SET {contador} = ? WHERE id = 1', (rodadas[contador],))
+        with diario.LeitorDiario(caminho) as leitor:
+            for _, momento, candidato_id, rodada, rodada_tokens, codigo, chave in leitor.registros():
+                tipo = diario.NOMES_REGISTRO.get(codigo)
+                if tipo not in TIPOS_VOTO or rodada != rodadas[RODADAS_VOTO[tipo]]:
+                    continue
+                if (tipo, chave) not in no_banco:
+                    no_banco[tipo, chave] = cursor.execute(f'''
+                        SELECT COUNT(*) FROM {TIPOS_VOTO[tipo][0]} v JOIN tokens t ON t.id = v.token_id
+                        WHERE t.token = ? AND v.rodada = ?
+                    ''', (chave, rodada)).fetchone()[0]
+                if no_banco[tipo, chave]:
+                    no_banco[tipo, chave] -= 1
+                    resultado[tipo][1] += 1
+                elif gravar_voto(cursor, tipo, candidato_id, bytes_para_token(chave), momento,
+                                 {'rodada_tokens': rodada_tokens, RODADAS_VOTO[tipo]: rodada}):
+                    resultado[tipo][0] += 1
+                else:
+                    resultado[tipo][2] += 1  # token que não existe no banco ou já usado
+    obter_cache_resultados().invalidar(*(tabela for tabela, _, _ in TIPOS_VOTO.values()))
+    obter_indice_tokens().limpar_estados()
+    return {tipo: tuple(contagem) for tipo, contagem in resultado.items()}
+
+# Função para carregar o placar de um tipo de voto (compartilhado via cache).
+# Devolve uma tupla de (candidato, votos) na ordem de exibição dos candidatos.
+def carregar_placar(tipo):
+    return obter_cache_resultados().obter(TIPOS_VOTO[tipo][0], 'placar', lambda: consultar_placar(tipo))
+
+@medir(contar_linhas=True)
+def consultar_placar(tipo):
+    placar = TIPOS_VOTO[tipo][2]
+    with conectar_banco() as conn:
+        return tuple(conn.execute(f'''
+            SELECT c.nome, p.votos FROM {placar} p
+            JOIN candidatos c ON c.id = p.candidato_id
+            WHERE p.rodada = {rodada_atual(RODADAS_VOTO[tipo])} AND p.votos > 0 ORDER BY c.ordem, c.id
+        '''))
+
+# Layout comum aos gráficos; o plotly copia o dicionário em cada figura
+LAYOUT_GRAFICO = {'showlegend': False, 'margin': {'t': 60}}
+
+# Nível de confiança dos intervalos exibidos junto com os gráficos
+CONFIANCA_INTERVALOS = 0.95
+
+# Função para carregar os intervalos de confiança do placar de um tipo de voto
+# (compartilhados via cache e recalculados só quando entra voto novo).
+# Devolve (linhas, margem de erro máxima), com uma linha (candidato, votos, proporção,
+# wilson_inf, wilson_sup, goodman_inf, goodman_sup, bootstrap_inf, bootstrap_sup)
+# por candidato, na ordem do placar.
+def carregar_intervalos(tipo):
+    return obter_cache_resultados().obter(TIPOS_VOTO[tipo][0], 'intervalos',
+                                          lambda: calcular_intervalos(carregar_placar(tipo)))
+
+@medir()
+def calcular_intervalos(placar):
+    import estatisticas
+    linhas, margem = estatisticas.calcular_intervalos([votos for _, votos in placar], CONFIANCA_INTERVALOS)
+    return [(nome,) + linha for (nome, _), linha in zip(placar, linhas)], margem
+
+# Função para montar o gráfico de rosca direto dos totais (dicionário candidato -> votos),
+# sem passar por DataFrame nem plotly.express. Com `intervalos` (o resultado de
+# carregar_intervalos, na mesma ordem dos votos) o intervalo de Wilson de cada
+# candidato aparece ao passar o mouse e a margem de erro vai para o título.
+@medir()
+def montar_grafico_rosca(titulo, votos, intervalos=None):
+    import plotly.graph_objects as go
+
+    total_participantes = sum(votos.values())
+    detalhes = {'hovertemplate': '%{label}<br>%{value} votos<extra></extra>'}
+    subtitulo = f'{total_participantes} participantes'
+    if intervalos is not None and intervalos[0]:
+        linhas, margem = intervalos
+        detalhes = {
+            'customdata': [(linha[3] * 100, linha[4] * 100) for linha in linhas],
+            'hovertemplate': (f'%{{label}}<br>%{{value}} votos<br>IC {CONFIANCA_INTERVALOS:.0%}: '
+                              '%{customdata[0]:.1f}% a %{customdata[1]:.1f}%<extra></extra>'),
+        }
+        subtitulo += f', margem de erro ±{margem * 100:.1f} p.p.'
+    fig = go.Figure(go.Pie(
+        labels=list(votos),
+        values=list(votos.values()),
+        hole=0.4,
+        textposition='inside',
+        textinfo='percent+label',
+        **detalhes,
+    ), layout=LAYOUT_GRAFICO)
+    fig.layout.title.text = f'{titulo} ({subtitulo})'
+    return fig
 
 # Função para gerar o gráfico de rosca para intenção de voto
 def gerar_grafico_intencao_voto(candidato_favorecido=None):
-    conn = conectar_banco()
-    df = pd.read_sql_query("SELECT candidato, COUNT(*) as votos FROM intencao_voto GROUP BY candidato", conn)
-    conn.close()
+    return obter_cache_resultados().obter('intencao_voto', ('grafico', candidato_favorecido),
+                                          lambda: montar_grafico_intencao_voto(candidato_favorecido))
+
+def montar_grafico_intencao_voto(candidato_favorecido):
+    # dict novo: o placar do cache é compartilhado e trocar_votos altera os totais
+    votos = dict(carregar_placar('intencao'))
 
     # Manipular dados se houver um candidato favorecido e gráfico vantajoso estiver ativado
+    # (os intervalos de confiança só acompanham os totais reais)
     if candidato_favorecido:
-        df = trocar_votos(df, candidato_favorecido, 'votos')
+        votos = trocar_votos(votos, candidato_favorecido)
+        return montar_grafico_rosca('Intenção de Voto', votos)
 
-    total_participantes = df['votos'].sum()
-    fig = px.pie(df, names='candidato', values='votos', hole=0.4, title=f'Intenção de Voto ({total_participantes} participantes)')
-    fig.update_traces(textposition='inside', textinfo='percent+label')
-    fig.update_layout(showlegend=False)
-    return fig
+    return montar_grafico_rosca('Intenção de Voto', votos, carregar_intervalos('intencao'))
 
 # Função para gerar o gráfico de rosca para rejeição
 def gerar_grafico_rejeicao(candidato_favorecido=None):
-    conn = conectar_banco()
-    df = pd.read_sql_query("SELECT candidato, COUNT(*) as rejeicoes FROM rejeicao GROUP BY candidato", conn)
-    conn.close()
+    return obter_cache_resultados().obter('rejeicao', ('grafico', candidato_favorecido),
+                                          lambda: montar_grafico_rejeicao(candidato_favorecido))
+
+def montar_grafico_rejeicao(candidato_favorecido):
+    rejeicoes = dict(carregar_placar('rejeicao'))
 
     # Manipular dados se houver um candidato favorecido e gráfico vantajoso estiver ativado
     if candidato_favorecido:
-        df = trocar_rejeicoes(df, candidato_favorecido)
+        rejeicoes = trocar_rejeicoes(rejeicoes, candidato_favorecido)
+        return montar_grafico_rosca('Rejeição', rejeicoes)
 
-    total_participantes = df['rejeicoes'].sum()
-    fig = px.pie(df, names='candidato', values='rejeicoes', hole=0.4, title=f'Rejeição ({total_participantes} participantes)')
-    fig.update_traces(textposition='inside', textinfo='percent+label')
-    fig.update_layout(showlegend=False)
-    return fig
+    return montar_grafico_rosca('Rejeição', rejeicoes, carregar_intervalos('rejeicao'))
 
 # Função para trocar votos se o gráfico vantajoso estiver ativado
-def trocar_votos(df, candidato_favorecido, coluna):
-    if candidato_favorecido and candidato_favorecido in df['candidato'].values:
-        max_value = df[coluna].max()
-        candidato_mais_votado = df.loc[df[coluna] == max_value, 'candidato'].values[0]
+def trocar_votos(votos, candidato_favorecido):
+    if candidato_favorecido and candidato_favorecido in votos:
+        max_value = max(votos.values())
+        candidato_mais_votado = next(nome for nome, total in votos.items() if total == max_value)
         # Trocar os valores entre o candidato favorecido e o candidato com maior votação
-        df.loc[df['candidato'] == candidato_mais_votado, coluna] = df.loc[df['candidato'] == candidato_favorecido, coluna].values[0]
-        df.loc[df['candidato'] == candidato_favorecido, coluna] = max_value
-    return df
+        votos[candidato_mais_votado] = votos[candidato_favorecido]
+        votos[candidato_favorecido] = max_value
+    return votos
 
 # Função para trocar rejeições se o gráfico vantajoso estiver ativado
-def trocar_rejeicoes(df, candidato_favorecido):
-    if candidato_favorecido and candidato_favorecido in df['candidato'].values:
-        max_rejeicoes = df['rejeicoes'].max()
-        candidato_mais_rejeitado = df.loc[df['rejeicoes'] == max_rejeicoes, 'candidato'].values[0]
+def trocar_rejeicoes(rejeicoes, candidato_favorecido):
+    if candidato_favorecido and candidato_favorecido in rejeicoes:
+        max_rejeicoes = max(rejeicoes.values())
+        candidato_mais_rejeitado = next(nome for nome, total in rejeicoes.items() if total == max_rejeicoes)
         
         if candidato_mais_rejeitado == candidato_favorecido:
-            segundo_mais_rejeitado = df.loc[df['rejeicoes'] != max_rejeicoes, 'rejeicoes'].max()
+            outros = [total for total in rejeicoes.values() if total != max_rejeicoes]
             
             # Verificar se o segundo candidato existe antes de tentar acessar
-            if not df[df['rejeicoes'] == segundo_mais_rejeitado].empty:
-                segundo_candidato = df.loc[df['rejeicoes'] == segundo_mais_rejeitado, 'candidato'].values[0]
+            if outros:
+                segundo_mais_rejeitado = max(outros)
+                segundo_candidato = next(nome for nome, total in rejeicoes.items() if total == segundo_mais_rejeitado)
                 
                 # Trocar os valores entre o candidato favorecido e o segundo mais rejeitado
-                df.loc[df['candidato'] == segundo_candidato, 'rejeicoes'] = max_rejeicoes
-                df.loc[df['candidato'] == candidato_favorecido, 'rejeicoes'] = segundo_mais_rejeitado
-    return df
+                rejeicoes[segundo_candidato] = max_rejeicoes
+                rejeicoes[candidato_favorecido] = segundo_mais_rejeitado
+    return rejeicoes
+
+# Fuso horário usado para exibir os horários da linha do tempo
+FUSO_HORARIO = ZoneInfo(os.environ.get('ENQUETE_FUSO_HORARIO', 'America/Sao_Paulo'))
+
+# Títulos dos gráficos da linha do tempo de cada tipo de voto
+TITULOS_LINHA_DO_TEMPO = {
+    'intencao': 'Intenção de Voto',
+    'rejeicao': 'Rejeição',
+}
+
+# Função para carregar a linha do tempo de um tipo de voto (compartilhada via cache).
+# Devolve uma tupla de (início da faixa, candidato, votos na faixa) em ordem de tempo,
+# lida só do resumo: o custo acompanha a quantidade de faixas, não a de votos.
+def carregar_linha_do_tempo(tipo, granularidade):
+    return obter_cache_resultados().obter(TIPOS_VOTO[tipo][0], ('linha_do_tempo', granularidade),
+                                          lambda: consultar_linha_do_tempo(tipo, granularidade))
+
+@medir(contar_linhas=True)
+def consultar_linha_do_tempo(tipo, granularidade):
+    resumo = LINHAS_DO_TEMPO[granularidade][0]
+    with conectar_banco() as conn:
+        return tuple(conn.execute(f'''
+            SELECT r.inicio, c.nome, r.votos FROM {resumo} r
+            JOIN candidatos c ON c.id = r.candidato_id
+            WHERE r.tipo = ? AND r.rodada = {rodada_atual(RODADAS_VOTO[tipo])} ORDER BY r.inicio, c.ordem, c.id
+        ''', (tipo,)))
+
+# Função para gerar os gráficos da linha do tempo de um tipo de voto (compartilhados via cache)
+def gerar_graficos_linha_do_tempo(tipo, granularidade):
+    return obter_cache_resultados().obter(
+        TIPOS_VOTO[tipo][0], ('grafico_linha_do_tempo', granularidade),
+        lambda: montar_graficos_linha_do_tempo(TITULOS_LINHA_DO_TEMPO[tipo], carregar_linha_do_tempo(tipo, granularidade), granularidade))
+
+# Função para montar os dois gráficos da linha do tempo em uma única passada pelas faixas:
+# votos recebidos em cada faixa e a participação acumulada (%) de cada candidato
+@medir()
+def montar_graficos_linha_do_tempo(titulo, linhas, granularidade):
+    import plotly.graph_objects as go
+
+    horarios = []
+    votos_por_faixa = []
+    acumulados = {}  # candidato -> votos até a faixa atual
+    participacoes = {}  # candidato -> participação acumulada ao fim de cada faixa
+    total = 0
+    for inicio, faixa in groupby(linhas, key=itemgetter(0)):
+        votos_na_faixa = 0
+        for _, candidato, votos in faixa:
+            acumulados[candidato] = acumulados.get(candidato, 0) + votos
+            votos_na_faixa += votos
+        total += votos_na_faixa
+        horarios.append(datetime.fromtimestamp(inicio, FUSO_HORARIO))
+        votos_por_faixa.append(votos_na_faixa)
+        for candidato, votos in acumulados.items():
+            # Candidato que só apareceu agora tinha 0% nas faixas anteriores
+            participacoes.setdefault(candidato, [0.0] * (len(horarios) - 1)).append(100 * votos / total)
+
+    fig_votos = go.Figure(go.Bar(
+        x=horarios, y=votos_por_faixa,
+        hovertemplate='%{x}<br>%{y} votos<extra></extra>',
+    ), layout=LAYOUT_GRAFICO)
+    fig_votos.layout.title.text = f'{titulo}: votos por {granularidade} ({total} participantes)'
+
+    fig_participacao = go.Figure([
+        go.Scatter(x=horarios, y=valores, name=candidato, mode='lines',
+                   hovertemplate='%{x}<br>%{y:.1f}%<extra>' + candidato + '</extra>')
+        for candidato, valores in participacoes.items()
+    ], layout=LAYOUT_GRAFICO)
+    fig_participacao.update_layout(title_text=f'{titulo}: participação acumulada', showlegend=True,
+                                   yaxis={'range': [0, 100], 'ticksuffix': '%'})
+    return fig_votos, fig_participacao
+
+# Intervalo (em segundos) entre as conferências de votos novos nos gráficos ao vivo
+INTERVALO_AO_VIVO = 5
+
+# Função geradora do gráfico de cada tipo de voto
+GRAFICOS = {
+    'intencao': gerar_grafico_intencao_voto,
+    'rejeicao': gerar_grafico_rejeicao,
+}
+
+# Com todas as conexões do banco ocupadas, mostra `mensagem` pedindo para tentar de
+# novo, como o formulário de voto faz, em vez do erro
+@contextmanager
+def avisar_pool_esgotado(mensagem):
+    try:
+        yield
+    except PoolEsgotado:
+        st.warning(mensagem)
+
+# Aviso dos fragmentos ao vivo, que tentam de novo sozinhos no próximo intervalo
+AVISO_AO_VIVO_OCUPADO = "Muitas pessoas acessando neste momento. Os resultados voltam na próxima atualização."
+
+# Função para exibir os gráficos atualizados sozinhos, sem recarregar a página.
+# Só este fragmento roda de novo a cada INTERVALO_AO_VIVO segundos; ele confere a versão
+# das tabelas no cache de resultados, e as consultas e as figuras só são refeitas
+# quando entrou voto novo. Os reruns do fragmento não passam por main(), por isso
+# a enquete vem como argumento.
+@st.fragment(run_every=INTERVALO_AO_VIVO)
+def exibir_graficos_ao_vivo(enquete, tipos=('intencao', 'rejeicao'), seguir_configuracao=True, chave='graficos'):
+    with usar_enquete(enquete), avisar_pool_esgotado(AVISO_AO_VIVO_OCUPADO):
+        candidato_favorecido = None
+        if seguir_configuracao:
+            config = carregar_configuracoes()
+            if config and not config[0]:
+                candidato_favorecido = config[1]
+        for posicao, tipo in enumerate(tipos):
+            if posicao:
+                st.markdown("---")  # Separador entre os gráficos
+            st.plotly_chart(GRAFICOS[tipo](candidato_favorecido), key=f'{chave}_{tipo}')
+            if not candidato_favorecido:
+                exibir_intervalos(tipo)
+
+# Função para exibir a tabela dos intervalos de confiança de um tipo de voto. É montada
+# em markdown, sem pandas, para não pesar na página do eleitor.
+def exibir_intervalos(tipo):
+    linhas, margem = carregar_intervalos(tipo)
+    if not linhas:
+        return
+    with st.expander(f"Intervalos de confiança ({CONFIANCA_INTERVALOS:.0%})"):
+        tabela = [
+            "| Candidato | Votos | % | Wilson | Simultâneo (Goodman) | Bootstrap |",
+            "|---|---:|---:|---:|---:|---:|",
+        ]
+        for nome, votos, proporcao, *limites in linhas:
+            faixas = ' | '.join(f'{inferior:.1%} a {superior:.1%}' for inferior, superior in zip(limites[::2], limites[1::2]))
+            tabela.append(f"| {nome.replace('|', '/')} | {votos} | {proporcao:.1%} | {faixas} |")
+        st.markdown('\n'.join(tabela))
+        st.caption(f"Margem de erro máxima: ±{margem * 100:.1f} pontos percentuais. "
+                   "Wilson vale para cada candidato isoladamente; o simultâneo vale para todos ao mesmo tempo.")
+
+# Função para exibir a linha do tempo de cada tipo de voto, atualizada sozinha como
+# os gráficos de rosca (só as faixas do resumo são lidas a cada voto novo)
+@st.fragment(run_every=INTERVALO_AO_VIVO)
+def exibir_linha_do_tempo_ao_vivo(enquete, granularidade, chave='linha_do_tempo'):
+    with usar_enquete(enquete), avisar_pool_esgotado(AVISO_AO_VIVO_OCUPADO):
+        for posicao, tipo in enumerate(TIPOS_VOTO):
+            if posicao:
+                st.markdown("---")  # Separador entre os gráficos
+            if not carregar_linha_do_tempo(tipo, granularidade):
+                st.write(f"{TITULOS_LINHA_DO_TEMPO[tipo]}: nenhum voto com horário registrado ainda.")
+                continue
+            fig_votos, fig_participacao = gerar_graficos_linha_do_tempo(tipo, granularidade)
+            st.plotly_chart(fig_votos, key=f'{chave}_{tipo}_votos')
+            st.plotly_chart(fig_participacao, key=f'{chave}_{tipo}_participacao')
 
 # Função para validar o token
 def validar_token(token_url):
@@ -267,28 +2292,103 @@ def validar_token(token_url):
         return "admin"
     elif token_url == "gr@f1c=0":
         return "grafico"
+    elif token_url and verificar_token(token_url) is not None:
+        return "user"
     else:
-        conn = conectar_banco()
-        cursor = conn.cursor()
-        cursor.execute('SELECT token FROM tokens WHERE token = ?', (token_url,))
-        resultado = cursor.fetchone()
-        conn.close()
-        if resultado:
-            return "user"
-        else:
-            return None
+        return None
+
+# Acessos à página pública de resultados (sem token) por cliente: rajada permitida e
+# acessos por segundo repostos, por sessão e por IP. Cada recarga da página é uma sessão
+# nova, então o limite por sessão só segura uma aba aberta; robôs e recargas seguidas
+# são limitados por IP, atrás de um proxy confiável. Não há limite para o processo todo:
+# um único cliente o esgotaria e negaria a página a todos. Sem IP, o que segura a carga
+# é o cache de resultados com single-flight: acessos repetidos são acertos no cache e
+# os resultados só são recalculados uma vez por voto novo. O limite por IP é folgado
+# porque muitos eleitores podem sair pelo mesmo IP (rede móvel, Wi-Fi da prefeitura).
+LIMITE_PUBLICO_SESSAO = (5, 0.5)
+LIMITE_PUBLICO_IP = (30, 2.0)
+
+# Clientes acompanhados por limitador; acima disso os mais antigos são esquecidos
+CLIENTES_LIMITADOS_MAX = 10000
+
+# Proxies confiáveis na frente do app, informados em ENQUETE_PROXIES_CONFIAVEIS. O IP do
+# cliente é a entrada do X-Forwarded-For acrescentada pelo mais externo deles; as
+# anteriores podem ter sido forjadas pelo próprio cliente. O padrão é 0 (cabeçalho
+# ignorado): sem proxy, o X-Forwarded-For inteiro vem do cliente, que poderia trocá-lo a
+# cada acesso para escapar do limite. Atrás de um proxy (Streamlit Cloud, nginx...),
+# defina ENQUETE_PROXIES_CONFIAVEIS=1, ou o número de proxies encadeados.
+PROXIES_CONFIAVEIS = int(os.environ.get('ENQUETE_PROXIES_CONFIAVEIS', '0'))
+
+
+# Limitador de acessos por cliente (balde de fichas): cada chave começa com `capacidade`
+# fichas e ganha `por_segundo` fichas por segundo até encher; cada acesso gasta uma.
+# Guarda no máximo `max_chaves` clientes, esquecendo os que estão há mais tempo sem acessar.
+class LimitadorTaxa:
+    def __init__(self, capacidade, por_segundo, max_chaves=CLIENTES_LIMITADOS_MAX):
+        self.capacidade = capacidade
+        self.por_segundo = por_segundo
+        self.max_chaves = max_chaves
+        self._baldes = OrderedDict()
+        self._trava = threading.Lock()
+        self.permitidos = 0
+        self.recusados = 0
+
+    def permitir(self, chave):
+        agora = time.monotonic()
+        with self._trava:
+            fichas, ultimo = self._baldes.pop(chave, (self.capacidade, agora))
+            fichas = min(self.capacidade, fichas + (agora - ultimo) * self.por_segundo)
+            permitido = fichas >= 1
+            if permitido:
+                fichas -= 1
+                self.permitidos += 1
+            else:
+                self.recusados += 1
+            self._baldes[chave] = (fichas, agora)
+            if len(self._baldes) > self.max_chaves:
+                self._baldes.popitem(last=False)
+        return permitido
+
+    def metricas(self):
+        with self._trava:
+            return {'permitidos': self.permitidos, 'recusados': self.recusados, 'clientes': len(self._baldes)}
+
+
+# Limitadores da página pública, criados uma única vez por processo (todas as enquetes)
+@recurso_compartilhado
+def obter_limitadores_publicos():
+    return {'sessao': LimitadorTaxa(*LIMITE_PUBLICO_SESSAO), 'ip': LimitadorTaxa(*LIMITE_PUBLICO_IP)}
+
+# Função para identificar o cliente da execução atual: id da sessão do Streamlit e IP
+# de origem informado pelo proxy (None quando não dá para saber)
+def identificar_cliente():
+    contexto = get_script_run_ctx()
+    sessao = contexto.session_id if contexto is not None else None
+    ip = None
+    encaminhado = st.context.headers.get('X-Forwarded-For') if PROXIES_CONFIAVEIS else None
+    if encaminhado:
+        entradas = [entrada.strip() for entrada in encaminhado.split(',') if entrada.strip()]
+        if entradas:
+            ip = entradas[max(0, len(entradas) - PROXIES_CONFIAVEIS)]
+    return sessao, ip
+
+# Função para decidir se a execução atual pode montar os resultados públicos: a sessão
+# e o IP precisam ter fichas. Um acesso recusado não gasta a ficha do IP.
+def liberar_resultados_publicos():
+    sessao, ip = identificar_cliente()
+    limitadores = obter_limitadores_publicos()
+    liberado = ((sessao is None or limitadores['sessao'].permitir(sessao))
+                and (ip is None or limitadores['ip'].permitir(ip)))
+    if not liberado:
+        obter_metricas().somar('liberar_resultados_publicos', 'limitadas')
+    return liberado
 
 def pagina_usuario(token_url):
     st.title("🌲 Instituto Tarumã Pesquisa")
 
-    # Criar as tabelas se ainda não existirem
-    criar_tabelas()
-
     # Carregar as configurações de gráficos
-    config = carregar_configuracoes()
-    if config:
-        exibir_real, candidato_favorecido = config
-    else:
+    # Os gráficos leem a configuração a cada atualização; aqui só confere se ela existe
+    if not carregar_configuracoes():
         st.error("Erro ao carregar as configurações.")
         return
 
@@ -304,56 +2404,67 @@ def pagina_usuario(token_url):
             # Mostrar gráficos e formulários baseados no estado do token
             if usado_intencao and usado_rejeicao:
                 st.info("Seu voto já foi computado, obrigado por participar!")
-                st.plotly_chart(gerar_grafico_intencao_voto(candidato_favorecido if not exibir_real else None))
-                st.markdown("---")  # Separador entre os gráficos
-                st.plotly_chart(gerar_grafico_rejeicao(candidato_favorecido if not exibir_real else None))
+                exibir_graficos_ao_vivo(enquete_atual())
             else:
+                # Gráficos exibidos depois dos formulários quando um voto é registrado
+                graficos = None
                 if not usado_intencao:
                     st.success("Link válido para intenção de voto.")
                     with st.form(key='intencao_voto'):
-                        st.write("Se as eleições em São Miguel do Guaporé fossem hoje, em qual desses candidatos você votaria?")
+                        st.write(enquete_atual()['pergunta_intencao'])
                         
+                        # Opções vindas da tabela de candidatos; None é o 'Selecione uma opção'
+                        candidatos_intencao = candidatos_da_pergunta('intencao')
                         candidato = st.radio(
                             "Escolha o candidato:",
-                            options=['Selecione uma opção', 'Fabio de Paula', 'Coronel Crispim', 'Prof Eudes', 'Branco/Nulo', 'Não sei/Não decidi'],
+                            options=[None] + list(candidatos_intencao),
+                            format_func=lambda opcao: 'Selecione uma opção' if opcao is None else candidatos_intencao[opcao],
                             index=0  # Garante que a opção 'Selecione uma opção' esteja selecionada por padrão
                         )
 
                         submit_voto = st.form_submit_button("Votar")
 
-                        if candidato != 'Selecione uma opção' and submit_voto:
+                        if candidato is not None and submit_voto:
                             # Continuar o processo de votação
-                            registrar_intencao_voto(candidato, token_url)
-                            marcar_token_como_usado_intencao(token_url)
-                            st.success(f"Seu voto em {candidato} foi registrado com sucesso! Atualize a página para ver o resultado!")
-                            st.plotly_chart(gerar_grafico_intencao_voto(candidato_favorecido if not exibir_real else None))
-                        elif candidato == 'Selecione uma opção' and submit_voto:
+                            registrado = registrar_voto_formulario('intencao', candidato, token_url)
+                            if registrado:
+                                st.success(f"Seu voto em {candidatos_intencao[candidato]} foi registrado com sucesso! O resultado abaixo é atualizado automaticamente.")
+                                graficos = ('intencao',)
+                            elif registrado is not None:
+                                st.info("Este link já foi utilizado para a intenção de voto.")
+                        elif candidato is None and submit_voto:
                             st.warning("Você precisa selecionar um candidato antes de votar.")
 
                 if not usado_rejeicao:
                     st.success("Link válido para rejeição.")
                     with st.form(key='rejeicao'):
-                        st.write("Em qual desses candidatos você não votaria de jeito nenhum?")
+                        st.write(enquete_atual()['pergunta_rejeicao'])
                         
+                        candidatos_rejeicao = candidatos_da_pergunta('rejeicao')
                         rejeicao = st.radio(
                             "Escolha o candidato:",
-                            options=['Selecione uma opção', 'Fabio de Paula', 'Coronel Crispim', 'Prof Eudes'],
+                            options=[None] + list(candidatos_rejeicao),
+                            format_func=lambda opcao: 'Selecione uma opção' if opcao is None else candidatos_rejeicao[opcao],
                             index=0  # Garante que a opção 'Selecione uma opção' esteja selecionada por padrão
                         )
 
                         submit_rejeicao = st.form_submit_button("Registrar rejeição")
                         
-                        if rejeicao != 'Selecione uma opção' and submit_rejeicao:
-                            registrar_rejeicao(rejeicao, token_url)
-                            marcar_token_como_usado_rejeicao(token_url)
-                            st.success(f"Sua rejeição para {rejeicao} foi registrada com sucesso! Atualize a página para ver o resultado!")
-                            # Exibir ambos os gráficos após o registro de rejeição
-                            st.plotly_chart(gerar_grafico_intencao_voto(candidato_favorecido if not exibir_real else None))
-                            st.markdown("---")  # Separador entre os gráficos
-                            st.plotly_chart(gerar_grafico_rejeicao(candidato_favorecido if not exibir_real else None))
-                        elif rejeicao == 'Selecione uma opção' and submit_rejeicao:
+                        if rejeicao is not None and submit_rejeicao:
+                            registrado = registrar_voto_formulario('rejeicao', rejeicao, token_url)
+                            if registrado:
+                                st.success(f"Sua rejeição para {candidatos_rejeicao[rejeicao]} foi registrada com sucesso! O resultado abaixo é atualizado automaticamente.")
+                                # Exibir ambos os gráficos após o registro de rejeição
+                                graficos = ('intencao', 'rejeicao')
+                            elif registrado is not None:
+                                st.info("Este link já foi utilizado para a rejeição.")
+                        elif rejeicao is None and submit_rejeicao:
                             st.warning("Você precisa selecionar um candidato antes de registrar a rejeição.")
 
+                # Fora dos formulários: um fragmento não pode ficar dentro de st.form
+                if graficos:
+                    exibir_graficos_ao_vivo(enquete_atual(), graficos, chave='graficos_voto')
+
     else:
         st.error("Link não fornecido na URL. Adicione ?token=SEU_TOKEN à URL.")
 
@@ -363,50 +2474,301 @@ def pagina_usuario(token_url):
 # Código da Página de Configurações (Admin)
 # =======================================     
 #    
-# Função para converter DataFrame para Excel e CSV para download
-def converter_para_excel(df):
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False)
-    return output.getvalue()
-
-def converter_para_csv(df):
-    return df.to_csv(index=False).encode('utf-8')
-def criar_tokens(quantidade):
-    conn = conectar_banco()
-    cursor = conn.cursor()
-    for _ in range(quantidade):
-        token = str(uuid.uuid4())
-        cursor.execute('INSERT INTO tokens (token) VALUES (?)', (token,))
-    conn.commit()
-    conn.close()
-
-
-def exibir_e_gerar_download_tokens():
-    st.subheader("Visualização dos Tokens")
-    df_tokens = exibir_tokens()
-    st.dataframe(df_tokens)
-
-    # Botões para download dos tokens em Excel e CSV
-    st.download_button(
-        label="Baixar Tokens (Excel)",
-        data=converter_para_excel(df_tokens),
-        file_name="tokens.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+# Linhas lidas do banco por vez durante as exportações
+LINHAS_POR_BLOCO = 5000
+
+# Consultas das tabelas exportáveis pela página de administração
+EXPORTACOES = {
+    'tokens': f'''SELECT uuid_texto(token) AS token, usado_intencao = {RODADA_TOKENS} AS usado_intencao,
+                         usado_rejeicao = {RODADA_TOKENS} AS usado_rejeicao FROM tokens ORDER BY id''',
+    'intencao_votos': f'''SELECT v.id, c.nome AS candidato, uuid_texto(t.token) AS token,
+                                 datetime(v.registrado_em, 'unixepoch') AS registrado_em_utc FROM intencao_voto v
+                          JOIN candidatos c ON c.id = v.candidato_id
+                          LEFT JOIN tokens t ON t.id = v.token_id
+                          WHERE v.rodada = {rodada_atual('rodada_intencao')} ORDER BY v.id''',
+    'rejeicao': f'''SELECT v.id, c.nome AS candidato, uuid_texto(t.token) AS token,
+                           datetime(v.registrado_em, 'unixepoch') AS registrado_em_utc FROM rejeicao v
+                    JOIN candidatos c ON c.id = v.candidato_id
+                    LEFT JOIN tokens t ON t.id = v.token_id
+                    WHERE v.rodada = {rodada_atual('rodada_rejeicao')} ORDER BY v.id''',
+}
+
+# Tipo de cada coluna das exportações em Parquet (nomes dos tipos do pyarrow), declarado
+# uma vez: inferido bloco a bloco, uma coluna toda vazia em um bloco (o token de votos
+# sem token, no LEFT JOIN) sairia com tipo nulo e não bateria com o arquivo
+TIPOS_PARQUET = {
+    'tokens': ('string', 'int64', 'int64'),
+    'intencao_votos': ('int64', 'string', 'string', 'string'),
+    'rejeicao': ('int64', 'string', 'string', 'string'),
+}
+
+# Formatos de exportação: extensão do arquivo e tipo MIME
+FORMATOS_EXPORTACAO = {
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'CSV': ('csv', 'text/csv'),
+    'CSV compactado': ('csv.gz', 'application/gzip'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+# Pacote opcional exigido por cada formato; o formato só é oferecido se ele estiver instalado
+PACOTES_EXPORTACAO = {'Parquet': 'pyarrow'}
+
+# Função para listar os formatos de exportação disponíveis neste ambiente
+def formatos_disponiveis():
+    return [formato for formato in FORMATOS_EXPORTACAO
+            if formato not in PACOTES_EXPORTACAO or importlib.util.find_spec(PACOTES_EXPORTACAO[formato]) is not None]
+
+# Função para ler o resultado de uma consulta em blocos, direto do cursor.
+# Devolve os nomes das colunas e um gerador de listas de até LINHAS_POR_BLOCO linhas.
+@contextmanager
+def ler_em_blocos(consulta):
+    with conectar_banco() as conn:
+        cursor = conn.execute(consulta)
+        colunas = [descricao[0] for descricao in cursor.description]
+        try:
+            yield colunas, contar_blocos(iter(lambda: cursor.fetchmany(LINHAS_POR_BLOCO), []))
+        finally:
+            cursor.close()
+
+# Soma as linhas exportadas às linhas lidas de gerar_exportacao nas métricas
+def contar_blocos(blocos):
+    metricas = obter_metricas()
+    for bloco in blocos:
+        metricas.somar('gerar_exportacao', 'linhas', len(bloco))
+        yield bloco
+
+# Função para exportar uma consulta em CSV (opcionalmente gzip) sem montar a tabela em memória
+def exportar_csv(consulta, caminho, compactar=False):
+    abrir = gzip.open if compactar else open
+    with abrir(caminho, 'wt', encoding='utf-8', newline='') as arquivo, ler_em_blocos(consulta) as (colunas, blocos):
+        escritor = csv.writer(arquivo)
+        escritor.writerow(colunas)
+        for bloco in blocos:
+            escritor.writerows(bloco)
+
+# Linhas de uma planilha do Excel, contando o cabeçalho
+LINHAS_POR_PLANILHA = 1048576
+
+# Função para exportar uma consulta em Excel; no modo constant_memory o xlsxwriter
+# grava cada linha no disco assim que a próxima começa. Passando do limite de linhas
+# do Excel (o xlsxwriter só devolve -1 e descarta a linha), continua em outra planilha
+# com o mesmo cabeçalho.
+def exportar_excel(consulta, caminho):
+    import xlsxwriter
+
+    pasta = xlsxwriter.Workbook(caminho, {'constant_memory': True})
+    with ler_em_blocos(consulta) as (colunas, blocos):
+        planilha = pasta.add_worksheet()
+        planilha.write_row(0, 0, colunas)
+        linha = 1
+        for bloco in blocos:
+            for registro in bloco:
+                if linha == LINHAS_POR_PLANILHA:
+                    planilha = pasta.add_worksheet()
+                    planilha.write_row(0, 0, colunas)
+                    linha = 1
+                if planilha.write_row(linha, 0, registro) == -1:
+                    raise RuntimeError("Não foi possível gravar a linha na planilha do Excel.")
+                linha += 1
+    pasta.close()
+
+# Função para exportar uma consulta em Parquet, um row group por bloco (requer pyarrow).
+# `tipos` traz o tipo de cada coluna, na ordem da consulta (veja TIPOS_PARQUET).
+def exportar_parquet(consulta, caminho, tipos):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("A exportação em Parquet requer o pacote pyarrow.")
+
+    with ler_em_blocos(consulta) as (colunas, blocos):
+        esquema = pa.schema([(coluna, getattr(pa, tipo)()) for coluna, tipo in zip(colunas, tipos)])
+        with pq.ParquetWriter(caminho, esquema) as escritor:
+            for bloco in blocos:
+                escritor.write_table(pa.Table.from_arrays(
+                    [pa.array(valores, type=campo.type) for valores, campo in zip(zip(*bloco), esquema)],
+                    schema=esquema,
+                ))
+
+# Função para apagar um arquivo que pode já ter sido apagado
+def apagar_arquivo(caminho):
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+
+# Função para gerar o arquivo de exportação de uma tabela em um arquivo temporário.
+# Retorna o caminho do arquivo gerado; se a exportação falhar, o arquivo é apagado.
+@medir()
+def gerar_exportacao(nome, formato):
+    extensao = FORMATOS_EXPORTACAO[formato][0]
+    descritor, caminho = tempfile.mkstemp(prefix=f'{nome}-', suffix=f'.{extensao}')
+    os.close(descritor)
+    consulta = EXPORTACOES[nome]
+    try:
+        if formato == 'Excel':
+            exportar_excel(consulta, caminho)
+        elif formato == 'Parquet':
+            exportar_parquet(consulta, caminho, TIPOS_PARQUET[nome])
+        else:
+            exportar_csv(consulta, caminho, compactar=(formato == 'CSV compactado'))
+    except BaseException:
+        apagar_arquivo(caminho)
+        raise
+    return caminho
+
+# Arquivo de exportação gerado para uma sessão. É apagado quando é baixado, quando a
+# sessão gera outro no lugar ou quando a sessão termina: o Streamlit descarta o
+# session_state da sessão encerrada e o finalizador apaga o arquivo (ou na saída do processo).
+class ArquivoExportacao:
+    def __init__(self, formato, caminho):
+        self.formato = formato
+        self.caminho = caminho
+        self.apagar = weakref.finalize(self, apagar_arquivo, caminho)
+
+# Função para exibir a exportação de uma tabela em duas etapas: o arquivo só é gerado
+# quando o botão é clicado, e o botão de download aparece até o arquivo ser baixado
+def exibir_exportacao(nome, rotulo):
+    col1, col2 = st.columns([2, 1])
+    formato = col1.selectbox(f"Formato ({rotulo})", formatos_disponiveis(), key=f'formato_{nome}')
+    chave = f'exportacao_{nome}'
+    if col2.button(f"Gerar {rotulo}", key=f'gerar_{nome}'):
+        anterior = st.session_state.pop(chave, None)
+        if anterior is not None:
+            anterior.apagar()
+        try:
+            with st.spinner("Gerando arquivo..."):
+                st.session_state[chave] = ArquivoExportacao(formato, gerar_exportacao(nome, formato))
+        except RuntimeError as erro:
+            st.error(str(erro))
+        except (OSError, sqlite3.Error) as erro:
+            st.error(f"Não foi possível gerar o arquivo: {erro}")
+
+    exportacao = st.session_state.get(chave)
+    if exportacao is None or not os.path.exists(exportacao.caminho):
+        return
+    # O clique no download já entregou o arquivo (o navegador baixa o conteúdo enviado na
+    # execução anterior): apaga e não lê de novo nas próximas execuções
+    if st.session_state.get(f'baixar_{nome}'):
+        del st.session_state[chave]
+        exportacao.apagar()
+        col1.success(f"{rotulo} baixado. Gere de novo para outra cópia.")
+        return
+    extensao, mime = FORMATOS_EXPORTACAO[exportacao.formato]
+    with open(exportacao.caminho, 'rb') as arquivo:
+        st.download_button(
+            label=f"Baixar {rotulo} ({exportacao.formato})",
+            data=arquivo,
+            file_name=f"{nome}.{extensao}",
+            mime=mime,
+            key=f'baixar_{nome}',
+        )
 
-    st.download_button(
-        label="Baixar Tokens (CSV)",
-        data=converter_para_csv(df_tokens),
-        file_name="tokens.csv",
-        mime="text/csv"
-    )
+# Quantidade de tokens gravados por transação na criação em massa
+TOKENS_POR_LOTE = 20000
+
+# Função para gerar tokens UUID versão 4 em lote a partir de bytes aleatórios do
+# gerador criptográfico (os mesmos 16 bytes de uuid.uuid4().bytes, sem criar um objeto por token)
+def gerar_tokens(quantidade):
+    bruto = bytearray(secrets.token_bytes(16 * quantidade))
+    # Bits de versão (4) e de variante (RFC 4122) de cada UUID
+    bruto[6::16] = bytes((b & 0x0F) | 0x40 for b in bruto[6::16])
+    bruto[8::16] = bytes((b & 0x3F) | 0x80 for b in bruto[8::16])
+    return [bytes(bruto[i:i + 16]) for i in range(0, len(bruto), 16)]
+
+# Função para criar tokens em massa.
+# Os tokens são gravados com executemany em transações de TOKENS_POR_LOTE; o andamento
+# fica registrado em `lotes_tokens`, então uma criação interrompida pode ser retomada
+# com retomar_criacao_tokens. `progresso(criados, solicitados)` é chamado a cada lote.
+@medir()
+def criar_tokens(quantidade, progresso=None, tamanho_lote=TOKENS_POR_LOTE):
+    with transacao() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO lotes_tokens (solicitados) VALUES (?)', (quantidade,))
+        lote_id = cursor.lastrowid
+    return continuar_criacao_tokens(lote_id, progresso, tamanho_lote)
+
+# Função para retomar a criação de tokens de um lote interrompido
+def retomar_criacao_tokens(lote_id, progresso=None, tamanho_lote=TOKENS_POR_LOTE):
+    return continuar_criacao_tokens(lote_id, progresso, tamanho_lote)
+
+def continuar_criacao_tokens(lote_id, progresso, tamanho_lote):
+    with conectar_banco() as conn:
+        solicitados, criados = conn.execute(
+            'SELECT solicitados, criados FROM lotes_tokens WHERE id = ?', (lote_id,)
+        ).fetchone()
+
+    while criados < solicitados:
+        tokens = gerar_tokens(min(tamanho_lote, solicitados - criados))
+        # Tokens e andamento do lote na mesma transação: nada é gravado pela metade
+        with transacao() as conn:
+            cursor = conn.cursor()
+            # Relido com a trava de escrita: outra aba retomando o mesmo lote pode ter
+            # gravado tokens desde a última leitura, e o lote não passa do total pedido
+            solicitados, criados = cursor.execute(
+                'SELECT solicitados, criados FROM lotes_tokens WHERE id = ?', (lote_id,)
+            ).fetchone()
+            quantidade = min(len(tokens), solicitados - criados)
+            if quantidade <= 0:
+                break
+            tokens = tokens[:quantidade]
+            # Ids sequenciais a partir do maior existente (busca pelo índice UNIQUE de id)
+            ultimo_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM tokens').fetchone()[0]
+            cursor.executemany('INSERT INTO tokens (token, id) VALUES (?, ?)',
+                               zip(tokens, range(ultimo_id + 1, ultimo_id + 1 + quantidade)))
+            cursor.execute('UPDATE lotes_tokens SET criados = criados + ? WHERE id = ?', (quantidade, lote_id))
+        obter_indice_tokens().adicionar(tokens, ultimo_id + quantidade)
+        criados += quantidade
+        if progresso is not None:
+            progresso(criados, solicitados)
+
+    with transacao() as conn:
+        conn.execute('UPDATE lotes_tokens SET concluido_em = CURRENT_TIMESTAMP WHERE id = ? AND concluido_em IS NULL', (lote_id,))
+    return criados
+
+# Função para buscar a criação de tokens mais recente que não chegou ao fim
+def lote_tokens_pendente():
+    with conectar_banco() as conn:
+        return conn.execute('''
+            SELECT id, solicitados, criados FROM lotes_tokens
+            WHERE concluido_em IS NULL ORDER BY id DESC LIMIT 1
+        ''').fetchone()
+
+
+# Função para exibir uma tabela paginada por chave.
+# `buscar(apos, limite)` devolve as linhas seguintes à chave `apos` (primeira coluna da
+# linha) e `contar()` o total com os filtros atuais; só a página atual é carregada.
+# A pilha com a chave inicial de cada página fica em st.session_state[chave].
+def exibir_tabela_paginada(chave, colunas, buscar, contar, filtros):
+    import pandas as pd
+
+    estado = st.session_state.setdefault(chave, {'filtros': filtros, 'inicios': [None]})
+    if estado['filtros'] != filtros:
+        estado['filtros'] = filtros
+        estado['inicios'] = [None]
+
+    # Uma linha a mais indica se existe próxima página
+    linhas = buscar(estado['inicios'][-1], TAMANHO_PAGINA + 1)
+    tem_proxima = len(linhas) > TAMANHO_PAGINA
+    linhas = linhas[:TAMANHO_PAGINA]
+
+    st.caption(f"{contar()} registros · página {len(estado['inicios'])}")
+    st.dataframe(pd.DataFrame(linhas, columns=colunas), hide_index=True)
+
+    col1, col2 = st.columns(2)
+    if col1.button("◀ Página anterior", key=f'{chave}_anterior', disabled=len(estado['inicios']) == 1):
+        estado['inicios'].pop()
+        st.rerun()
+    if col2.button("Próxima página ▶", key=f'{chave}_proxima', disabled=not tem_proxima):
+        estado['inicios'].append(linhas[-1][0])
+        st.rerun()
 
 def pagina_admin():
-    st.title("Configurações")
+    import pandas as pd
 
-    # Criar as tabelas se ainda não existirem
-    criar_tabelas()
+    st.title("Configurações")
+    enquete = enquete_atual()
+    st.caption(f"Enquete: {enquete['nome']} ({enquete['slug']}) · banco {enquete['arquivo']}")
 
     # Exibir opções de configuração
     st.subheader("Configurações dos Gráficos")
@@ -425,9 +2787,13 @@ def pagina_admin():
     # Exibir combobox e dataframe se "Exibir gráficos reais" for desmarcado
     if not exibir_real:
         st.subheader("Seleção do Candidato Favorecido")
+        # Só faz sentido favorecer quem aparece nas duas perguntas
+        rejeitaveis = candidatos_da_pergunta('rejeicao')
+        opcoes = [nome for id_, nome in candidatos_da_pergunta('intencao').items() if id_ in rejeitaveis]
         candidato_favorecido = st.selectbox(
             "Escolha o candidato que deve ser favorecido:",
-            ("Fabio de Paula", "Coronel Crispim", "Prof Eudes")
+            opcoes,
+            index=opcoes.index(candidato_favorecido) if candidato_favorecido in opcoes else 0
         )
         st.write("O candidato selecionado receberá a maior votação quando estiver em desvantagem e a menor rejeição quando ele não for o menos rejeitado.")
 
@@ -446,69 +2812,207 @@ def pagina_admin():
 
     # Separador
     st.markdown("---")
-    
-    # Exibição da tabela de tokens com botão para atualizar e baixar em Excel
+
+    # Candidatos exibidos nos formulários e gráficos
+    st.subheader("Candidatos")
+    st.write("Edite nomes, ordem de exibição e em quais perguntas cada candidato aparece. Linhas removidas são apenas desativadas, para não perder os votos já registrados.")
+    tabela_candidatos = pd.DataFrame(carregar_candidatos(), columns=['id', 'nome', 'ordem', 'intencao', 'rejeicao', 'ativo'])
+    tabela_candidatos[['intencao', 'rejeicao', 'ativo']] = tabela_candidatos[['intencao', 'rejeicao', 'ativo']].astype(bool)
+    editados = st.data_editor(
+        tabela_candidatos,
+        num_rows='dynamic',
+        hide_index=True,
+        disabled=['id'],
+        column_config={
+            'nome': st.column_config.TextColumn("Nome", required=True),
+            'ordem': st.column_config.NumberColumn("Ordem", required=True, step=1),
+            'intencao': st.column_config.CheckboxColumn("Intenção de voto", default=True),
+            'rejeicao': st.column_config.CheckboxColumn("Rejeição", default=True),
+            'ativo': st.column_config.CheckboxColumn("Ativo", default=True),
+        },
+        key='editor_candidatos',
+    )
+    if st.button("Salvar Candidatos"):
+        linhas = editados.astype(object).where(editados.notna(), None).to_dict('records')
+        if any(not (linha['nome'] or '').strip() or linha['ordem'] is None for linha in linhas):
+            st.error("Todo candidato precisa de nome e ordem.")
+        elif len({linha['nome'].strip() for linha in linhas}) != len(linhas):
+            st.error("Há candidatos com o mesmo nome.")
+        else:
+            salvar_candidatos(linhas)
+            st.success("Candidatos salvos com sucesso.")
+
+    # Separador
+    st.markdown("---")
+
+    # Métricas da fila de gravação de votos
+    st.subheader("Fila de Gravação de Votos")
+    metricas_fila = obter_fila_votos().metricas()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Votos na fila", metricas_fila['profundidade'])
+    col2.metric("Lotes gravados", metricas_fila['lotes'])
+    col3.metric("Último lote", metricas_fila['ultimo_lote'])
+    col4.metric("Média por lote", f"{metricas_fila['media_lote']:.1f}", help=f"Maior lote: {metricas_fila['maior_lote']}")
+    # Travas do SQLite e votos recusados pelo limite, neste processo (todas as enquetes)
+    metricas = obter_metricas()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Escritas que encontraram trava", metricas.total('bloqueios'))
+    col2.metric("Novas tentativas", metricas.total('retentativas'))
+    col3.metric("Votos recusados (ocupado)", metricas.total('rejeitadas'), help=f"Limite: {LIMITE_VOTOS_PENDENTES} votos pendentes")
+
+    # Diário dos votos ao lado do banco (todos os processos escrevem no mesmo arquivo)
+    if DIARIO_VOTOS:
+        st.subheader("Diário de Votos")
+        metricas_diario = obter_diario().metricas()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Registros no diário", metricas_diario['total_registros'])
+        col2.metric("Gravações (fsync)", metricas_diario['escritas'],
+                    help=f"Registros gravados por este processo: {metricas_diario['registros']}")
+        col3.metric("Registros no instantâneo", metricas_diario['registros_no_instantaneo'])
+        col4.metric("Instantâneos salvos", metricas_diario['instantaneos'],
+                    help=f"Falhas: {metricas_diario['falhas_instantaneo']}")
+
+    # Métricas do cache de resultados dos gráficos
+    st.subheader("Cache de Resultados")
+    metricas_cache = obter_cache_resultados().metricas()
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Acertos", metricas_cache['acertos'])
+    col2.metric("Falhas", metricas_cache['falhas'])
+    col3.metric("Cálculos compartilhados", metricas_cache['coalescidas'],
+                help="Pedidos que esperaram um cálculo igual já em andamento em vez de repeti-lo")
+    col4.metric("Taxa de acerto", f"{metricas_cache['taxa_acerto']:.0%}")
+    col5.metric("Itens em cache", metricas_cache['itens'])
+
+    # Limite de acessos à página pública de resultados, neste processo (todas as enquetes)
+    st.subheader("Página Pública de Resultados")
+    limitadores = obter_limitadores_publicos()
+    metricas_sessao = limitadores['sessao'].metricas()
+    metricas_ip = limitadores['ip'].metricas()
+    col1, col2, col3, col4 = st.columns(4)
+    # O IP só é consultado depois de a sessão ter ficha
+    col1.metric("Acessos liberados", metricas_sessao['permitidos'] - metricas_ip['recusados'])
+    col2.metric("Acessos limitados", obter_metricas().total('limitadas'),
+                help=f"Por sessão: {metricas_sessao['recusados']} · por IP: {metricas_ip['recusados']}")
+    col3.metric("Sessões acompanhadas", metricas_sessao['clientes'])
+    col4.metric("IPs acompanhados", metricas_ip['clientes'],
+                help="Zero sem ENQUETE_PROXIES_CONFIAVEIS: o X-Forwarded-For só é usado atrás de um proxy confiável")
+
+    # Métricas do índice de tokens em memória
+    st.subheader("Índice de Tokens")
+    metricas_indice = obter_indice_tokens().metricas()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Links recusados sem consulta", metricas_indice['recusados_filtro'])
+    col2.metric("Estados vindos do cache", metricas_indice['acertos_lru'])
+    col3.metric("Consultas ao banco", metricas_indice['consultas_banco'])
+    col4.metric("Tokens no filtro", metricas_indice['tokens_no_filtro'])
+
+    # Tempos das funções de banco e dos gráficos neste processo (todas as enquetes)
+    st.subheader("Métricas de Desempenho")
+    metricas = obter_metricas()
+    resumo = metricas.resumo()
+    if resumo:
+        st.dataframe(pd.DataFrame(resumo).round(3), hide_index=True)
+    else:
+        st.write("Nenhuma chamada medida ainda.")
+    col1, col2 = st.columns(2)
+    col1.download_button(
+        label="Baixar métricas (Prometheus)",
+        data=metricas.texto_prometheus(),
+        file_name="metricas.prom",
+        mime="text/plain",
+    )
+    if col2.button("Zerar Métricas"):
+        metricas.zerar()
+        st.rerun()
+
+    # Separador
+    st.markdown("---")
+
+    # Exibição da tabela de tokens, uma página por vez, com botão para baixar em Excel
     st.subheader("Visualização da Tabela de Tokens")
-    df_tokens = exibir_tokens()
-    st.dataframe(df_tokens)
-    
-    if st.button("Atualizar Tabela de Tokens"):
-        df_tokens = exibir_tokens()
-        st.dataframe(df_tokens)
-        st.success("Tabela de Tokens atualizada.")
-
-    st.download_button(
-        label="Baixar Tokens (Excel)",
-        data=converter_para_excel(df_tokens),
-        file_name="tokens.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    col1, col2 = st.columns(2)
+    situacao = col1.selectbox("Situação", list(SITUACOES_TOKEN), key='filtro_situacao_tokens')
+    prefixo_token = col2.text_input("Início do token", key='filtro_prefixo_tokens').strip()
+    exibir_tabela_paginada(
+        'pagina_tokens', ['token', 'usado_intencao', 'usado_rejeicao'],
+        lambda apos, limite: buscar_pagina_tokens(apos, situacao, prefixo_token, limite),
+        lambda: contar_tokens(situacao, prefixo_token),
+        (situacao, prefixo_token),
     )
 
+    exibir_exportacao('tokens', "Tokens")
+
     # Separador acima do botão de download
     st.markdown("---")
 
     # Botões para download dos votos
     st.subheader("Download de Votos")
 
-    df_intencao = exibir_tabela_intencao_votos()
-    df_rejeicao = exibir_tabela_rejeicao()
-
-    # Exibir tabelas de intenção de votos e rejeição com botões para atualizar
-    st.subheader("Visualização da Tabela de Intenção de Votos")
-    st.dataframe(df_intencao)
-    if st.button("Atualizar Tabela de Intenção de Votos"):
-        df_intencao = exibir_tabela_intencao_votos()
-        st.dataframe(df_intencao)
-        st.success("Tabela de Intenção de Votos atualizada.")
-
-    st.subheader("Visualização da Tabela de Rejeição")
-    st.dataframe(df_rejeicao)
-    if st.button("Atualizar Tabela de Rejeição"):
-        df_rejeicao = exibir_tabela_rejeicao()
-        st.dataframe(df_rejeicao)
-        st.success("Tabela de Rejeição atualizada.")
+    # Exibir tabelas de intenção de votos e rejeição, uma página por vez
+    for tipo, titulo in (('intencao', "Visualização da Tabela de Intenção de Votos"), ('rejeicao', "Visualização da Tabela de Rejeição")):
+        st.subheader(titulo)
+        col1, col2 = st.columns(2)
+        votados = dict(listar_candidatos_votados(tipo))
+        candidato = col1.selectbox("Candidato", [None] + list(votados), key=f'filtro_candidato_{tipo}',
+                                   format_func=lambda opcao, votados=votados: 'Todos' if opcao is None else votados[opcao])
+        prefixo_voto = col2.text_input("Início do token", key=f'filtro_prefixo_{tipo}').strip()
+        exibir_tabela_paginada(
+            f'pagina_{tipo}', ['id', 'candidato', 'token'],
+            lambda apos, limite, tipo=tipo, candidato=candidato, prefixo_voto=prefixo_voto:
+                buscar_pagina_votos(tipo, apos, candidato, prefixo_voto, limite),
+            lambda tipo=tipo, candidato=candidato, prefixo_voto=prefixo_voto: contar_votos(tipo, candidato, prefixo_voto),
+            (candidato, prefixo_voto),
+        )
 
     # Separador acima do botão de download
     st.markdown("---")
 
-    # Download de intenção de votos em Excel e CSV
-    st.download_button(
-        label="Baixar Intenção de Votos (Excel)",
-        data=converter_para_excel(df_intencao),
-        file_name="intencao_votos.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    # Download de intenção de votos e rejeição (Excel, CSV, CSV compactado ou Parquet)
+    exibir_exportacao('intencao_votos', "Intenção de Votos")
+    exibir_exportacao('rejeicao', "Rejeição")
 
-    st.download_button(
-        label="Baixar Intenção de Votos (CSV)",
-        data=converter_para_csv(df_intencao),
-        file_name="intencao_votos.csv",
-        mime="text/csv"
-    )
+    # Separador para a conferência do placar
+    st.markdown("---")
+
+    # Conferência do placar mantido a cada voto contra as tabelas de votos
+    st.subheader("Conferência do Placar")
+    if st.button("Verificar Placar"):
+        for tipo, nome in (('intencao', 'Intenção de Votos'), ('rejeicao', 'Rejeição')):
+            divergencias = verificar_placar(tipo)
+            if divergencias:
+                st.error(f"Placar de {nome} diverge dos votos registrados.")
+                st.dataframe(pd.DataFrame(divergencias, columns=['candidato', 'placar', 'votos reais']))
+            else:
+                st.success(f"Placar de {nome} confere com os votos registrados.")
+    if st.button("Reconstruir Placar"):
+        reconstruir_placar('intencao')
+        reconstruir_placar('rejeicao')
+        st.success("Placar reconstruído a partir dos votos registrados.")
+    if DIARIO_VOTOS and st.button("Conferir com o Diário"):
+        estado = totais_do_diario()
+        if estado['invalido'] is not None:
+            st.warning(f"Diário com registro corrompido na posição {estado['invalido']}; conferido só até ali.")
+        for tipo, nome in (('intencao', 'Intenção de Votos'), ('rejeicao', 'Rejeição')):
+            divergencias = conferir_placar_com_diario(tipo, estado)
+            if divergencias:
+                st.error(f"Placar de {nome} diverge do diário de votos.")
+                st.dataframe(pd.DataFrame(divergencias, columns=['candidato', 'placar', 'diário']))
+            else:
+                st.success(f"Placar de {nome} confere com o diário de votos.")
 
     # Separador para a opção de zerar banco de dados
     st.markdown("---")
 
+    # Zerar é começar uma nova rodada; os dados das rodadas antigas são apagados em segundo plano
+    rodadas = consultar_rodadas()
+    metricas_limpeza = obter_limpeza_rodadas().metricas()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Rodada dos tokens", rodadas['rodada_tokens'])
+    col2.metric("Rodada da intenção de voto", rodadas['rodada_intencao'])
+    col3.metric("Rodada da rejeição", rodadas['rodada_rejeicao'])
+    col4.metric("Votos antigos apagados", metricas_limpeza['linhas_apagadas'],
+                help="Limpeza em andamento" if metricas_limpeza['em_andamento'] else "Nenhuma limpeza em andamento")
+
     # Checkbox para zerar banco de dados
     if st.checkbox("Zerar banco de dados"):
         st.warning("Essa ação não pode ser desfeita. Selecione as opções abaixo para zerar:")
@@ -517,36 +3021,60 @@ def pagina_admin():
         if st.button("Zerar Tokens"):
             zerar_tokens()
             st.success("Todos os tokens foram zerados com sucesso.")
-            # Reexibir os tokens após zerar para verificar se deu certo
-            df_tokens = exibir_tokens()
-            st.dataframe(df_tokens)
 
         # Botão para zerar intenção de votos
         if st.button("Zerar Intenção de Votos"):
             zerar_intencao_votos()
             st.success("Todos os votos de intenção foram zerados com sucesso.")
-            df_intencao = exibir_tabela_intencao_votos()
-            st.dataframe(df_intencao)
         
         # Botão para zerar rejeição
         if st.button("Zerar Rejeição"):
             zerar_rejeicao()
             st.success("Todas as rejeições foram zeradas com sucesso.")
-            df_rejeicao = exibir_tabela_rejeicao()
-            st.dataframe(df_rejeicao)
 
     # Separador para a criação de tokens
     st.markdown("---")
 
     # Criação de tokens
     st.subheader("Criação de Tokens")
+
+    # Criação interrompida (ex.: conexão do navegador caiu no meio): permitir retomar
+    pendente = lote_tokens_pendente()
+    if pendente:
+        lote_id, solicitados, criados = pendente
+        st.warning(f"A criação de {solicitados} tokens foi interrompida em {criados}.")
+        if st.button("Retomar Criação de Tokens"):
+            barra = st.progress(criados / solicitados, text="Retomando criação de tokens...")
+            retomar_criacao_tokens(lote_id, lambda feitos, total: barra.progress(feitos / total, text=f"{feitos} de {total} tokens"))
+            st.success(f"Criação concluída: {solicitados} tokens.")
+
     quantidade_tokens = st.number_input("Quantos tokens deseja criar?", min_value=1, value=1000, step=1)
     if st.button("Criar Tokens"):
-        criar_tokens(quantidade_tokens)
+        barra = st.progress(0.0, text="Criando tokens...")
+        criar_tokens(quantidade_tokens, lambda feitos, total: barra.progress(feitos / total, text=f"{feitos} de {total} tokens"))
         st.success(f"{quantidade_tokens} tokens foram criados com sucesso!")
-        # Exibir os tokens após a criação
-        df_tokens = exibir_tokens()
-        st.dataframe(df_tokens)
+
+    # Separador para as enquetes
+    st.markdown("---")
+
+    # Enquetes servidas por este processo, cada uma com o seu banco
+    st.subheader("Enquetes")
+    st.dataframe(pd.DataFrame(listar_enquetes(), columns=COLUNAS_ENQUETE), hide_index=True)
+    if enquete['slug'] != ENQUETE_PADRAO:
+        st.write(f"Os links desta enquete precisam de `?enquete={enquete['slug']}&token=...`.")
+    with st.form(key='nova_enquete'):
+        st.write("Nova enquete")
+        slug = st.text_input("Identificador (usado na URL)").strip()
+        nome = st.text_input("Nome").strip()
+        pergunta_intencao = st.text_input("Pergunta de intenção de voto", value=PERGUNTA_INTENCAO_PADRAO)
+        pergunta_rejeicao = st.text_input("Pergunta de rejeição", value=PERGUNTA_REJEICAO_PADRAO)
+        if st.form_submit_button("Criar Enquete"):
+            try:
+                nova = criar_enquete(slug, nome or slug, pergunta_intencao, pergunta_rejeicao)
+            except ValueError as erro:
+                st.error(str(erro))
+            else:
+                st.success(f"Enquete criada. Administração: ?enquete={nova['slug']}&token=admin-Ro4143")
 
 
 
@@ -557,38 +3085,54 @@ def pagina_admin():
 def pagina_graficos():
     st.title("📊 Exibição de Gráficos")
 
-    # Criar as tabelas se ainda não existirem
-    criar_tabelas()
-
     # Carregar as configurações de gráficos
-    config = carregar_configuracoes()
-    if config:
-        exibir_real, candidato_favorecido = config
-    else:
+    # Os gráficos leem a configuração a cada atualização; aqui só confere se ela existe
+    if not carregar_configuracoes():
         st.error("Erro ao carregar as configurações.")
         return
 
     # Exibir o primeiro gráfico conforme a configuração atual
     st.subheader("Gráfico Atual (Configuração Atual)")
-    st.plotly_chart(gerar_grafico_intencao_voto(candidato_favorecido if not exibir_real else None))
-    st.plotly_chart(gerar_grafico_rejeicao(candidato_favorecido if not exibir_real else None))
+    exibir_graficos_ao_vivo(enquete_atual(), chave='graficos_atuais')
 
     st.markdown("---")  # Separador entre os gráficos
 
     # Exibir o gráfico real, independentemente da configuração
     st.subheader("Gráfico Real (Dados Reais)")
-    st.plotly_chart(gerar_grafico_intencao_voto(None))  # Gráfico real, sem ajustes
-    st.plotly_chart(gerar_grafico_rejeicao(None))  # Gráfico real, sem ajustes
+    exibir_graficos_ao_vivo(enquete_atual(), seguir_configuracao=False, chave='graficos_reais')  # Gráfico real, sem ajustes
+
+    st.markdown("---")
+
+    # Participação ao longo do tempo (dados reais), lida dos resumos por minuto/hora
+    st.subheader("Participação ao Longo do Tempo")
+    granularidade = st.radio("Agrupar votos por:", options=list(LINHAS_DO_TEMPO), index=1, horizontal=True)
+    exibir_linha_do_tempo_ao_vivo(enquete_atual(), granularidade)
 
 # =======================================
 # Código Principal para Selecionar a Página Correta
 # =======================================
 def main():
-    # Capturar token da URL
+    # Porta/arquivo de métricas, se configurados (uma única vez por processo)
+    iniciar_exportacao_metricas()
+
+    # Capturar enquete e token da URL
     query_params = st.query_params
+    slug = query_params.get('enquete', ENQUETE_PADRAO)
     token_url = query_params.get('token', None)
     token_url = token_url[0] if isinstance(token_url, list) else token_url
 
+    with avisar_pool_esgotado("Muitas pessoas acessando neste momento. Tente novamente em instantes."):
+        exibir_pagina(slug, token_url)
+
+# Função para exibir a página pedida na URL: administração, eleitor, gráficos ou resultados públicos
+def exibir_pagina(slug, token_url):
+    # Todas as funções de banco desta execução passam a usar o arquivo da enquete
+    enquete = buscar_enquete(slug)
+    if enquete is None:
+        st.error("Enquete não encontrada. Confira o link recebido.")
+        return
+    ENQUETE_ATUAL.set(enquete)
+
     # Validar o token
     pagina = validar_token(token_url)
 
@@ -600,10 +3144,12 @@ def main():
         pagina_graficos()
     else:
         st.warning("Você precisa de um link válido para participar.")
-        # Exibir gráficos como na página do usuário
-        st.plotly_chart(gerar_grafico_intencao_voto())
-        st.markdown("---")  # Separador entre os gráficos
-        st.plotly_chart(gerar_grafico_rejeicao())
+        # Exibir gráficos como na página do usuário, se o cliente não passou do limite de
+        # acessos (robôs e recargas seguidas da página pública não chegam ao banco)
+        if liberar_resultados_publicos():
+            exibir_graficos_ao_vivo(enquete_atual(), seguir_configuracao=False)
+        else:
+            st.info("Muitos acessos seguidos aos resultados. Aguarde alguns segundos e recarregue a página.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,319 @@
+# Diário dos votos: cópia só de acréscimo de cada voto aceito (e de cada troca de
+# rodada), gravada ao lado do banco da enquete, com instantâneos periódicos dos totais.
+#
+# Cada registro tem tamanho fixo (TAMANHO_REGISTRO bytes) e termina com um CRC32: um
+# registro cortado por uma queda no meio da escrita é reconhecido e descartado, e o
+# registro N está sempre na posição N * TAMANHO_REGISTRO. O instantâneo guarda os
+# totais da rodada atual até um certo registro; somando os registros seguintes (a
+# cauda) chega-se aos totais atuais sem abrir o SQLite. A leitura usa mmap e não
+# depende do Streamlit, então serve também para análises fora do app.
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos, só entre as threads do processo
+    fcntl = None
+
+
+# Registro: momento (Unix, segundos), candidato_id, rodada, rodada dos tokens, código do
+# registro, token (16 bytes do UUID) e o CRC32 dos bytes anteriores
+REGISTRO = struct.Struct('<qIIIB3x16s4xI')
+TAMANHO_REGISTRO = REGISTRO.size
+TAMANHO_CORPO = TAMANHO_REGISTRO - 4
+
+# Código de cada tipo de registro: um voto de cada tipo ou o início de uma nova rodada
+# de um contador (o campo rodada traz então o número da nova rodada)
+CODIGOS_REGISTRO = {
+    'intencao': 0,
+    'rejeicao': 1,
+    'rodada_tokens': 2,
+    'rodada_intencao': 3,
+    'rodada_rejeicao': 4,
+}
+NOMES_REGISTRO = {codigo: nome for nome, codigo in CODIGOS_REGISTRO.items()}
+
+# Contador de rodada dos votos de cada tipo
+CONTADORES_VOTO = {
+    'intencao': 'rodada_intencao',
+    'rejeicao': 'rodada_rejeicao',
+}
+
+# Registros acrescentados desde o último instantâneo que disparam um novo
+REGISTROS_POR_INSTANTANEO = 10000
+
+
+# Caminho do diário de uma enquete, ao lado do seu banco (enquete.db -> enquete.diario)
+def caminho_diario(caminho_banco):
+    return os.path.splitext(caminho_banco)[0] + '.diario'
+
+# Caminho do instantâneo de um diário (enquete.diario -> enquete.instantaneo.json)
+def caminho_instantaneo(caminho):
+    return os.path.splitext(caminho)[0] + '.instantaneo.json'
+
+
+def empacotar(momento, candidato_id, rodada, rodada_tokens, codigo, token):
+    corpo = REGISTRO.pack(momento, candidato_id, rodada, rodada_tokens, codigo, token, 0)[:TAMANHO_CORPO]
+    return corpo + struct.pack('<I', zlib.crc32(corpo))
+
+# Registro de um voto aceito; `token` são os 16 bytes do UUID
+def registro_de_voto(tipo, candidato_id, token, momento, rodada, rodada_tokens):
+    return empacotar(int(momento), candidato_id, rodada, rodada_tokens, CODIGOS_REGISTRO[tipo], token)
+
+# Registro do início de uma nova rodada de um contador
+def registro_de_rodada(contador, rodada, momento):
+    return empacotar(int(momento), 0, rodada, 0, CODIGOS_REGISTRO[contador], bytes(16))
+
+
+# Leitor do diário por mmap: só lê o arquivo, sem travar nada nem tocar no banco.
+# Enxerga os registros completos existentes ao abrir; um registro pela metade no fim
+# do arquivo (escrita em andamento ou queda) fica de fora.
+class LeitorDiario:
+    def __init__(self, caminho):
+        self._mapa = None
+        self.invalido = None
+        try:
+            self._arquivo = open(caminho, 'rb')
+        except FileNotFoundError:
+            self._arquivo = None
+            self.quantidade = 0
+            return
+        self.quantidade = os.fstat(self._arquivo.fileno()).st_size // TAMANHO_REGISTRO
+        if self.quantidade:
+            self._mapa = mmap.mmap(self._arquivo.fileno(), self.quantidade * TAMANHO_REGISTRO, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.quantidade
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *erro):
+        self.fechar()
+
+    # Arrays devolvidos por como_array() precisam ser descartados antes
+    def fechar(self):
+        if self._mapa is not None:
+            self._mapa.close()
+            self._mapa = None
+        if self._arquivo is not None:
+            self._arquivo.close()
+            self._arquivo = None
+
+    # CRC32 gravado no registro da posição informada
+    def crc(self, posicao):
+        return struct.unpack_from('<I', self._mapa, posicao * TAMANHO_REGISTRO + TAMANHO_CORPO)[0]
+
+    # Registros a partir da posição `inicio`, como tuplas
+    # (posição, momento, candidato_id, rodada, rodada_tokens, código, token).
+    # Para no primeiro registro com CRC errado; a posição dele fica em `self.invalido`.
+    def registros(self, inicio=0):
+        self.invalido = None
+        if self._mapa is None:
+            return
+        dados = memoryview(self._mapa)
+        try:
+            deslocamento = inicio * TAMANHO_REGISTRO
+            for posicao, campos in enumerate(REGISTRO.iter_unpack(dados[deslocamento:]), inicio):
+                if zlib.crc32(dados[deslocamento:deslocamento + TAMANHO_CORPO]) != campos[-1]:
+                    self.invalido = posicao
+                    return
+                yield (posicao,) + campos[:-1]
+                deslocamento += TAMANHO_REGISTRO
+        finally:
+            dados.release()
+
+    # Todos os registros como array estruturado do NumPy, sem cópia (lido do mmap sob
+    # demanda). Não confere os CRCs: para isso, percorra registros().
+    def como_array(self):
+        import numpy as np
+        tipo = np.dtype({
+            'names': ['momento', 'candidato_id', 'rodada', 'rodada_tokens', 'codigo', 'token', 'crc'],
+            'formats': ['<i8', '<u4', '<u4', '<u4', 'u1', 'V16', '<u4'],
+            'offsets': [0, 8, 12, 16, 20, 24, 44],
+            'itemsize': TAMANHO_REGISTRO,
+        })
+        if self._mapa is None:
+            return np.empty(0, dtype=tipo)
+        return np.frombuffer(self._mapa, dtype=tipo, count=self.quantidade)
+
+
+# Votos de um tipo (e, se informada, de uma rodada) de um array de como_array(), como
+# dicionário candidato_id -> votos; vetorizado, para diários com milhões de registros
+def contar_votos(registros, tipo, rodada=None):
+    import numpy as np
+    filtro = registros['codigo'] == CODIGOS_REGISTRO[tipo]
+    if rodada is not None:
+        filtro &= registros['rodada'] == rodada
+    candidatos, votos = np.unique(registros['candidato_id'][filtro], return_counts=True)
+    return dict(zip(candidatos.tolist(), votos.tolist()))
+
+
+# Estado dos totais: quantos registros já foram somados, o CRC do último (para notar
+# um diário trocado por outro), a maior rodada vista de cada contador (0 = nenhuma) e
+# os votos por (rodada, candidato_id) de cada tipo, só das rodadas atuais
+def estado_vazio():
+    return {
+        'registros': 0,
+        'crc_ultimo': None,
+        'rodadas': dict.fromkeys(('rodada_tokens', *CONTADORES_VOTO.values()), 0),
+        'placar': {tipo: {} for tipo in CONTADORES_VOTO},
+    }
+
+
+# Soma os registros do diário a partir do estado informado (o de um instantâneo, ou
+# do zero). Um estado que não bate com o diário (CRC do último registro diferente ou
+# diário menor) é descartado e a soma recomeça do início.
+def repetir(caminho, estado=None):
+    estado = estado or estado_vazio()
+    with LeitorDiario(caminho) as leitor:
+        fim = estado['registros']
+        if fim and (fim > len(leitor) or leitor.crc(fim - 1) != estado['crc_ultimo']):
+            estado = estado_vazio()
+        rodadas, placar = estado['rodadas'], estado['placar']
+        posicao = None
+        for posicao, _, candidato_id, rodada, rodada_tokens, codigo, _ in leitor.registros(estado['registros']):
+            nome = NOMES_REGISTRO.get(codigo)
+            if nome in CONTADORES_VOTO:
+                votos = placar[nome]
+                votos[rodada, candidato_id] = votos.get((rodada, candidato_id), 0) + 1
+                contador = CONTADORES_VOTO[nome]
+                if rodada > rodadas[contador]:
+                    rodadas[contador] = rodada
+                if rodada_tokens > rodadas['rodada_tokens']:
+                    rodadas['rodada_tokens'] = rodada_tokens
+            elif nome is not None:
+                rodadas[nome] = max(rodadas[nome], rodada)
+        if posicao is not None:
+            estado['registros'] = posicao + 1
+            estado['crc_ultimo'] = leitor.crc(posicao)
+        estado['invalido'] = leitor.invalido
+    # Um lote gravado antes de uma troca de rodada pode entrar no diário depois dela:
+    # por isso a soma é por rodada e só as antigas são descartadas no fim
+    for tipo, contador in CONTADORES_VOTO.items():
+        placar[tipo] = {chave: votos for chave, votos in placar[tipo].items() if chave[0] >= rodadas[contador]}
+    return estado
+
+# Votos da rodada atual de um tipo, como dicionário candidato_id -> votos
+def totais(estado, tipo):
+    rodada = estado['rodadas'][CONTADORES_VOTO[tipo]]
+    return {candidato_id: votos for (r, candidato_id), votos in estado['placar'][tipo].items() if r == rodada}
+
+
+# Último instantâneo do diário, ou None se não houver
+def ler_instantaneo(caminho):
+    try:
+        with open(caminho_instantaneo(caminho), encoding='utf-8') as arquivo:
+            dados = json.load(arquivo)
+    except FileNotFoundError:
+        return None
+    dados['placar'] = {tipo: {(rodada, candidato_id): votos for rodada, candidato_id, votos in linhas}
+                       for tipo, linhas in dados['placar'].items()}
+    return dados
+
+# Totais atuais: o último instantâneo mais a cauda do diário
+def totais_atuais(caminho):
+    return repetir(caminho, ler_instantaneo(caminho))
+
+# Grava um instantâneo com os totais atuais e devolve o estado gravado. O arquivo é
+# escrito ao lado e trocado de uma vez: quem lê nunca pega um instantâneo pela metade.
+def salvar_instantaneo(caminho):
+    estado = totais_atuais(caminho)
+    dados = dict(estado, placar={tipo: [[rodada, candidato_id, votos] for (rodada, candidato_id), votos in sorted(votos.items())]
+                                 for tipo, votos in estado['placar'].items()})
+    dados.pop('invalido', None)
+    destino = caminho_instantaneo(caminho)
+    descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(destino)), suffix='.tmp')
+    try:
+        with os.fdopen(descritor, 'w', encoding='utf-8') as arquivo:
+            json.dump(dados, arquivo)
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, destino)
+    except BaseException:
+        os.unlink(temporario)
+        raise
+    return estado
+
+
+# Gravador do diário. Cada chamada de acrescentar() é uma única escrita seguida de um
+# único fsync, então um lote inteiro de votos custa um fsync. O arquivo é aberto com
+# O_APPEND e, onde houver fcntl, travado durante a escrita: processos diferentes
+# servindo a mesma enquete acrescentam registros inteiros, sem se misturar.
+class Diario:
+    def __init__(self, caminho, registros_por_instantaneo=REGISTROS_POR_INSTANTANEO):
+        self.caminho = caminho
+        self.registros_por_instantaneo = registros_por_instantaneo
+        self._trava = threading.Lock()
+        self._pedido_instantaneo = threading.Event()
+        self.escritas = 0
+        self.registros = 0
+        self.instantaneos = 0
+        self.falhas_instantaneo = 0
+
+        self._descritor = os.open(caminho, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.total_registros = os.fstat(self._descritor).st_size // TAMANHO_REGISTRO
+        instantaneo = ler_instantaneo(caminho)
+        self.registros_no_instantaneo = instantaneo['registros'] if instantaneo else 0
+
+        self._thread = threading.Thread(target=self._executar, name='diario-instantaneos', daemon=True)
+        self._thread.start()
+        if self.total_registros - self.registros_no_instantaneo >= registros_por_instantaneo:
+            self._pedido_instantaneo.set()
+
+    # Acrescenta os registros (bytes de registro_de_voto/registro_de_rodada) e só volta
+    # depois do fsync
+    def acrescentar(self, registros):
+        dados = memoryview(b''.join(registros))
+        with self._trava:
+            if fcntl is not None:
+                fcntl.flock(self._descritor, fcntl.LOCK_EX)
+            try:
+                # Sobra de uma escrita interrompida por uma queda: nunca foi confirmada
+                # e desalinharia todos os registros seguintes
+                tamanho = os.fstat(self._descritor).st_size
+                if tamanho % TAMANHO_REGISTRO:
+                    os.ftruncate(self._descritor, tamanho - tamanho % TAMANHO_REGISTRO)
+                while dados:
+                    dados = dados[os.write(self._descritor, dados):]
+                os.fsync(self._descritor)
+                self.total_registros = os.fstat(self._descritor).st_size // TAMANHO_REGISTRO
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._descritor, fcntl.LOCK_UN)
+            self.escritas += 1
+            self.registros += len(registros)
+            if self.total_registros - self.registros_no_instantaneo >= self.registros_por_instantaneo:
+                self._pedido_instantaneo.set()
+
+    # Instantâneos em segundo plano: somar a cauda não atrasa a confirmação dos votos
+    def _executar(self):
+        while True:
+            self._pedido_instantaneo.wait()
+            self._pedido_instantaneo.clear()
+            try:
+                estado = salvar_instantaneo(self.caminho)
+            except OSError:
+                with self._trava:
+                    self.falhas_instantaneo += 1
+                continue
+            with self._trava:
+                self.instantaneos += 1
+                self.registros_no_instantaneo = estado['registros']
+
+    def metricas(self):
+        with self._trava:
+            return {
+                'escritas': self.escritas,
+                'registros': self.registros,
+                'total_registros': self.total_registros,
+                'instantaneos': self.instantaneos,
+                'falhas_instantaneo': self.falhas_instantaneo,
+                'registros_no_instantaneo': self.registros_no_instantaneo,
+            }
@@ -0,0 +1,81 @@
+# Intervalos de confiança dos resultados da enquete.
+#
+# Tudo é calculado direto dos totais por candidato (nunca dos votos um a um) e
+# vetorizado com NumPy: o custo depende só da quantidade de candidatos e de
+# reamostragens, não da quantidade de votos. Os quantis da normal vêm do
+# statistics.NormalDist, sem precisar importar o scipy.
+
+from statistics import NormalDist
+
+import numpy as np
+
+
+# Nível de confiança e reamostragens usados quando não informados
+CONFIANCA_PADRAO = 0.95
+REAMOSTRAGENS_PADRAO = 1000
+
+
+# Quantil bilateral da normal padrão; com `comparacoes` > 1 aplica a correção de
+# Bonferroni, usada pelos intervalos simultâneos
+def quantil_normal(confianca=CONFIANCA_PADRAO, comparacoes=1):
+    return NormalDist().inv_cdf(1 - (1 - confianca) / (2 * comparacoes))
+
+
+# Margem de erro máxima (proporção 50%) de uma amostra de `total` votos
+def margem_de_erro(total, confianca=CONFIANCA_PADRAO):
+    return quantil_normal(confianca) * 0.5 / np.sqrt(total) if total else float('nan')
+
+
+# Intervalo de Wilson de cada candidato, tratado isoladamente (binomial).
+# Devolve os arrays (inferior, superior) em proporção.
+def intervalos_wilson(votos, confianca=CONFIANCA_PADRAO):
+    votos = np.asarray(votos, dtype=float)
+    total = votos.sum()
+    z2 = quantil_normal(confianca) ** 2
+    proporcao = votos / total
+    denominador = 1 + z2 / total
+    centro = (proporcao + z2 / (2 * total)) / denominador
+    meia_largura = np.sqrt(proporcao * (1 - proporcao) / total + z2 / (4 * total * total)) * np.sqrt(z2) / denominador
+    return np.clip(centro - meia_largura, 0, 1), np.clip(centro + meia_largura, 0, 1)
+
+
+# Intervalos simultâneos de Goodman para a multinomial: valem juntos para todos os
+# candidatos com a confiança pedida. Devolve os arrays (inferior, superior).
+def intervalos_goodman(votos, confianca=CONFIANCA_PADRAO):
+    votos = np.asarray(votos, dtype=float)
+    total = votos.sum()
+    a = quantil_normal(confianca, comparacoes=len(votos)) ** 2  # qui-quadrado com 1 grau de liberdade
+    raiz = np.sqrt(a * (a + 4 * votos * (total - votos) / total))
+    denominador = 2 * (total + a)
+    return (a + 2 * votos - raiz) / denominador, (a + 2 * votos + raiz) / denominador
+
+
+# Intervalos por bootstrap: cada reamostragem sorteia os totais de uma vez com
+# multinomial(total, proporções), em vez de sortear os votos um a um.
+# A semente fixa faz o mesmo placar sempre dar o mesmo intervalo.
+def intervalos_bootstrap(votos, confianca=CONFIANCA_PADRAO, reamostragens=REAMOSTRAGENS_PADRAO, semente=0):
+    votos = np.asarray(votos, dtype=np.int64)
+    total = int(votos.sum())
+    sorteio = np.random.default_rng(semente)
+    amostras = sorteio.multinomial(total, votos / total, size=reamostragens) / total
+    cauda = (1 - confianca) / 2
+    inferior, superior = np.quantile(amostras, [cauda, 1 - cauda], axis=0)
+    return inferior, superior
+
+
+# Todas as estimativas de um placar, como linhas
+# (votos, proporção, wilson_inf, wilson_sup, goodman_inf, goodman_sup, bootstrap_inf, bootstrap_sup)
+# na ordem dos totais recebidos, e a margem de erro máxima
+def calcular_intervalos(votos, confianca=CONFIANCA_PADRAO, reamostragens=REAMOSTRAGENS_PADRAO):
+    votos = np.asarray(votos, dtype=np.int64)
+    total = int(votos.sum())
+    if not total:
+        return [], float('nan')
+    colunas = np.column_stack((
+        votos,
+        votos / total,
+        *intervalos_wilson(votos, confianca),
+        *intervalos_goodman(votos, confianca),
+        *intervalos_bootstrap(votos, confianca, reamostragens),
+    ))
+    return [(int(linha[0]),) + tuple(linha[1:]) for linha in colunas.tolist()], float(margem_de_erro(total, confianca))
@@ -0,0 +1,133 @@
+# Ferramentas de manutenção do banco da enquete, para rodar fora do Streamlit.
+#
+# Uso:
+#   python ferramentas.py verificar-placar [--banco enquete.db]
+#   python ferramentas.py reconstruir-placar [--banco enquete.db]
+#   python ferramentas.py preencher-linha-do-tempo [--banco enquete.db] [--momento "2024-10-01 18:00"]
+#   python ferramentas.py totais-do-diario [--banco enquete.db] [--aplicar]
+#   python ferramentas.py repetir-diario [--banco enquete.db]
+#   python ferramentas.py salvar-instantaneo [--banco enquete.db]
+
+import argparse
+import sys
+from datetime import datetime
+
+import diario
+
+
+# Importa c.py apontando para o banco informado
+def carregar_app(caminho_banco):
+    import c
+    c.CAMINHO_BANCO = caminho_banco
+    c.obter_pool()  # abre o banco e aplica as migrações
+    return c
+
+
+# Confere os dois placares; sai com código 1 se algum divergir
+def comando_verificar_placar(args):
+    c = carregar_app(args.banco)
+    ok = True
+    for tipo in c.TIPOS_VOTO:
+        divergencias = c.verificar_placar(tipo)
+        if not divergencias:
+            print(f'{tipo}: placar confere com os votos registrados')
+            continue
+        ok = False
+        print(f'{tipo}: {len(divergencias)} candidato(s) com divergência')
+        for candidato, no_placar, reais in divergencias:
+            print(f'  {candidato}: placar={no_placar} votos={reais}')
+    return 0 if ok else 1
+
+
+def comando_reconstruir_placar(args):
+    c = carregar_app(args.banco)
+    for tipo in c.TIPOS_VOTO:
+        c.reconstruir_placar(tipo)
+        print(f'{tipo}: placar reconstruído')
+    return 0
+
+
+# Dá horário aos votos antigos e refaz os resumos por minuto e por hora
+def comando_preencher_linha_do_tempo(args):
+    c = carregar_app(args.banco)
+    momento = None
+    if args.momento:
+        horario = datetime.fromisoformat(args.momento)
+        if horario.tzinfo is None:
+            horario = horario.replace(tzinfo=c.FUSO_HORARIO)
+        momento = horario.timestamp()
+    for tipo, quantidade in c.preencher_linha_do_tempo(momento).items():
+        print(f'{tipo}: {quantidade} voto(s) sem horário preenchido(s); resumos refeitos')
+    return 0
+
+
+# Totais da rodada atual pelo diário (último instantâneo mais a cauda), comparados com o
+# placar do banco; com --aplicar, o placar passa a ser o do diário. Sai com código 1 se
+# algum divergir (antes de aplicar).
+def comando_totais_do_diario(args):
+    c = carregar_app(args.banco)
+    estado = c.totais_do_diario()
+    print(f"diário: {estado['registros']} registro(s); rodadas: "
+          + ', '.join(f'{contador}={rodada}' for contador, rodada in estado['rodadas'].items()))
+    if estado['invalido'] is not None:
+        print(f"aviso: registro corrompido na posição {estado['invalido']}; somado só até ali")
+    ok = True
+    for tipo in c.TIPOS_VOTO:
+        divergencias = c.conferir_placar_com_diario(tipo, estado)
+        if args.aplicar:
+            c.aplicar_placar_do_diario(tipo, estado)
+        if not divergencias:
+            print(f'{tipo}: placar confere com o diário')
+            continue
+        ok = False
+        print(f"{tipo}: {len(divergencias)} candidato(s) com divergência{' (placar trocado pelo do diário)' if args.aplicar else ''}")
+        for candidato, no_placar, no_diario in divergencias:
+            print(f'  {candidato}: placar={no_placar} diário={no_diario}')
+    return 0 if ok else 1
+
+
+# Regrava no banco os votos do diário que faltam nele (depois de restaurar um backup)
+def comando_repetir_diario(args):
+    c = carregar_app(args.banco)
+    for tipo, (regravados, presentes, recusados) in c.repetir_diario().items():
+        print(f'{tipo}: {regravados} voto(s) regravado(s), {presentes} já no banco, {recusados} recusado(s)')
+    return 0
+
+
+def comando_salvar_instantaneo(args):
+    estado = diario.salvar_instantaneo(diario.caminho_diario(args.banco))
+    print(f"instantâneo salvo com {estado['registros']} registro(s)")
+    if estado['invalido'] is not None:
+        print(f"aviso: registro corrompido na posição {estado['invalido']}; o instantâneo para ali")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ferramentas de manutenção da enquete')
+    parser.add_argument('--banco', default='enquete.db', help='Arquivo SQLite da enquete')
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    comandos.add_parser('verificar-placar', help='Compara o placar com a contagem dos votos').set_defaults(
+        funcao=comando_verificar_placar)
+    comandos.add_parser('reconstruir-placar', help='Refaz o placar a partir dos votos').set_defaults(
+        funcao=comando_reconstruir_placar)
+    preencher = comandos.add_parser('preencher-linha-do-tempo',
+                                    help='Dá horário aos votos antigos e refaz os resumos da linha do tempo')
+    preencher.add_argument('--momento', help='Horário dado aos votos sem horário (ISO, fuso da enquete; padrão: agora)')
+    preencher.set_defaults(funcao=comando_preencher_linha_do_tempo)
+    totais = comandos.add_parser('totais-do-diario',
+                                 help='Soma o diário (instantâneo + cauda) e compara com o placar')
+    totais.add_argument('--aplicar', action='store_true', help='Troca o placar da rodada atual pelo do diário')
+    totais.set_defaults(funcao=comando_totais_do_diario)
+    comandos.add_parser('repetir-diario', help='Regrava no banco os votos do diário que faltam nele').set_defaults(
+        funcao=comando_repetir_diario)
+    comandos.add_parser('salvar-instantaneo', help='Grava agora um instantâneo dos totais do diário').set_defaults(
+        funcao=comando_salvar_instantaneo)
+
+    args = parser.parse_args()
+    sys.exit(args.funcao(args))
+
+
+if __name__ == '__main__':
+    main()